@@ -0,0 +1,6 @@
+# Benchmarks that need no nec engine: fake_engine stands in for nec2,
+# throughput (python -m nec.bench) measures the evaluation rate of the
+# optimizer on synthetic models and convergence (python -m
+# nec.bench.convergence) the evaluations the optimizers need to reach a score.
+# logcheck (python -m nec.bench.logcheck) checks that the text and the binary
+# log of a parallel run give the same population.
@@ -0,0 +1,3 @@
+from nec.bench.throughput import main
+
+main()
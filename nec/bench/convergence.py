@@ -0,0 +1,243 @@
+from __future__ import division
+import sys, math, random, json
+from nec.print_out import printOut
+from nec.bench import fake_engine
+
+# Convergence benchmarks, python -m nec.bench.convergence. The cost of an
+# optimization is the number of engine runs, so every optimizer is run on a
+# set of test problems for many seeds with the same evaluation budget and
+# reported by
+#   success   the runs reaching the target score within the budget
+#   evals     the median evaluations of the successful runs to reach the target
+#   best@N    the median best score after N evaluations, N in --checkpoints
+# The problems are analytic functions (sphereN, rosenbrockN, rastriginN, N is
+# the dimension) and yagiN, the N element yagi of the fake engine's model
+# scored like nec.opt's default target function, max(max_gain_diff,
+# max_swr_diff), without running an engine. Every optimizer gets the same
+# seeds, so two versions of an optimizer can be compared run by run.
+
+class BudgetExhausted(Exception):
+	pass
+
+class Problem:
+	"""The evaluator interface of the optimizers around a test function. Counts the
+	evaluations, records the best score after each of them and raises BudgetExhausted
+	once the budget is spent."""
+	def __init__(self, name, n, domain, target):
+		self.name = name
+		self.n = n
+		self.domain = domain
+		self.target_score = target
+		self.enforce_domain_limits = True
+		self.x = None
+		self.reset(0)
+
+	def reset(self, budget):
+		self.budget = budget
+		self.evaluations = 0
+		self.best = None
+		#(evaluations, best score) at every improvement
+		self.trace = []
+		self.reached = None
+		self.x = [random.uniform(d[0], d[1]) for d in self.domain]
+
+	def function(self, vector):
+		raise NotImplementedError
+
+	def target(self, vector, id=None):
+		if self.evaluations >= self.budget:
+			raise BudgetExhausted()
+		s = self.function(vector)
+		self.evaluations += 1
+		if self.best is None or s < self.best:
+			self.best = s
+			self.trace.append((self.evaluations, s))
+			if self.reached is None and s <= self.target_score:
+				self.reached = self.evaluations
+		return s
+
+	def testMemberAgainstScore(self, vector, score, id):
+		s = self.target(vector, id)
+		if s <= float(score):
+			return s
+		return None
+
+	def initialPopulation(self):
+		return [], []
+
+	def print_status(self, minv, meanv, vector, count, improved):
+		pass
+
+	def iterationCallback(self, iter_no, population, scores, improved):
+		pass
+
+	def bestAt(self, evaluations):
+		best = None
+		for e, s in self.trace:
+			if e > evaluations: break
+			best = s
+		return best
+
+
+class Sphere(Problem):
+	def __init__(self, n):
+		Problem.__init__(self, "sphere%d"%n, n, n*[(-5.0, 5.0)], 1e-4)
+	def function(self, x):
+		return sum(t*t for t in x)
+
+class Rosenbrock(Problem):
+	def __init__(self, n):
+		Problem.__init__(self, "rosenbrock%d"%n, n, n*[(-2.048, 2.048)], 1e-2)
+	def function(self, x):
+		return sum(100*(x[i+1]-x[i]*x[i])**2+(1-x[i])**2 for i in range(len(x)-1))
+
+class Rastrigin(Problem):
+	def __init__(self, n):
+		Problem.__init__(self, "rastrigin%d"%n, n, n*[(-5.12, 5.12)], 1.0)
+	def function(self, x):
+		return 10*len(x)+sum(t*t-10*math.cos(2*math.pi*t) for t in x)
+
+class YagiSurrogate(Problem):
+	"""The element half lengths and spacings of a yagi (nec.bench.throughput.yagiModel)
+	scored with the analytic model of the fake engine from 470 to 530 MHz, with a target
+	gain just below the model's best and a target SWR of 2. The SWR is relative to
+	the model's resistance of a resonant driven element at a quarter wave spacing."""
+	FREQUENCIES = [470+6*i for i in range(11)]
+	def __init__(self, elements):
+		self.elements = elements
+		#a little below the best gain the model allows at SWR 2, from 3 to 16 elements
+		l = math.log10(elements)
+		self.target_gain = 19.5*l-3.7*l*l-2.5
+		self.z0 = 73.0*1.4/(1+.1*(elements-1))
+		domain = [(.15, .18), (.12, .17)]+(elements-2)*[(.12, .155)]
+		domain += [(.07, .15)]+(elements-2)*[(.08, .2)]
+		Problem.__init__(self, "yagi%d"%elements, len(domain), domain, 0.0)
+
+	def function(self, vector):
+		e = self.elements
+		wires = []
+		x = .0
+		for i in range(e):
+			if i: x += vector[e+i-1]
+			l = vector[i]
+			wires.append((i+1, 11, [x, -l, 0, x, l, 0], .002))
+		model = fake_engine.Model(wires, (2, 6), 0, 1.0)
+		gain_diff = swr_diff = -1000.0
+		for f in self.FREQUENCIES:
+			real, imag = model.impedance(f)
+			g = abs(complex(real-self.z0, imag)/complex(real+self.z0, imag))
+			net = model.gain(f)+10*math.log10(max(1-g*g, 1e-12))
+			gain_diff = max(gain_diff, self.target_gain-net)
+			swr_diff = max(swr_diff, (1+g)/max(1-g, 1e-12)-2)
+		return max(gain_diff, swr_diff)
+
+PROBLEMS = {"sphere":Sphere, "rosenbrock":Rosenbrock, "rastrigin":Rastrigin, "yagi":YagiSurrogate}
+
+def problem(name):
+	for kind in PROBLEMS:
+		if name.startswith(kind) and name[len(kind):].isdigit():
+			return PROBLEMS[kind](int(name[len(kind):]))
+	raise ValueError("unknown problem %s, expected one of %s followed by the size"%(name, ", ".join(sorted(PROBLEMS))))
+
+
+def runOptimizer(name, evaluator, options):
+	from nec import differential_evolution as DE
+	budget = evaluator.budget
+	np = options.de_np
+	if name == "de":
+		DE.differential_evolution_optimizer(evaluator, population_size=np, f=options.de_f, cr=options.de_cr, max_iter=budget).run()
+	elif name == "de-dither":
+		DE.differential_evolution_optimizer(evaluator, population_size=np, f=options.de_f, cr=options.de_cr, max_iter=budget, dither=options.de_dither or .3).run()
+	elif name == "de-desqi":
+		DE.differential_evolution_optimizer(evaluator, population_size=np, f=options.de_f, cr=options.de_cr, max_iter=budget, plugin=DE.DESQIPlugin()).run()
+	elif name == "de-simplex":
+		DE.differential_evolution_optimizer(evaluator, population_size=np, f=options.de_f, cr=options.de_cr, max_iter=budget, plugin=DE.SimplexPlugin()).run()
+	elif name == "shade":
+		DE.shade_optimizer(evaluator, population_size=np, max_evaluations=budget, max_iter=budget).run()
+	elif name == "cmaes":
+		from nec.cmaes import cmaes_optimizer
+		cmaes_optimizer(evaluator, max_iter=budget, max_evaluations=budget).run()
+	elif name == "simplex":
+		from nec import simplex
+		simplex.fmin(evaluator, xtol=1e-8, ftol=1e-8, maxfun=budget, disp=0)
+	elif name == "mads":
+		from nec import pattern_search
+		pattern_search.mads(evaluator, xtol=1e-8, maxfun=budget, disp=0)
+	else:
+		raise ValueError("unknown optimizer %s"%name)
+
+OPTIMIZERS = ("de", "de-dither", "de-desqi", "de-simplex", "shade", "cmaes", "simplex", "mads")
+
+def median(values):
+	values = sorted(values)
+	if not values: return None
+	m = len(values)//2
+	if len(values) % 2: return values[m]
+	return (values[m-1]+values[m])/2
+
+def benchmark(evaluator, optimizer, options, checkpoints):
+	runs = []
+	for seed in range(options.seeds):
+		random.seed(seed)
+		evaluator.reset(options.budget)
+		try:
+			runOptimizer(optimizer, evaluator, options)
+		except BudgetExhausted:
+			pass
+		runs.append({"seed":seed, "evaluations":evaluator.evaluations, "reached":evaluator.reached, "best":evaluator.best, "best_at":[evaluator.bestAt(c) for c in checkpoints]})
+	reached = [r["reached"] for r in runs if r["reached"] is not None]
+	result = {"problem":evaluator.name, "optimizer":optimizer, "target":evaluator.target_score, "success":len(reached)/len(runs), "evaluations_to_target":median(reached), "runs":runs}
+	result["best_at"] = [median([r["best_at"][i] for r in runs if r["best_at"][i] is not None]) for i in range(len(checkpoints))]
+	return result
+
+
+def formatScore(s):
+	if s is None: return "-"
+	return "%.4g"%s
+
+def optionParser():
+	import optparse
+	parser = optparse.OptionParser(usage="%prog [options]", description="Runs the optimizers on test problems for many seeds and reports the evaluations to reach the target score and the best score versus the evaluation budget.")
+	parser.add_option("-p", "--problems", default="sphere5,rosenbrock5,rastrigin5,yagi6,yagi10", help="comma separated problems: sphereN, rosenbrockN, rastriginN (N dimensions) and yagiN (the fake engine's N element yagi). The default is %default")
+	parser.add_option("-O", "--optimizers", default=",".join(OPTIMIZERS), help="comma separated optimizers. The default is %default")
+	parser.add_option("-b", "--budget", default=3000, type="int", help="evaluations per run. The default is %default")
+	parser.add_option("-s", "--seeds", default=10, type="int", help="runs per problem and optimizer, seeded 0 to SEEDS-1. The default is %default")
+	parser.add_option("-c", "--checkpoints", default="", help="comma separated evaluation counts the best score is reported at. By default a tenth, a quarter, half and all of the budget")
+	parser.add_option("-t", "--target", default=[], action="append", metavar="PROBLEM=SCORE", help="the target score of a problem, e.g. yagi6=-3. By default 1e-4 for sphere, 1e-2 for rosenbrock, 1 for rastrigin and 0 for yagi")
+	parser.add_option("--de-np", default=50, type="int", help="the population size of the DE optimizers. The default is %default")
+	parser.add_option("--de-f", default=.8, type="float", help="The default is %default")
+	parser.add_option("--de-cr", default=.9, type="float", help="The default is %default")
+	parser.add_option("--de-dither", default=.3, type="float", help="the dither of de-dither. The default is %default")
+	parser.add_option("--json", default="", metavar="FILE", help="also write the results, including every run, to FILE as JSON")
+	return parser
+
+def main():
+	options, args = optionParser().parse_args()
+	if options.checkpoints:
+		checkpoints = [int(c) for c in options.checkpoints.replace(",", " ").split()]
+	else:
+		checkpoints = [options.budget//10, options.budget//4, options.budget//2, options.budget]
+	targets = {}
+	for t in options.target:
+		name, score = t.split("=")
+		targets[name.strip()] = float(score)
+	results = []
+	printOut("%-14s %-11s %8s %8s %8s "%("problem", "optimizer", "target", "success", "evals")+" ".join("%10s"%("best@%d"%c) for c in checkpoints))
+	for name in options.problems.replace(",", " ").split():
+		evaluator = problem(name)
+		if name in targets:
+			evaluator.target_score = targets[name]
+		for optimizer in options.optimizers.replace(",", " ").split():
+			r = benchmark(evaluator, optimizer, options, checkpoints)
+			results.append(r)
+			evals = "-" if r["evaluations_to_target"] is None else "%.0f"%r["evaluations_to_target"]
+			printOut("%-14s %-11s %8s %7.0f%% %8s "%(name, optimizer, formatScore(r["target"]), 100*r["success"], evals)+" ".join("%10s"%formatScore(b) for b in r["best_at"]))
+			sys.stdout.flush()
+	if options.json:
+		f = open(options.json, "wt")
+		try:
+			json.dump({"budget":options.budget, "seeds":options.seeds, "checkpoints":checkpoints, "results":results}, f, indent=1)
+		finally: f.close()
+
+if __name__ == "__main__":
+	main()
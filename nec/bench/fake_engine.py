@@ -0,0 +1,219 @@
+from __future__ import division
+import sys, os, math, time, stat
+
+# Stand-in for a nec2 engine used for benchmarking (nec.bench). It reads a
+# deck, derives the impedance and the pattern from a cheap analytic model of
+# the wires and writes an output file close enough to nec2's for
+# NecOutputParser and parseAgt: the antenna input parameters, the power budget,
+# the radiation patterns and the average power gain of the RP cards asking for
+# it. It takes the same arguments as the real engines:
+#   python -m nec.bench.fake_engine DECK OUTPUT
+#   python -m nec.bench.fake_engine -i DECK -o OUTPUT
+#   python -m nec.bench.fake_engine < file with the deck and the output on two lines
+# Every run sleeps NEC_FAKE_ENGINE_LATENCY seconds (0 by default) to stand in
+# for the solver. writeLauncher makes an executable for --engine.
+
+LATENCY_VARIABLE = "NEC_FAKE_ENGINE_LATENCY"
+
+def parseDeck(lines):
+	wires = []
+	ex = None
+	runs = []
+	fr = []
+	pending = 0
+	ground = 0
+	scale = 1.0
+	for ln in lines:
+		sl = ln.replace(',', ' ').split()
+		if not sl: continue
+		card = sl[0].upper()
+		try:
+			if card == "GW":
+				wires.append((int(sl[1]), int(sl[2]), [float(x) for x in sl[3:9]], float(sl[9])))
+			elif card == "GS":
+				scale = float(sl[3])
+			elif card == "GN":
+				ground = sl[1] != "-1"
+			elif card == "EX":
+				ex = (int(sl[2]), int(sl[3]))
+			elif card == "FR":
+				count = max(1, int(sl[2]))
+				start = float(sl[5])
+				step = float(sl[6]) if len(sl) > 6 else 0
+				fr = [start+i*step for i in range(count)]
+				pending = 1
+			elif card == "RP":
+				runs.append((list(fr), [float(x) for x in sl[1:]] ))
+				pending = 0
+			elif card == "PQ" or card == "PT":
+				pass
+			elif card == "XQ":
+				if pending:
+					runs.append((list(fr), None))
+					pending = 0
+			elif card == "EN":
+				break
+		except (ValueError, IndexError):
+			raise SystemExit("fake engine: invalid card %s"%ln)
+	return wires, ex, runs, ground, scale
+
+class Model:
+	def __init__(self, wires, ex, ground, scale):
+		self.elements = []
+		for tag, segs, c, r in wires:
+			length = scale*math.sqrt((c[0]-c[3])**2+(c[1]-c[4])**2+(c[2]-c[5])**2)
+			pos = scale*(c[0]+c[3])/2
+			self.elements.append((tag, length, pos))
+		self.driven = None
+		if ex:
+			for e in self.elements:
+				if e[0] == ex[0]: self.driven = e
+		if self.driven is None and self.elements:
+			self.driven = self.elements[0]
+		self.ground = ground
+
+	def impedance(self, freq):
+		if not self.driven: return (50.0, 0.0)
+		f0 = 142.5/max(self.driven[1], 1e-3)
+		x = freq/f0
+		n = len(self.elements)
+		#the closer the parasitic elements, the lower the feed point resistance
+		nearest = min([abs(e[2]-self.driven[2]) for e in self.elements if e is not self.driven] or [1.0])*freq/300.0
+		real = 73.0*x*x/(1+.1*(n-1))*(.4+4*min(nearest, .25)) + 5*math.sin(3*x)
+		imag = 42.5 + 420.0*(x-1) - 30*(n-1)*(x-1)*(x-1) - 150*(nearest-.15)
+		return (max(real, .5), imag)
+
+	def gain(self, freq):
+		n = len(self.elements)
+		if not n: return 0.0
+		wl = 300.0/freq
+		order = sorted(self.elements, key=lambda e: e[2])
+		boom = (order[-1][2]-order[0][2])/wl
+		g = 2.15 + 10*math.log10(1+1.6*boom*n/(1+.1*n))
+		director = 0
+		for i in range(n):
+			tag, length, pos = order[i]
+			spacing = (pos-order[i-1][2])/wl if i else .2
+			if self.driven and tag == self.driven[0]:
+				best = .47
+			elif self.driven and pos < self.driven[2]:
+				best = .51
+			else:
+				#the directors taper along the boom and their best length follows their spacing
+				best = .45-.008*director+.15*(spacing-.2)
+				director += 1
+			d = length/wl - best
+			g -= 40*d*d
+			if i: g -= 30*(spacing-.2)**2
+		return g + (3 if self.ground else 0)
+
+	def pattern(self, freq, phi, theta):
+		g = self.gain(freq)
+		n = len(self.elements)
+		k = 1+.6*n
+		c = (1+math.cos(math.radians(phi)))/2
+		s = math.sin(math.radians(theta))
+		v = max(c**k*abs(s), 1e-6) + .02/(n+1)
+		return g + 10*math.log10(v)
+
+def writeRun(out, model, freqs, rp):
+	for freq in freqs:
+		real, imag = model.impedance(freq)
+		out.append("")
+		out.append("                                --------- FREQUENCY --------")
+		out.append("                                FREQUENCY : %11.4E MHZ"%freq)
+		out.append("                                WAVELENGTH: %11.4E METERS"%(299.8/freq))
+		out.append("")
+		out.append("                                  --------- ANTENNA INPUT PARAMETERS ---------")
+		out.append("")
+		out.append("  TAG   SEG.    VOLTAGE (VOLTS)         CURRENT (AMPS)         IMPEDANCE (OHMS)        ADMITTANCE (MHOS)     POWER")
+		out.append("  NO.   NO.     REAL      IMAG.        REAL      IMAG.        REAL      IMAG.        REAL      IMAG.       (WATTS)")
+		z2 = real*real+imag*imag
+		cr, ci = real/z2, -imag/z2
+		out.append(" %4d %5d %11.4E %11.4E %11.4E %11.4E %11.4E %11.4E %11.4E %11.4E %11.4E"%(model.driven[0] if model.driven else 1, 1, 1.0, 0.0, cr, ci, real, imag, cr, ci, cr/2))
+		out.append("")
+		out.append("                               ---------- POWER BUDGET ---------")
+		out.append("                               INPUT POWER   = %11.4E WATTS"%(cr/2))
+		out.append("                               RADIATED POWER= %11.4E WATTS"%(cr/2))
+		out.append("                               STRUCTURE LOSS= %11.4E WATTS"%0)
+		out.append("                               NETWORK LOSS  = %11.4E WATTS"%0)
+		out.append("                               EFFICIENCY    =  100.00 PERCENT")
+		out.append("")
+		if not rp: continue
+		ntheta, nphi, xnda = int(rp[1]), int(rp[2]), int(rp[3])
+		theta0, phi0 = rp[4], rp[5]
+		dtheta = rp[6] if len(rp) > 6 else 0
+		dphi = rp[7] if len(rp) > 7 else 0
+		out.append("                               ---------- RADIATION PATTERNS -----------")
+		out.append("")
+		out.append("  ---- ANGLES -----     - POWER GAINS -       ---- POLARIZATION ----   ---- E(THETA) ----    ----- E(PHI) ------")
+		out.append("  THETA     PHI       VERT.   HOR.    TOTAL       AXIAL      TILT  SENSE   MAGNITUDE    PHASE    MAGNITUDE     PHASE")
+		out.append(" DEGREES   DEGREES     DB       DB       DB        RATIO   DEG.            VOLTS/M   DEGREES    VOLTS/M   DEGREES")
+		total = .0
+		for i in range(ntheta):
+			theta = theta0+i*dtheta
+			for j in range(nphi):
+				phi = phi0+j*dphi
+				g = model.pattern(freq, phi, theta)
+				total += math.pow(10, g/10)*abs(math.sin(math.radians(theta)))
+				out.append(" %7.2f %9.2f %9.2f %7.2f %7.2f %10.5f %8.2f %7s %11.4E %8.2f %11.4E %8.2f"%(theta, phi, -999.99, g, g, 0, 90, "LINEAR", 0, 0, 1e-3, 0))
+		out.append("")
+		if xnda % 10 == 1:
+			count = max(1, ntheta*nphi)
+			agt = max(total/count*1.6, 1e-3)
+			out.append("   AVERAGE POWER GAIN= %11.4E       SOLID ANGLE USED IN AVERAGING=(  2.0000)*PI STERADIANS."%agt)
+			out.append("")
+
+def run(deck_file, output_file, latency=None):
+	with open(deck_file, "rt") as f:
+		lines = f.readlines()
+	wires, ex, runs, ground, scale = parseDeck(lines)
+	model = Model(wires, ex, ground, scale)
+	out = ["", "                               NUMERICAL ELECTROMAGNETICS CODE (fake engine)", ""]
+	for freqs, rp in runs:
+		writeRun(out, model, freqs, rp)
+	out.append("")
+	out.append("  RUN TIME =     0.000")
+	if latency is None:
+		latency = float(os.environ.get(LATENCY_VARIABLE, "0") or 0)
+	if latency > 0:
+		time.sleep(latency)
+	with open(output_file, "wt") as f:
+		f.write("\n".join(out)+"\n")
+
+def writeLauncher(directory, latency=0):
+	"""Writes an executable running the fake engine with the given latency to directory
+	and returns its path, to be used as --engine."""
+	path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	if os.name == "nt":
+		launcher = os.path.join(directory, "fake_nec.bat")
+		f = open(launcher, "wt")
+		try:
+			f.write("@set PYTHONPATH=%s;%%PYTHONPATH%%\n"%path)
+			f.write("@set %s=%g\n"%(LATENCY_VARIABLE, latency))
+			f.write("@\"%s\" -m nec.bench.fake_engine %%*\n"%sys.executable)
+		finally: f.close()
+		return launcher
+	launcher = os.path.join(directory, "fake_nec")
+	f = open(launcher, "wt")
+	try:
+		f.write("#!/bin/sh\n")
+		f.write("PYTHONPATH='%s'${PYTHONPATH:+:$PYTHONPATH} %s=%g exec '%s' -m nec.bench.fake_engine \"$@\"\n"%(path, LATENCY_VARIABLE, latency, sys.executable))
+	finally: f.close()
+	os.chmod(launcher, os.stat(launcher).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+	return launcher
+
+def main(argv=None):
+	if argv is None: argv = sys.argv[1:]
+	args = [a for a in argv]
+	if "-i" in args and "-o" in args:
+		run(args[args.index("-i")+1], args[args.index("-o")+1])
+	elif len(args) >= 2:
+		run(args[0], args[1])
+	else:
+		deck = sys.stdin.readline().strip()
+		output = sys.stdin.readline().strip()
+		run(deck, output)
+
+if __name__ == "__main__":
+	main()
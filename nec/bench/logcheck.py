@@ -0,0 +1,89 @@
+from __future__ import division
+import os, sys, shutil, tempfile, subprocess
+from nec.print_out import printOut
+from nec.bench import fake_engine
+from nec.bench.throughput import yagiModel
+
+# Log consistency check, python -m nec.bench.logcheck [options] [-- nec.opt options].
+# Runs an optimization of a yagi with the fake engine, by default with
+# --parallel-evaluations 4, writing the text log and a binary log, and checks
+# that extract_last_population reads the same population from both. The text
+# log readers take line i of a generation for member i, so the concurrent
+# evaluations must log in member order. The values are compared to the
+# precision of the text log.
+
+TOLERANCE = 2e-7
+
+def extract(filename):
+	from nec.extract_last_population import parseLogFile
+	#the progress lines are not needed
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, "wt")
+	try:
+		return parseLogFile(filename, 0, -1, 0)
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+def compare(text, binary):
+	"""Returns the differences of two extracted populations, an empty list if they agree."""
+	if not text or not binary:
+		return ["no population in the %s log"%("text" if not text else "binary")]
+	differences = []
+	if list(text[0]) != list(binary[0]):
+		differences.append("columns %s and %s"%(" ".join(text[0]), " ".join(binary[0])))
+	if len(text[1]) != len(binary[1]):
+		differences.append("%d and %d members"%(len(text[1]), len(binary[1])))
+	for i in range(min(len(text[1]), len(binary[1]))):
+		values = [text[1][i]]+list(text[2][i])
+		others = [binary[1][i]]+list(binary[2][i])
+		if len(values) != len(others) or [1 for k in range(len(values)) if abs(values[k]-others[k]) > TOLERANCE*max(1, abs(others[k]))]:
+			differences.append("member %d: %s and %s"%(i, " ".join("%.7f"%v for v in values), " ".join("%.7f"%v for v in others)))
+	return differences
+
+def optionParser():
+	import optparse
+	parser = optparse.OptionParser(usage="%prog [options] [-- nec.opt options]", description="Checks that the text and the binary log of a fake engine optimization give the same population.")
+	parser.add_option("-e", "--elements", default=4, type="int", help="elements of the yagi. The default is %default")
+	parser.add_option("-p", "--population", default=12, type="int", help="the DE population size. The default is %default")
+	parser.add_option("-g", "--generations", default=4, type="int", help="DE generations. The default is %default")
+	parser.add_option("-j", "--parallel-evaluations", default=4, type="int", help="evaluations run concurrently. The default is %default")
+	parser.add_option("-o", "--output-dir", dest="output", default="", metavar="DIR", help="scratch directory, kept when given. By default a temporary directory is used and removed")
+	return parser
+
+def main():
+	options, args = optionParser().parse_args()
+	temporary = not options.output
+	if temporary:
+		options.output = tempfile.mkdtemp(prefix="nec_logcheck_")
+	else:
+		options.output = os.path.abspath(options.output)
+		try:
+			os.makedirs(options.output)
+		except OSError: pass
+	try:
+		engine = fake_engine.writeLauncher(options.output)
+		model = os.path.join(options.output, "logcheck.nec")
+		f = open(model, "wt")
+		try: f.write(yagiModel(options.elements))
+		finally: f.close()
+		for f in (model+".opt_log", model+".blog", model+".blog.idx"):
+			if os.path.exists(f): os.remove(f)
+		opt_args = ["-e", engine, "-o", os.path.join(options.output, "output"), "-s", "(470,6,11)", "--quiet", "--de-np", str(options.population), "-M", str(options.generations), "--parallel-evaluations", str(options.parallel_evaluations), "--binary-log", model+".blog", "--log-file", model+".opt_log"]
+		path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+		env = dict(os.environ)
+		env["PYTHONPATH"] = path+os.pathsep+env["PYTHONPATH"] if env.get("PYTHONPATH") else path
+		subprocess.check_call([sys.executable, "-m", "nec.opt"]+opt_args+args+[model], cwd=options.output, env=env, stdout=open(os.devnull, "w"))
+		differences = compare(extract(model+".opt_log"), extract(model+".blog"))
+	finally:
+		if temporary:
+			shutil.rmtree(options.output, True)
+	if differences:
+		printOut("The text and the binary log differ:")
+		for d in differences:
+			printOut("  "+d)
+		sys.exit(1)
+	printOut("The text and the binary log give the same population")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,195 @@
+from __future__ import division
+import os, sys, json, random, shutil, tempfile, glob
+from nec.print_out import printOut
+from nec.timing import clock
+from nec.bench import fake_engine
+
+# Throughput benchmarks, python -m nec.bench [options] [-- nec.opt options].
+# Every model is evaluated with the fake engine (nec.bench.fake_engine) and
+# the evaluation rate of each stage is reported in evaluations per second:
+#   deck   the engine inputs of a population (SY evaluation, segmentation, cards)
+#   parse  NecOutputParser on the engine outputs of a population
+#   score  whole evaluations of a population: decks, engine runs, parsing and target function
+#   de     full DE generations, including the logging
+# The models are yagis and stacked dipole arrays of increasing size, yagiN has
+# N elements and arrayN has N bays. The options after -- go to nec.opt, e.g.
+# --parallel-evaluations or --frequency-interpolation, to compare their rates.
+
+def yagiModel(elements):
+	#reflector, driven element and directors on a boom along X, the spacings are optimized
+	lines = ["CM nec.bench %d element yagi"%elements, "CE", "SY r=0.002"]
+	for i in range(1, elements+1):
+		if i == 1:
+			lines.append("SY l1=0.165\t' 0.15, 0.18")
+		elif i == 2:
+			lines.append("SY l2=0.155\t' 0.12, 0.17")
+		else:
+			lines.append("SY l%d=0.14\t' 0.12, 0.155"%i)
+	lines.append("SY x1=0")
+	for i in range(2, elements+1):
+		if i == 2:
+			lines.append("SY d2=0.1\t' 0.07, 0.15")
+		else:
+			lines.append("SY d%d=0.13\t' 0.08, 0.2"%i)
+		lines.append("SY x%d=x%d+d%d"%(i, i-1, i))
+	for i in range(1, elements+1):
+		lines.append("GW %d 11 x%d -l%d 0 x%d l%d 0 r"%(i, i, i, i, i))
+	lines += ["GE", "EX 0 2 6 0 1 0", "FR 0 1 0 0 470 6", "RP 0 1 73 1000 90 0 0 5", "EN"]
+	return "\n".join(lines)+"\n"
+
+def arrayModel(bays):
+	#horizontal dipoles stacked along Z, a reflector rod behind each, fed at the middle bay
+	lines = ["CM nec.bench %d bay array"%bays, "CE", "SY r=0.002", "SY lr=0.18\t' 0.16, 0.2", "SY s=0.12\t' 0.08, 0.18", "SY h=0.32\t' 0.25, 0.4"]
+	for i in range(bays):
+		lines.append("SY l%d=0.16\t' 0.14, 0.18"%i)
+		lines.append("SY z%d=%g*h"%(i, i-(bays-1)/2))
+	for i in range(bays):
+		lines.append("GW %d 11 0 -l%d z%d 0 l%d z%d r"%(2*i+1, i, i, i, i))
+		lines.append("GW %d 11 -s -lr z%d -s lr z%d r"%(2*i+2, i, i))
+	lines += ["GE", "EX 0 %d 6 0 1 0"%(2*(bays//2)+1), "FR 0 1 0 0 470 6", "RP 0 1 73 1000 90 0 0 5", "EN"]
+	return "\n".join(lines)+"\n"
+
+MODELS = {"yagi":yagiModel, "array":arrayModel}
+
+def modelText(name):
+	for kind in MODELS:
+		if name.startswith(kind) and name[len(kind):].isdigit():
+			return MODELS[kind](int(name[len(kind):]))
+	raise ValueError("unknown model %s, expected one of %s followed by the size"%(name, ", ".join(sorted(MODELS))))
+
+
+class Bench:
+	def __init__(self, options, opt_args):
+		self.options = options
+		self.opt_args = opt_args
+		self.engine = fake_engine.writeLauncher(options.output, options.latency)
+
+	def evaluator(self, name):
+		from nec import opt
+		from nec.input import NecInputFile
+		directory = os.path.join(self.options.output, name)
+		try:
+			os.makedirs(directory)
+		except OSError: pass
+		model = os.path.join(directory, name+".nec")
+		f = open(model, "wt")
+		try: f.write(modelText(name))
+		finally: f.close()
+		args = ["-e", self.engine, "-o", os.path.join(directory, "output"), "-n", str(self.options.num_cores), "-s", self.options.sweep, "--quiet", "--timing", "--log-file", model+".opt_log", "--de-np", str(self.options.population), "-M", str(self.options.generations)]
+		#the option parsers read sys.argv
+		argv = sys.argv
+		sys.argv = sys.argv[0:1]
+		try:
+			options, inputs = opt.optionParser().parse_args(args+self.opt_args+[model])
+		finally:
+			sys.argv = argv
+		options.output_best = 0
+		nec_file_input = NecInputFile(options.input, options.debug)
+		options.agt_correction = not options.noagt_correction
+		options.angle_step = nec_file_input.angle_step
+		try:
+			os.makedirs(options.output)
+		except OSError: pass
+		return opt.NecFileEvaluator(nec_file_input, options)
+
+	def population(self, evaluator):
+		return [[random.uniform(d[0], d[1]) for d in evaluator.domain] for i in range(self.options.population)]
+
+	def run(self, name):
+		from nec import opt
+		from nec.output_parser import NecOutputParser
+		#the evaluator prints its settings and the best scores
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, "wt")
+		try:
+			evaluator = self.evaluator(name)
+			try:
+				result = {"model":name, "parameters":evaluator.n}
+				vectors = self.population(evaluator)
+				repeat = self.options.repeat
+
+				start = clock()
+				for i in range(repeat):
+					prepared = evaluator.prepareMany(vectors)
+				result["deck"] = repeat*len(vectors)/(clock()-start)
+				result["segments"] = max(p[0][i][1] for p in prepared if p[0] for i in range(len(p[0])))
+
+				for f in glob.glob(os.path.join(evaluator.options.output, "*.out")):
+					os.remove(f)
+				start = clock()
+				evaluator.targetMany(vectors)
+				result["score"] = len(vectors)/(clock()-start)
+
+				outputs = glob.glob(os.path.join(evaluator.options.output, "*.out"))
+				start = clock()
+				for i in range(repeat):
+					for f in outputs:
+						NecOutputParser(f, 1.0, evaluator.options)
+				result["parse"] = repeat*len(vectors)/(clock()-start)
+
+				evaluations = evaluator.timing.evaluations
+				start = clock()
+				opt.globalOptimizer(evaluator, evaluator.options).run()
+				result["de"] = (evaluator.timing.evaluations-evaluations)/(clock()-start)
+			finally:
+				evaluator.join()
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+		return result
+
+
+def formatRate(rate):
+	if rate >= 100: return "%.0f"%rate
+	if rate >= 10: return "%.1f"%rate
+	return "%.2f"%rate
+
+def optionParser():
+	import optparse
+	parser = optparse.OptionParser(usage="%prog [options] [-- nec.opt options]", description="Measures the evaluations per second of deck generation, output parsing, scoring and DE generations on synthetic models with a fake nec engine.")
+	parser.add_option("-m", "--models", default="yagi3,yagi6,yagi12,array2,array4,array8", help="comma separated models, yagiN is an N element yagi and arrayN an N bay dipole array. The default is %default")
+	parser.add_option("-p", "--population", default=16, type="int", help="vectors per measurement and the DE population size. The default is %default")
+	parser.add_option("-g", "--generations", default=3, type="int", help="DE generations run per model. The default is %default")
+	parser.add_option("-r", "--repeat", default=5, type="int", help="times the deck generation and the parsing are repeated. The default is %default")
+	parser.add_option("-n", "--num-cores", default=4, type="int", help="engines run at once. The default is %default")
+	parser.add_option("-s", "--sweep", default="(470,6,39)", help="the sweep of every model. The default is %default")
+	parser.add_option("-l", "--latency", default=0, type="float", metavar="SECONDS", help="time every fake engine run sleeps. The default is %default")
+	parser.add_option("--seed", default=1, type="int", help="random seed of the vectors. The default is %default")
+	parser.add_option("-o", "--output-dir", dest="output", default="", metavar="DIR", help="scratch directory, kept when given. By default a temporary directory is used and removed")
+	parser.add_option("--json", default="", metavar="FILE", help="also write the results to FILE as JSON")
+	return parser
+
+def main():
+	options, args = optionParser().parse_args()
+	temporary = not options.output
+	if temporary:
+		options.output = tempfile.mkdtemp(prefix="nec_bench_")
+	else:
+		options.output = os.path.abspath(options.output)
+		try:
+			os.makedirs(options.output)
+		except OSError: pass
+	random.seed(options.seed)
+	#failed evaluations write their decks to the current directory
+	cwd = os.getcwd()
+	os.chdir(options.output)
+	results = []
+	try:
+		bench = Bench(options, args)
+		printOut("%-10s %6s %6s %10s %10s %10s %10s"%("model", "params", "segs", "deck/s", "parse/s", "score/s", "de/s"))
+		for name in options.models.replace(",", " ").split():
+			r = bench.run(name)
+			results.append(r)
+			printOut("%-10s %6d %6d %10s %10s %10s %10s"%(name, r["parameters"], r["segments"], formatRate(r["deck"]), formatRate(r["parse"]), formatRate(r["score"]), formatRate(r["de"])))
+	finally:
+		os.chdir(cwd)
+		if temporary:
+			shutil.rmtree(options.output, True)
+	if options.json:
+		f = open(options.json, "wt")
+		try:
+			json.dump({"latency":options.latency, "num_cores":options.num_cores, "sweep":options.sweep, "nec.opt":args, "results":results}, f, indent=1)
+		finally: f.close()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,199 @@
+from __future__ import division
+import os, struct, json
+
+# Binary evaluation log, written next to the text log with --binary-log.
+# The file starts with an 8 byte magic, the length of a JSON header and the
+# header itself ({"columns": [...]}), padded so the records start at a multiple
+# of 8 bytes. Every evaluation is a record of little endian float64 values, one
+# per column: run, generation, member, Score, the parameters in the order of
+# the text log and the four scores of every sweep (NaN when not computed).
+# The records can be memory mapped as a (count, columns) array.
+#
+# A run is one optimizer run appended to the file, the generation is the
+# number of generations the optimizer had completed when the vector was
+# evaluated (the initial population and the first DE trials are both 0) and
+# the member is the population index, -1 when unknown. In every run the first
+# record of a member is its initial score, the later ones are its trials.
+#
+# The index file (FILE.idx) holds a (run, generation, first record) triple of
+# int64 values for every generation of every run. It is rebuilt from the
+# records when it is missing or out of date.
+
+MAGIC = b"NECBLOG1"
+INDEX_ENTRY = struct.Struct("<3q")
+NAN = float("nan")
+
+def isBinaryLog(filename):
+	try:
+		f = open(filename, "rb")
+	except IOError:
+		return 0
+	try:
+		return f.read(len(MAGIC)) == MAGIC
+	finally:
+		f.close()
+
+def memberIndex(id):
+	#the optimizers' evaluation ids are member indices or strings like "p12"
+	if isinstance(id, int):
+		return id
+	digits = "".join(c for c in str(id) if c.isdigit())
+	if digits:
+		return int(digits)
+	return -1
+
+def readHeader(f):
+	if f.read(len(MAGIC)) != MAGIC:
+		raise IOError("not a binary evaluation log")
+	size = struct.unpack("<I", f.read(4))[0]
+	header = json.loads(f.read(size).decode("utf-8"))
+	return header, len(MAGIC)+4+size
+
+
+class BinaryLogWriter:
+	def __init__(self, filename, columns):
+		self.filename = filename
+		self.columns = ["run", "generation", "member"]+list(columns)
+		self.record = struct.Struct("<%dd"%len(self.columns))
+		self.run = 0
+		self.generation = None
+		if os.path.exists(filename) and os.path.getsize(filename):
+			log = BinaryLog(filename)
+			if log.columns != self.columns:
+				#a log of another model, the new run starts a new file
+				os.rename(filename, filename+".old")
+				if os.path.exists(filename+".idx"):
+					os.rename(filename+".idx", filename+".old.idx")
+			else:
+				if log.count:
+					self.run = int(log.record(log.count-1)[0])+1
+				#brings the index up to date and drops a partial record of an interrupted run
+				log.generations()
+				self.file = open(filename, "r+b")
+				self.file.truncate(log.offset+log.count*log.record_size)
+				self.file.seek(0, os.SEEK_END)
+				self.count = log.count
+				self.index = open(filename+".idx", "ab")
+				return
+		self.file = open(filename, "wb")
+		header = json.dumps({"columns":self.columns}).encode("utf-8")
+		header += b" "*(-(len(MAGIC)+4+len(header)) % 8)
+		self.file.write(MAGIC+struct.pack("<I", len(header))+header)
+		self.count = 0
+		self.index = open(filename+".idx", "wb")
+
+	def append(self, generation, member, score, vector, range_scores):
+		if generation != self.generation:
+			self.generation = generation
+			self.index.write(INDEX_ENTRY.pack(self.run, generation, self.count))
+		values = [self.run, generation, member, score]+list(vector)+list(range_scores)
+		values += (len(self.columns)-len(values))*[NAN]
+		self.file.write(self.record.pack(*[NAN if v is None else float(v) for v in values]))
+		self.count += 1
+
+	def flush(self):
+		self.file.flush()
+		self.index.flush()
+
+	def close(self):
+		if self.file.closed: return
+		self.file.close()
+		self.index.close()
+
+
+class BinaryLog:
+	"""Reads a binary evaluation log, see the comment at the top of nec.binary_log."""
+	def __init__(self, filename):
+		self.filename = filename
+		f = open(filename, "rb")
+		try:
+			header, self.offset = readHeader(f)
+		finally:
+			f.close()
+		self.columns = header["columns"]
+		self.record_struct = struct.Struct("<%dd"%len(self.columns))
+		self.record_size = self.record_struct.size
+		#a partial record at the end is an interrupted write
+		self.count = (os.path.getsize(filename)-self.offset)//self.record_size
+
+	def vars(self):
+		#the parameter names, the columns between Score and the first range score
+		names = self.columns[4:]
+		for i in range(len(names)):
+			if names[i].startswith("R0"):
+				return names[0:i]
+		return names
+
+	def record(self, i):
+		f = open(self.filename, "rb")
+		try:
+			f.seek(self.offset+i*self.record_size)
+			return self.record_struct.unpack(f.read(self.record_size))
+		finally:
+			f.close()
+
+	def records(self, start=0, stop=None):
+		#yields the records as tuples of floats, reading a block at a time
+		if stop is None or stop > self.count:
+			stop = self.count
+		f = open(self.filename, "rb")
+		try:
+			f.seek(self.offset+start*self.record_size)
+			block = max(1, (1<<20)//self.record_size)
+			i = start
+			while i < stop:
+				n = min(block, stop-i)
+				data = f.read(n*self.record_size)
+				for r in self.record_struct.iter_unpack(data):
+					yield r
+				i += n
+		finally:
+			f.close()
+
+	def array(self):
+		"""The records as a read only numpy memmap of shape (count, columns)."""
+		import numpy
+		return numpy.memmap(self.filename, dtype="<f8", mode="r", offset=self.offset, shape=(self.count, len(self.columns)))
+
+	def generations(self):
+		"""Returns a list of (run, generation, first record, end record)."""
+		try:
+			f = open(self.filename+".idx", "rb")
+			try:
+				data = f.read()
+			finally:
+				f.close()
+		except IOError:
+			data = b""
+		indexed = list(INDEX_ENTRY.iter_unpack(data[0:len(data)-len(data) % INDEX_ENTRY.size]))
+		#entries past the records come from an interrupted run. The records from the last
+		#valid entry on are rescanned, the index may lag behind them
+		valid = [e for e in indexed if e[2] < self.count]
+		entries = valid[0:-1]
+		i = valid[-1][2] if valid else 0
+		last = None
+		for r in self.records(i):
+			key = (int(r[0]), int(r[1]))
+			if key != last:
+				entries.append(key+(i,))
+				last = key
+			i += 1
+		if entries != indexed:
+			f = open(self.filename+".idx", "wb")
+			try:
+				for e in entries:
+					f.write(INDEX_ENTRY.pack(*e))
+			finally:
+				f.close()
+		ends = [e[2] for e in entries[1:]]+[self.count]
+		return [(entries[i][0], entries[i][1], entries[i][2], ends[i]) for i in range(len(entries))]
+
+	def runs(self):
+		"""Returns a list of (first record, end record) of every run."""
+		runs = []
+		for run, generation, start, end in self.generations():
+			if runs and runs[-1][0] == run:
+				runs[-1][2] = end
+			else:
+				runs.append([run, start, end])
+		return [(r[1], r[2]) for r in runs]
@@ -0,0 +1,109 @@
+from __future__ import division
+import os, time, random, pickle, zlib
+from nec.print_out import printOut
+from nec.input import InputError
+
+# Checkpoints of a running optimization: the complete optimizer state
+# (population, scores, generation count, adaptation memories), the evaluator
+# state (best vector and score, logged generation, AGT threshold statistics,
+# surrogate samples) and the random generator state, pickled and zlib
+# compressed. The file is written to a temporary name and renamed over the
+# previous checkpoint, so a crash while saving leaves the previous one intact.
+
+MAGIC = b"NECOPTCK"
+VERSION = 2
+
+def checkpointFile(options):
+	return options.checkpoint_file or options.input+".checkpoint"
+
+#scores are saved as plain (score, agt score) pairs, the evaluator's Score class
+#belongs to __main__ when nec.opt runs as a script
+def packScores(scores):
+	return [tuple(s.scores) if hasattr(s, "scores") else float(s) for s in scores]
+
+def unpackScores(evaluator, scores):
+	return [type(evaluator).Score(*s) if isinstance(s, tuple) else s for s in scores]
+
+def save(filename, optimizer, evaluator):
+	optimizer_state = optimizer.state()
+	optimizer_state["scores"] = packScores(optimizer_state["scores"])
+	state = {
+		"version":VERSION,
+		"input":evaluator.options.input,
+		"opt_vars":list(evaluator.opt_vars),
+		"optimizer":type(optimizer).__name__,
+		"optimizer_state":optimizer_state,
+		"evaluator_state":evaluator.state(),
+		"random_state":random.getstate(),
+		"time":time.time(),
+	}
+	data = MAGIC+zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+	tmp = filename+".tmp"
+	f = open(tmp, "wb")
+	try:
+		f.write(data)
+		f.flush()
+		os.fsync(f.fileno())
+	finally:
+		f.close()
+	os.replace(tmp, filename)
+
+def load(filename):
+	try:
+		f = open(filename, "rb")
+	except IOError:
+		raise InputError("Cannot resume, checkpoint file %s not found"%filename)
+	try:
+		data = f.read()
+	finally:
+		f.close()
+	if not data.startswith(MAGIC):
+		raise InputError("%s is not a checkpoint file"%filename)
+	state = pickle.loads(zlib.decompress(data[len(MAGIC):]))
+	if state.get("version") != VERSION:
+		raise InputError("Unsupported checkpoint version in %s"%filename)
+	return state
+
+def resume(filename, optimizer, evaluator):
+	state = load(filename)
+	if state["opt_vars"] != list(evaluator.opt_vars):
+		raise InputError("Cannot resume, the checkpoint parameters %s do not match %s"%(str(state["opt_vars"]), str(evaluator.opt_vars)))
+	if state["optimizer"] != type(optimizer).__name__:
+		raise InputError("Cannot resume, the checkpoint was saved by %s"%state["optimizer"])
+	optimizer_state = state["optimizer_state"]
+	optimizer_state["scores"] = unpackScores(evaluator, optimizer_state["scores"])
+	optimizer.restore_state(optimizer_state)
+	evaluator.restoreState(state["evaluator_state"])
+	random.setstate(state["random_state"])
+	#the population goes to the log as the initial population of a fresh run does
+	evaluator.logPopulation(optimizer.population, optimizer.scores)
+	printOut("Resumed from %s at generation %d, best score %g"%(filename, optimizer.count, float(evaluator.best_score)))
+
+class Checkpoint:
+	def __init__(self, filename, evaluator, every=0, interval=0):
+		self.filename = filename
+		self.evaluator = evaluator
+		self.every = every
+		self.interval = interval
+		self.last = time.time()
+
+	def generation(self, optimizer):
+		due = self.every and optimizer.count % self.every == 0
+		if self.interval and time.time()-self.last >= self.interval:
+			due = True
+		if not due: return
+		try:
+			save(self.filename, optimizer, self.evaluator)
+		except (IOError, OSError, pickle.PicklingError) as e:
+			printOut("Failed to save checkpoint %s: %s"%(self.filename, str(e)))
+		self.last = time.time()
+
+def attach(optimizer, evaluator, options):
+	filename = checkpointFile(options)
+	if not hasattr(optimizer, "state"):
+		printOut("Checkpoints are not supported by the %s optimizer"%getattr(optimizer, "name", options.optimizer))
+		return
+	if options.resume:
+		resume(filename, optimizer, evaluator)
+	if options.checkpoint_every or options.checkpoint_interval:
+		optimizer.checkpoint = Checkpoint(filename, evaluator, options.checkpoint_every, options.checkpoint_interval)
@@ -0,0 +1,261 @@
+from __future__ import division
+'''
+Covariance matrix adaptation evolution strategy with IPOP restarts.
+
+It uses the same evaluator interface as differential_evolution_optimizer:
+ n, domain, x, target(vector, id), print_status(min, mean, best, count, improved),
+ iterationCallback(count, population, scores, improved) and initialPopulation().
+If the evaluator has targetMany(vectors, ids) each generation of lambda samples
+is passed to it at once so the samples can be evaluated concurrently.
+
+The search runs in coordinates normalized to [0,1] over the domain. Samples outside
+the domain are evaluated at the nearest point inside it and ranked with a penalty
+proportional to their squared distance from the domain.
+
+ 1. N. Hansen, The CMA Evolution Strategy: A Tutorial, arXiv:1604.00772
+ 2. A. Auger, N. Hansen, A Restart CMA Evolution Strategy With Increasing Population Size, CEC 2005
+'''
+
+import math
+import random
+from nec.demathutils import mean_value, sort_permutation
+
+def eigen_symmetric(a, max_sweeps=50):
+  # cyclic Jacobi rotations, returns (eigenvalues, eigenvectors as columns)
+  n = len(a)
+  a = [list(row) for row in a]
+  v = [[1.0 if i == j else 0.0 for j in range(n)] for i in range(n)]
+  for sweep in range(max_sweeps):
+    off = 0.0
+    for i in range(n):
+      for j in range(i+1, n):
+        off += a[i][j]*a[i][j]
+    if off < 1e-22:
+      break
+    for p in range(n):
+      for q in range(p+1, n):
+        if abs(a[p][q]) < 1e-300:
+          continue
+        theta = (a[q][q]-a[p][p])/(2*a[p][q])
+        t = (1.0 if theta >= 0 else -1.0)/(abs(theta)+math.sqrt(theta*theta+1))
+        c = 1/math.sqrt(t*t+1)
+        s = t*c
+        for k in range(n):
+          akp = a[k][p]
+          akq = a[k][q]
+          a[k][p] = c*akp - s*akq
+          a[k][q] = s*akp + c*akq
+        for k in range(n):
+          apk = a[p][k]
+          aqk = a[q][k]
+          a[p][k] = c*apk - s*aqk
+          a[q][k] = s*apk + c*aqk
+        for k in range(n):
+          vkp = v[k][p]
+          vkq = v[k][q]
+          v[k][p] = c*vkp - s*vkq
+          v[k][q] = s*vkp + c*vkq
+  return [a[i][i] for i in range(n)], v
+
+
+class cmaes_optimizer(object):
+
+  def __init__(self,
+               evaluator,
+               population_size=0,
+               sigma=.3,
+               max_iter=10000,
+               max_evaluations=0,
+               restarts=4,
+               increase_popsize=2,
+               tol_fun=1e-6,
+               tol_x=1e-7,
+               show_progress=False,
+               insert_solution_vector=None):
+    self.evaluator = evaluator
+    self.n = evaluator.n
+    self.initial_population_size = population_size if population_size > 0 else 4+int(3*math.log(self.n))
+    self.sigma0 = sigma
+    self.max_iter = max_iter
+    self.max_evaluations = max_evaluations
+    self.restarts = restarts
+    self.increase_popsize = increase_popsize
+    self.tol_fun = tol_fun
+    self.tol_x = tol_x
+    self.show_progress = show_progress
+    self.seeded = insert_solution_vector
+    self.evaluations = 0
+    self.count = 0
+    self.population = []
+    self.scores = []
+    self.best_score = None
+    self.best_vector = None
+
+  def to_domain(self, y):
+    d = self.evaluator.domain
+    return [d[i][0]+y[i]*(d[i][1]-d[i][0]) for i in range(self.n)]
+
+  def from_domain(self, x):
+    d = self.evaluator.domain
+    return [(x[i]-d[i][0])/(d[i][1]-d[i][0]) if d[i][1] > d[i][0] else .5 for i in range(self.n)]
+
+  def initial_mean(self):
+    if self.seeded is not None and self.seeded is not False:
+      return self.from_domain(self.seeded)
+    population, scores = self.evaluator.initialPopulation()
+    if population and scores and len(scores) == len(population):
+      scored = [i for i in range(len(scores)) if scores[i] is not None]
+      if scored:
+        return self.from_domain(population[min(scored, key=lambda i: float(scores[i]))])
+    if population:
+      return self.from_domain(population[0])
+    if self.evaluator.x:
+      return self.from_domain(self.evaluator.x)
+    return self.n*[.5]
+
+  def evaluate(self, vectors):
+    ids = ["c%d"%i for i in range(len(vectors))]
+    if hasattr(self.evaluator, "targetMany"):
+      scores = self.evaluator.targetMany(vectors, ids)
+    else:
+      scores = [self.evaluator.target(vectors[i], ids[i]) for i in range(len(vectors))]
+    self.evaluations += len(vectors)
+    return scores
+
+  def budget_left(self):
+    if self.count >= self.max_iter:
+      return False
+    if self.max_evaluations and self.evaluations >= self.max_evaluations:
+      return False
+    return True
+
+  def run(self):
+    self.optimize()
+    self.evaluator.x = self.best_vector
+    if self.show_progress:
+      self.evaluator.print_status(
+            self.best_score,
+            mean_value(list(map(float,self.scores))),
+            self.best_vector,
+            'Final',0)
+
+  def optimize(self):
+    lam = self.initial_population_size
+    mean = self.initial_mean()
+    restart = 0
+    while True:
+      self.search(mean, lam)
+      restart += 1
+      if restart > self.restarts or not self.budget_left():
+        break
+      lam = int(lam*self.increase_popsize)
+      mean = [random.random() for i in range(self.n)]
+
+  def search(self, mean, lam):
+    n = self.n
+    mu = lam//2
+    weights = [math.log(mu+.5)-math.log(i+1) for i in range(mu)]
+    total = sum(weights)
+    weights = [w/total for w in weights]
+    mueff = 1/sum(w*w for w in weights)
+    cc = (4+mueff/n)/(n+4+2*mueff/n)
+    cs = (mueff+2)/(n+mueff+5)
+    c1 = 2/((n+1.3)**2+mueff)
+    cmu = min(1-c1, 2*(mueff-2+1/mueff)/((n+2)**2+mueff))
+    damps = 1+2*max(0, math.sqrt((mueff-1)/(n+1))-1)+cs
+    chin = math.sqrt(n)*(1-1/(4*n)+1/(21*n*n))
+    sigma = self.sigma0
+    pc = n*[0.0]
+    ps = n*[0.0]
+    b = [[1.0 if i == j else 0.0 for j in range(n)] for i in range(n)]
+    d = n*[1.0]
+    c = [[1.0 if i == j else 0.0 for j in range(n)] for i in range(n)]
+    eigen_generation = 0
+    generation = 0
+    history = []
+    history_length = 10+int(30*n/lam)
+    while self.budget_left():
+      # sample lambda offspring
+      ys = []
+      xs = []
+      for k in range(lam):
+        z = [random.gauss(0, 1) for i in range(n)]
+        dz = [d[i]*z[i] for i in range(n)]
+        y = [sum(b[i][j]*dz[j] for j in range(n)) for i in range(n)]
+        ys.append(y)
+        xs.append([mean[i]+sigma*y[i] for i in range(n)])
+      repaired = [[min(1.0, max(0.0, v)) for v in x] for x in xs]
+      vectors = [self.to_domain(x) for x in repaired]
+      scores = self.evaluate(vectors)
+      fitness = []
+      for k in range(lam):
+        penalty = sum((xs[k][i]-repaired[k][i])**2 for i in range(n))
+        fitness.append(float(scores[k]) + penalty*(1+abs(float(scores[k]))))
+      order = sort_permutation(fitness)
+      # improved counts the samples better than the best score before this generation
+      previous_best = self.best_score
+      improved = 0
+      for k in range(lam):
+        if previous_best is None or float(scores[k]) < float(previous_best):
+          improved += 1
+        if self.best_score is None or float(scores[k]) < float(self.best_score):
+          self.best_score = scores[k]
+          self.best_vector = vectors[k]
+      self.population = vectors
+      self.scores = scores
+      self.evaluator.x = self.best_vector
+
+      # recombination
+      old_mean = mean
+      mean = n*[0.0]
+      for r in range(mu):
+        x = xs[order[r]]
+        for i in range(n):
+          mean[i] += weights[r]*x[i]
+      step = [(mean[i]-old_mean[i])/sigma for i in range(n)]
+      # C^-1/2 * step = B * D^-1 * B^T * step
+      bt = [sum(b[j][i]*step[j] for j in range(n))/d[i] for i in range(n)]
+      invsqrt_step = [sum(b[i][j]*bt[j] for j in range(n)) for i in range(n)]
+      for i in range(n):
+        ps[i] = (1-cs)*ps[i] + math.sqrt(cs*(2-cs)*mueff)*invsqrt_step[i]
+      ps_norm = math.sqrt(sum(v*v for v in ps))
+      hsig = ps_norm/math.sqrt(1-(1-cs)**(2*(generation+1)))/chin < 1.4+2/(n+1)
+      for i in range(n):
+        pc[i] = (1-cc)*pc[i] + (math.sqrt(cc*(2-cc)*mueff)*step[i] if hsig else 0.0)
+      # covariance update
+      artmp = [[(xs[order[r]][i]-old_mean[i])/sigma for i in range(n)] for r in range(mu)]
+      for i in range(n):
+        for j in range(i+1):
+          rank_mu = 0.0
+          for r in range(mu):
+            rank_mu += weights[r]*artmp[r][i]*artmp[r][j]
+          v = (1-c1-cmu)*c[i][j] + c1*(pc[i]*pc[j] + (0 if hsig else cc*(2-cc)*c[i][j])) + cmu*rank_mu
+          c[i][j] = v
+          c[j][i] = v
+      sigma = sigma*math.exp((cs/damps)*(ps_norm/chin-1))
+
+      if generation-eigen_generation > lam/(c1+cmu)/n/10:
+        eigen_generation = generation
+        values, b = eigen_symmetric(c)
+        d = [math.sqrt(max(v, 1e-20)) for v in values]
+
+      if self.show_progress:
+        self.evaluator.print_status(
+          self.best_score,
+          mean_value(list(map(float,scores))),
+          self.best_vector,
+          self.count, improved)
+      self.evaluator.iterationCallback(self.count, self.population, self.scores, improved)
+      self.count += 1
+      generation += 1
+
+      # stopping criteria of this run
+      history.append(fitness[order[0]])
+      if len(history) > history_length:
+        del history[0]
+      if len(history) == history_length and max(history)-min(history) < self.tol_fun and max(fitness)-min(fitness) < self.tol_fun:
+        break
+      if sigma*max(d) < self.tol_x:
+        break
+      if max(d) > 1e7*min(d):
+        break
@@ -55,6 +55,7 @@ derivative works thereof, in binary and source code form.
 #from stdlib import random
 import random
 import operator
+import math
 from nec.demathutils import *
 import sys
 
@@ -139,6 +140,20 @@ data members:
 
 
     self.scores = self.population_size*[1000.0]
+    self.count = 0
+    self.restored = False
+    self.checkpoint = None
+
+  # everything but these is the state saved by checkpoints,
+  # the iteration limit comes from the options of the resumed run
+  state_exclude = ("evaluator", "plugin", "checkpoint", "restored", "max_iter")
+
+  def state(self):
+    return dict((k, v) for k, v in self.__dict__.items() if k not in self.state_exclude)
+
+  def restore_state(self, state):
+    self.__dict__.update(state)
+    self.restored = True
 
   def run(self):	
     self.optimize()
@@ -154,11 +169,15 @@ data members:
 
 
   def optimize(self):
-    # initialise the population please
-    self.make_random_population()
+    if self.restored:
+      # continue a run restored from a checkpoint
+      count = self.count
+    else:
+      # initialise the population please
+      self.make_random_population()
+      self.monitor_score = mean_value(list(map(float,self.scores )))
+      count = 0
     converged = False
-    monitor_score = mean_value(list(map(float,self.scores )))
-    count = 0
     while not converged:
       improved = self.evolve()
       self.evaluator.iterationCallback(count, self.population, self.scores, improved)
@@ -174,25 +193,35 @@ data members:
             count, improved)
 
       count += 1
-      if count%self.monitor_cycle==0:
-        if (monitor_score-mean_value(list(map(float,self.scores))) ) < self.eps:
-          converged = True
-        else:
-         monitor_score = mean_value(list(map(float,self.scores)))
-      rd = (mean_value(list(map(float,self.scores))) - float(min_value(self.scores)) )
-      rd = rd*rd/(float(min_value(self.scores))*float(min_value(self.scores)) + self.eps*self.eps )
-      if ( rd < self.eps*self.eps ):
+      converged = self.converged(count)
+      self.count = count
+      if self.checkpoint and not converged:
+        self.checkpoint.generation(self)
+
+  def converged(self, count):
+    converged = False
+    if count%self.monitor_cycle==0:
+      if (self.monitor_score-mean_value(list(map(float,self.scores))) ) < self.eps:
         converged = True
+      else:
+       self.monitor_score = mean_value(list(map(float,self.scores)))
+    rd = (mean_value(list(map(float,self.scores))) - float(min_value(self.scores)) )
+    rd = rd*rd/(float(min_value(self.scores))*float(min_value(self.scores)) + self.eps*self.eps )
+    if ( rd < self.eps*self.eps ):
+      converged = True
 
 
-      if count>=self.max_iter:
-        converged =True
+    if count>=self.max_iter:
+      converged =True
+    return converged
 
   def make_random_population(self):
     self.population,self.scores = self.evaluator.initialPopulation()
     if self.population:
 	    self.population_size = len(self.population)
-	    self.scores = self.population_size*[1000.0]
+	    # scores supplied by the evaluator are kept, members without one are scored
+	    if len(self.scores) != self.population_size:
+	      self.scores = self.population_size*[None]
 	    self.score_population()
 	    return
     for ii in range(self.population_size):
@@ -210,17 +239,32 @@ data members:
     if self.seeded is not False:
       self.population[0] = self.seeded
     # score the population please
-    self.scores = self.population_size*[1000.]
+    self.scores = self.population_size*[None]
     self.score_population()
 
   def score_population(self):
-    for vector,ii in zip(self.population,range(self.population_size)):
-      tmp_score = self.evaluator.target(vector, ii)
+    todo = [ii for ii in range(self.population_size) if self.scores[ii] is None]
+    if hasattr(self.evaluator, "targetMany"):
+      tmp_scores = self.evaluator.targetMany([self.population[ii] for ii in todo], todo)
+      for k in range(len(todo)):
+        self.scores[todo[k]] = tmp_scores[k]
+      return
+    for ii in todo:
+      tmp_score = self.evaluator.target(self.population[ii], ii)
       self.scores[ii]=tmp_score
 
+  def evaluate_trials(self, trials):
+    # trials[ii] competes with member ii, the result is its score or None if it lost.
+    # all trials of a generation are known before any is evaluated, so an evaluator
+    # which can evaluate several at once gets them together
+    if hasattr(self.evaluator, "testMembersAgainstScores"):
+      return self.evaluator.testMembersAgainstScores(trials, list(self.scores), list(range(len(trials))))
+    return [self.evaluator.testMemberAgainstScore(trials[ii], self.scores[ii], ii) for ii in range(len(trials))]
+
   def evolve(self):
     new_population=[[]]*self.population_size
     improved = 0
+    trials = []
     for ii in range(self.population_size):
       rnd = random_double(self.population_size-1)
       permut = sort_permutation(rnd)
@@ -258,13 +302,15 @@ data members:
         else:
           if (rnd[jj]<self.cr):
             test_vector[ permut[jj] ] = vi[ permut[jj] ]
-      # get the score please
-      test_score = self.evaluator.testMemberAgainstScore(test_vector, self.scores[ii],ii)
-      #self.evaluator.target( test_vector )
+      trials.append(test_vector)
+    # get the scores please
+    test_scores = self.evaluate_trials(trials)
+    for ii in range(self.population_size):
+      test_score = test_scores[ii]
       # check if the score if lower
       if test_score is not None:
         self.scores[ii] = test_score
-        new_population[ii] = test_vector
+        new_population[ii] = trials[ii]
         improved+=1
     for ii in range(self.population_size):
       if new_population[ii]:
@@ -281,6 +327,190 @@ data members:
     return improved
 
 
+def weighted_lehmer_mean(values, weights):
+  num = 0.0
+  den = 0.0
+  for v, w in zip(values, weights):
+    num += w*v*v
+    den += w*v
+  if den == 0.0:
+    return 0.0
+  return num/den
+
+
+class shade_optimizer(differential_evolution_optimizer):
+  """
+Success-history based adaptive DE with linear population size reduction (L-SHADE).
+
+ F and CR are sampled per trial from a memory of successful values
+ (Cauchy and normal distributions around a randomly picked memory slot),
+ mutation is current-to-pbest/1 with an archive of replaced parents and
+ the population shrinks linearly from its initial size to min_population_size
+ as the evaluation budget max_evaluations is consumed. The default budget is
+ DEFAULT_EVALUATIONS_PER_PARAMETER evaluations per parameter, at most max_iter
+ generations of the initial population, so the population actually shrinks
+ in a run that would otherwise stop on stall first.
+
+ 1. R. Tanabe, A. Fukunaga, Success-History Based Parameter Adaptation for Differential Evolution, CEC 2013
+ 2. R. Tanabe, A. Fukunaga, Improving the Search Performance of SHADE Using Linear Population Size Reduction, CEC 2014
+  """
+
+  DEFAULT_EVALUATIONS_PER_PARAMETER = 2000
+
+  def __init__(self,
+               evaluator,
+               population_size=50,
+               min_population_size=4,
+               max_evaluations=0,
+               memory_size=6,
+               p_best=.11,
+               archive_rate=1.4,
+               stall_generations=0,
+               **kwds):
+    differential_evolution_optimizer.__init__(self, evaluator, population_size=population_size, **kwds)
+    self.initial_population_size = population_size
+    self.min_population_size = max(4, min_population_size)
+    self.max_evaluations = max_evaluations or min(self.DEFAULT_EVALUATIONS_PER_PARAMETER*self.vector_length, self.max_iter*population_size)
+    self.memory_size = max(1, memory_size)
+    self.memory_f = self.memory_size*[.5]
+    self.memory_cr = self.memory_size*[.5]
+    self.memory_pos = 0
+    self.p_best = p_best
+    self.archive_rate = archive_rate
+    self.archive = []
+    self.evaluations = 0
+    self.stall_generations = stall_generations if stall_generations > 0 else max(20, 2*self.vector_length)
+    self.stall_count = 0
+    self.stall_score = None
+
+  state_exclude = differential_evolution_optimizer.state_exclude+("max_evaluations",)
+
+  def make_random_population(self):
+    differential_evolution_optimizer.make_random_population(self)
+    self.initial_population_size = self.population_size
+    self.evaluations += self.population_size
+
+  def sample_cr(self, r):
+    if self.memory_cr[r] is None:
+      return 0.0
+    return min(1.0, max(0.0, random.gauss(self.memory_cr[r], .1)))
+
+  def sample_f(self, r):
+    while True:
+      f = self.memory_f[r] + .1*math.tan(math.pi*(random.random()-.5))
+      if f > 0:
+        return min(1.0, f)
+
+  def evolve(self):
+    np = self.population_size
+    order = sort_permutation(list(map(float, self.scores)))
+    pbest_count = max(2, int(round(self.p_best*np)))
+    new_population=[[]]*np
+    successful_f = []
+    successful_cr = []
+    deltas = []
+    improved = 0
+    trials = []
+    for ii in range(np):
+      r = random.randrange(self.memory_size)
+      cr = self.sample_cr(r)
+      f = self.sample_f(r)
+      x = self.population[ii]
+      xp = self.population[order[random.randrange(pbest_count)]]
+      r1 = random.randrange(np-1)
+      if r1 >= ii:
+        r1 += 1
+      while True:
+        r2 = random.randrange(np+len(self.archive))
+        if r2 != ii and r2 != r1:
+          break
+      x1 = self.population[r1]
+      x2 = self.population[r2] if r2 < np else self.archive[r2-np]
+      test_vector = list(x)
+      jrand = random.randrange(self.vector_length)
+      for jj in range(self.vector_length):
+        if jj != jrand and random.random() >= cr:
+          continue
+        v = x[jj] + f*(xp[jj]-x[jj]) + f*(x1[jj]-x2[jj])
+        if self.evaluator.enforce_domain_limits:
+          if v > self.evaluator.domain[jj][1]:
+            v = (self.evaluator.domain[jj][1]+x[jj])/2
+          if v < self.evaluator.domain[jj][0]:
+            v = (self.evaluator.domain[jj][0]+x[jj])/2
+        test_vector[jj] = v
+      trials.append((test_vector, f, cr))
+    # the archive gets the replaced parents once the whole generation is evaluated
+    test_scores = self.evaluate_trials([t[0] for t in trials])
+    self.evaluations += np
+    for ii in range(np):
+      test_vector, f, cr = trials[ii]
+      test_score = test_scores[ii]
+      if test_score is not None:
+        delta = abs(float(self.scores[ii])-float(test_score))
+        if delta > 0:
+          successful_f.append(f)
+          successful_cr.append(cr)
+          deltas.append(delta)
+          self.archive.append(self.population[ii])
+        self.scores[ii] = test_score
+        new_population[ii] = test_vector
+        improved += 1
+    for ii in range(np):
+      if new_population[ii]:
+        self.population[ii]=new_population[ii]
+    self.update_memory(successful_f, successful_cr, deltas)
+    self.reduce_population()
+    if self.plugin:
+      res = self.plugin.postEvolve(self)
+      if res:
+        for r in res:
+          self.population[r[0]] = r[1]
+          self.scores[r[0]] = r[2]
+    self.best_score = float(min_value( self.scores ))
+    self.best_vector = self.population[ min_index( self.scores ) ]
+    self.evaluator.x = self.best_vector
+    return improved
+
+  def update_memory(self, successful_f, successful_cr, deltas):
+    if not deltas:
+      return
+    total = sum(deltas)
+    weights = [d/total for d in deltas]
+    self.memory_f[self.memory_pos] = weighted_lehmer_mean(successful_f, weights)
+    if self.memory_cr[self.memory_pos] is None or max(successful_cr) == 0:
+      self.memory_cr[self.memory_pos] = None
+    else:
+      self.memory_cr[self.memory_pos] = weighted_lehmer_mean(successful_cr, weights)
+    self.memory_pos = (self.memory_pos+1)%self.memory_size
+
+  def reduce_population(self):
+    progress = min(1.0, self.evaluations/self.max_evaluations)
+    target = int(round(self.initial_population_size + (self.min_population_size-self.initial_population_size)*progress))
+    target = max(self.min_population_size, target)
+    if target < self.population_size:
+      order = sort_permutation(list(map(float, self.scores)))
+      keep = sorted(order[0:target])
+      self.population = apply_permutation(self.population, keep)
+      self.scores = apply_permutation(self.scores, keep)
+      self.population_size = target
+    archive_size = int(round(self.archive_rate*self.population_size))
+    while len(self.archive) > archive_size:
+      del self.archive[random.randrange(len(self.archive))]
+
+  def converged(self, count):
+    if self.evaluations >= self.max_evaluations:
+      return True
+    best = float(min_value(self.scores))
+    if self.stall_score is None or self.stall_score - best > self.eps*max(1.0, abs(best)):
+      self.stall_score = best
+      self.stall_count = 0
+    else:
+      self.stall_count += 1
+      if self.stall_count >= self.stall_generations:
+        return True
+    return differential_evolution_optimizer.converged(self, count)
+
+
 class DESQIPlugin:
   def __init__(self, maxN=3):
     self.maxN = maxN
@@ -307,7 +537,10 @@ class DESQIPlugin:
       f2 = float(de.scores[i2])
       f3 = float(de.scores[i3])
       for i in range(de.vector_length):
-        test_vector[i] = .5*( (x1[i]*x1[i]-x2[i]*x2[i])*f3 + (x2[i]*x2[i] - x3[i]*x3[i])*f1 + (x3[i]*x3[i] - x1[i]*x1[i])*f2) / ( (x1[i]-x2[i])*f1 + (x2[i] - x3[i])*f1 + (x3[i] - x1[i])*f2)
+        # the vertex of the parabola through the three points, the worst member's value where there is none
+        d = (x1[i]-x2[i])*f3 + (x2[i] - x3[i])*f1 + (x3[i] - x1[i])*f2
+        if d != 0:
+          test_vector[i] = .5*( (x1[i]*x1[i]-x2[i]*x2[i])*f3 + (x2[i]*x2[i] - x3[i]*x3[i])*f1 + (x3[i]*x3[i] - x1[i]*x1[i])*f2) / d
       test_score = de.evaluator.target( test_vector )
       if test_score < de.scores[w]:
         return [(w, test_vector, test_score)]
@@ -391,12 +624,14 @@ class test_rosenbrock_function(object):
 		self.n = 2*dim
 		self.dim = dim
 		self.domain = [ (-10,10) ]*self.n
-		self.optimizer = differential_evolution_optimizer(self,population_size=self.n*10,n_cross=self.n*2,eps=1e-8, show_progress=True)
+		self.enforce_domain_limits = True
+		self.optimizer = differential_evolution_optimizer(self,population_size=self.n*10,n_cross=self.n*2,eps=1e-8, show_progress=True, show_progress_nth_cycle=100)
+		self.optimizer.run()
 		for x in self.x:
 			assert abs(x-1.0)<1e-2
 	
 	
-	def target(self, vector):
+	def target(self, vector, id=None):
 		tmp = list(vector)
 		x_vec = vector[0:self.dim]
 		y_vec = vector[self.dim:]
@@ -406,12 +641,15 @@ class test_rosenbrock_function(object):
 		#print list(x_vec), list(y_vec), result
 		return result
 	
-	def print_status(self, mins,means,vector,txt):
-		sys.stdout.write("MinScore=%g, MeanScore=%g, Solution = %s\n"%mins, means, str(list(vector)) )
+	def testMemberAgainstScore(self, vector, score, id):
+		s = self.target(vector, id)
+		if s <= score: return s
+		return None
+	def print_status(self, mins,means,vector,count,improved):
+		sys.stdout.write("%s. MinScore=%g, MeanScore=%g, Solution = %s\n"%(str(count), mins, means, str(list(vector))) )
 	def initialPopulation(self):
 		return [], []
-	def iterationCallback(self, count,population,scores):
-		sys.stdout.write(str(count)+"\n")
+	def iterationCallback(self, count,population,scores,improved):
 		pass
 	
 	
@@ -0,0 +1,100 @@
+from __future__ import division
+import os, hashlib, sqlite3, zlib, atexit
+from threading import Lock
+
+# Engine run archive for reproducible profiling. With --engine-record FILE
+# every engine run stores its output, zlib compressed, in the sqlite database
+# FILE under the SHA-1 of its deck. With --engine-replay FILE the engine runs
+# whose deck is in FILE write the recorded output instead of running the
+# engine, so an optimization recorded once can be replayed with the same
+# --seed and options to time the parsing and the scoring without the engines.
+# Decks missing from the archive are run by the engine and counted as misses.
+# Both options may name the same file, the misses are then recorded.
+
+COMMIT_EVERY = 100
+
+def deckHash(deck):
+	return hashlib.sha1(deck).hexdigest()
+
+def readFile(filename):
+	f = open(filename, "rb")
+	try: return f.read()
+	finally: f.close()
+
+
+class EngineArchive:
+	def __init__(self, record="", replay=""):
+		self.lock = Lock()
+		self.record_db = None
+		self.replay_db = None
+		self.recorded = 0
+		self.replayed = 0
+		self.misses = 0
+		self.pending = 0
+		if record:
+			self.record_db = self.open(record)
+		if replay:
+			if os.path.abspath(replay) == os.path.abspath(record or ""):
+				self.replay_db = self.record_db
+			else:
+				if not os.path.exists(replay):
+					raise IOError("engine archive %s not found"%replay)
+				self.replay_db = self.open(replay)
+		atexit.register(self.close)
+
+	def open(self, filename):
+		#the connection is shared by the evaluation threads under self.lock
+		db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+		db.execute("create table if not exists outputs (deck text primary key, output blob)")
+		db.commit()
+		return db
+
+	def replay(self, deck, nec_output):
+		"""Writes the recorded output of deck to nec_output, returns 0 if the engine has to run."""
+		if self.replay_db is None: return 0
+		with self.lock:
+			if self.replay_db is None: return 0
+			row = self.replay_db.execute("select output from outputs where deck=?", (deckHash(deck),)).fetchone()
+			if row is None:
+				self.misses += 1
+				return 0
+			self.replayed += 1
+		f = open(nec_output, "wb")
+		try: f.write(zlib.decompress(row[0]))
+		finally: f.close()
+		return 1
+
+	def record(self, deck, nec_output):
+		if self.record_db is None: return
+		try:
+			output = readFile(nec_output)
+		except IOError:
+			return
+		data = zlib.compress(output)
+		with self.lock:
+			if self.record_db is None: return
+			self.record_db.execute("insert or replace into outputs values (?, ?)", (deckHash(deck), sqlite3.Binary(data)))
+			self.recorded += 1
+			self.pending += 1
+			if self.pending >= COMMIT_EVERY:
+				self.record_db.commit()
+				self.pending = 0
+
+	def status(self):
+		with self.lock:
+			s = []
+			if self.replay_db is not None:
+				s.append("%d replayed, %d missed"%(self.replayed, self.misses))
+			if self.record_db is not None:
+				s.append("%d recorded"%self.recorded)
+			return "Engine archive: "+", ".join(s)
+
+	def close(self):
+		with self.lock:
+			if self.record_db is not None:
+				self.record_db.commit()
+				self.record_db.close()
+			if self.replay_db is not None and self.replay_db is not self.record_db:
+				self.replay_db.close()
+			self.record_db = None
+			self.replay_db = None
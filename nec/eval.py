@@ -9,6 +9,7 @@ from nec.print_out import printOut
 from nec.output_parser import FrequencyData, NecOutputParser
 from nec.html import HtmlOutput
 from nec.input import NecInputFile, InputError, EvalError
+from nec.timing import Timing
 from random import random
 from time import sleep
 
@@ -43,6 +44,8 @@ class Sweep:
 			total += r[0] + r[1]*(r[2]-1)/2
 		if not total: return 0
 		return total / len(self.ranges)
+	def maxFrequency(self):
+		return max([r[0]+r[1]*(r[2]-1) for r in self.ranges])
 
 class NecEvaluator:
 	def __init__(self, nec_file_input, options):
@@ -50,6 +53,18 @@ class NecEvaluator:
 		self.options = options
 		self.nec_file_input = nec_file_input
 		self.wire_structure = WireStructure(options)
+		self.workers = None
+		#set by the optimizer to fill sweeps in from a subset of the frequencies
+		self.interpolation = None
+		#set by the optimizer with --timing
+		self.timing = Timing()
+		self.engine_archive = None
+		if options.engine_record or options.engine_replay:
+			from nec.engine_archive import EngineArchive
+			self.engine_archive = EngineArchive(options.engine_record, options.engine_replay)
+		if options.workers:
+			from nec.worker import WorkerPool
+			self.workers = WorkerPool(options.workers, options.worker_timeout)
 		if options.engine_takes_cmd_args=='yes' or options.engine_takes_cmd_args=='auto' and os.name!='nt':
 			self.options.engine_takes_cmd_args = 1
 		else: self.options.engine_takes_cmd_args = 0
@@ -126,11 +141,23 @@ class NecEvaluator:
 	def formatName(self, n):
 		return "%8s"%n
 
-	def necInputLines(self, frequency, skipcards=["FR", "XQ", "RP", "EN"]):
+	def necInputLines(self, frequency, skipcards=["FR", "XQ", "RP", "EN"], segmentation_frequency=None, update_globals=1):
+		#segmentation_frequency overrides the half wave of the autosegmentation, the segment
+		#references of EX, LD, NT and TL cards follow the wires' segment counts
+		autosegment = self.nec_file_input.autosegment
+		if segmentation_frequency and autosegment[0]:
+			self.nec_file_input.autosegment = (autosegment[0], 150.0/segmentation_frequency)
+		try:
+			return self.necInputLines_(frequency, skipcards, update_globals)
+		finally:
+			self.nec_file_input.autosegment = autosegment
+
+	def necInputLines_(self, frequency, skipcards, update_globals):
 		lines=[]
 		math_lines = []
 		comments = []
-		self.nec_file_input.updateGlobalVars()
+		if update_globals:
+			self.nec_file_input.updateGlobalVars()
 		varlines = self.nec_file_input.srclines
 		comments = self.nec_file_input.comments
 		fn = lambda x:self.formatNumber(x,0)
@@ -244,7 +271,9 @@ class NecEvaluator:
 				raise EvalError("Failed to generate engine input. Reason:\n"+str(e)+"\nAround line:\n"+" ".join(ln))
 			
 		if self.wire_structure and self.options.validate_geometry: 
-			if not self.wire_structure.testLineIntersections(math_lines):
+			with self.timing.phase("geometry"):
+				valid = self.wire_structure.testLineIntersections(math_lines)
+			if not valid:
 				return []
 		segment_count += sum(list(map(lambda x: x[1], math_lines)))
 		return lines, segment_count
@@ -276,6 +305,9 @@ class NecEvaluator:
 			lines.append("FR 0 %d 0 0 %g %g"%(ranges[0][2],ranges[0][0],ranges[0][1]))
 			lines.append("PQ -1")
 			lines.append("PT -1")
+			for r in ranges[1:]:
+				lines.append("XQ")
+				lines.append("FR 0 %d 0 0 %g %g"%(r[2],r[0],r[1]))
 		lines.append("XQ")
 		lines.append("EN")
 		return lines
@@ -311,22 +343,70 @@ class NecEvaluator:
 		lines.append("EN")
 		return lines
 
-	def handlePopen(self, popen):
+	def engineCommand(self, args):
+		#the engine limits are set by a launcher in front of the engine
+		if self.process_monitor:
+			return self.process_monitor.command(args)
+		return args
+
+	def handlePopen(self, popen, engine, segments=0):
+		from nec.process_monitor import waitProcess
+		usage = None
 		try:
 			if self.process_monitor:
 				self.process_monitor.addProcess(popen)
-			popen.wait()
+			usage = waitProcess(popen)
 		finally:
 			if self.process_monitor:
 				self.process_monitor.removeProcess(popen)
+				self.process_monitor.account(engine, usage, popen.returncode, segments)
 
-	def runEngine(self, engine, nec_input, nec_output, engine_cin, wd):
+	def runEngine(self, engine, nec_input, nec_output, engine_cin, wd, segments=0):
+		if not self.engine_archive:
+			self.runEngine_(engine, nec_input, nec_output, engine_cin, wd, segments)
+			return
+		from nec.engine_archive import readFile
+		deck = readFile(os.path.join(wd, nec_input))
+		if self.engine_archive.replay(deck, os.path.join(wd, nec_output)):
+			return
+		self.runEngine_(engine, nec_input, nec_output, engine_cin, wd, segments)
+		self.engine_archive.record(deck, os.path.join(wd, nec_output))
+
+	def runEngine_(self, engine, nec_input, nec_output, engine_cin, wd, segments):
+		if self.workers:
+			f = open(os.path.join(wd, nec_input), "rt")
+			try: deck = f.read()
+			finally: f.close()
+			#the engine phase is the request to the worker, not the wait for a free one
+			output = self.workers.run(engine, deck, self.timing.phase("engine", os.path.basename(nec_input)))
+			if output is not None:
+				f = open(os.path.join(wd, nec_output), "wt")
+				try: f.write(output)
+				finally: f.close()
+				return
+			#no worker left, run it here
+		self.runLocalEngine(engine, nec_input, nec_output, engine_cin, wd, segments)
+
+	def runLocalEngine(self, engine, nec_input, nec_output, engine_cin, wd, segments=0):
+		#the engines running at once are limited by their predicted memory
+		reserved = 0
+		if self.process_monitor:
+			reserved = self.process_monitor.reserve(engine, segments)
+		try:
+			#the engine phase starts once the memory budget lets the engine run
+			with self.timing.phase("engine", os.path.basename(nec_input)):
+				self.runLocalEngine_(engine, nec_input, nec_output, engine_cin, wd, segments)
+		finally:
+			if self.process_monitor:
+				self.process_monitor.release(reserved)
+
+	def runLocalEngine_(self, engine, nec_input, nec_output, engine_cin, wd, segments=0):
 		import subprocess as sp
 		if self.options.engine_takes_cmd_args:
 			if engine == "nec2c" or engine == "nec2++":
-				self.handlePopen(sp.Popen([engine, "-i", nec_input, "-o", nec_output], cwd=wd))
+				self.handlePopen(sp.Popen(self.engineCommand([engine, "-i", nec_input, "-o", nec_output]), cwd=wd), engine, segments)
 			else:
-				self.handlePopen(sp.Popen([engine, nec_input, nec_output], cwd=wd))
+				self.handlePopen(sp.Popen(self.engineCommand([engine, nec_input, nec_output]), cwd=wd), engine, segments)
 		else:
 			try:
 				f = open(engine_cin,"wt")
@@ -336,7 +416,7 @@ class NecEvaluator:
 				f.write("\n")
 				f.close()
 				f = open(engine_cin)
-				self.handlePopen(sp.Popen(engine, stdin=f, stdout=open(os.devnull, "w"), cwd=wd))
+				self.handlePopen(sp.Popen(self.engineCommand([engine]), stdin=f, stdout=open(os.devnull, "w"), cwd=wd), engine, segments)
 			finally:
 				f.close()
 
@@ -351,11 +431,12 @@ class NecEvaluator:
 		try:
 			os.mkdir(wd)
 		except : pass
-		wd = os.path.join(wd, str(number))
+		id=id+'_'+str(number)
+		#one working directory per evaluation and chunk, so concurrent evaluations do not share engine scratch files
+		wd = os.path.join(wd, id)
 		try:
 			os.mkdir(wd)
 		except : pass
-		id=id+'_'+str(number)
 		
 		nec_input = "nec2_"+id+".inp"
 		agt_input = nec_input[0:-3]+"agt"
@@ -370,29 +451,40 @@ class NecEvaluator:
 
 		nec_input_lines, segments = nec_input_lines
 
-		file = open(nec_input, "wt") #".",
-		fslines = self.freqSweepLines(nec_input_lines,sweep)
-		if not fslines:
-			return ()
-		try: 
-			file.write("\n".join(fslines)+"\n")
-		finally: file.close()
-		if (self.options.agt_correction or get_agt_scores) and (use_agt is None):
-			file = open(agt_input, "wt") #".",
+		with self.timing.phase("deck"):
+			file = open(nec_input, "wt") #".",
+			fslines = self.freqSweepLines(nec_input_lines,sweep)
+			if not fslines:
+				return ()
 			try: 
-				file.write("\n".join(self.agtLines(nec_input_lines,sweep))+"\n")
+				file.write("\n".join(fslines)+"\n")
 			finally: file.close()
+			if (self.options.agt_correction or get_agt_scores) and (use_agt is None):
+				file = open(agt_input, "wt") #".",
+				try: 
+					file.write("\n".join(self.agtLines(nec_input_lines,sweep))+"\n")
+				finally: file.close()
 		
 		agt = 1.0
 		engine = chooseEngine(self.options.engine, segments)
 		if use_agt is not None:
 			agt = use_agt
 		elif self.options.agt_correction or get_agt_scores :
-			self.runEngine(engine, engine_agt_input, engine_nec_output, exe_input, wd)
-			agt = self.parseAgt(nec_output)
+			self.runEngine(engine, engine_agt_input, engine_nec_output, exe_input, wd, segments)
+			with self.timing.phase("parse"):
+				agt = self.parseAgt(nec_output)
 			if get_agt_scores:
 				return (nec_output,agt)
-		self.runEngine(engine, engine_nec_input, engine_nec_output, exe_input, wd)
+		if self.interpolation and self.interpolation.applies(sweep):
+			def runFrequencies(sub_sweep):
+				file = open(nec_input, "wt")
+				try:
+					file.write("\n".join(self.freqSweepLines(nec_input_lines,sub_sweep))+"\n")
+				finally: file.close()
+				self.runEngine(engine, engine_nec_input, engine_nec_output, exe_input, wd, segments)
+				return nec_output
+			return (self.interpolation.sweep(sweep, runFrequencies, agt),agt)
+		self.runEngine(engine, engine_nec_input, engine_nec_output, exe_input, wd, segments)
 		return (nec_output,agt)
 		
 	def runSweepT(self, nec_input_lines, sweep, number, result_map, result_lock, get_agt_scores, use_agt, id ):
@@ -545,9 +637,35 @@ class NecEvaluator:
 		except:
 			pass
 
+	def sweepInputLines(self, update_globals=1):
+		#the SY variables are evaluated once for all sweeps, update_globals=0 uses the current globals
+		with self.timing.phase("deck"):
+			return self.sweepInputLines_(update_globals)
+
+	def sweepInputLines_(self, update_globals):
+		inputs = []
+		for sweep in self.sweeps:
+			try:
+				if update_globals:
+					self.nec_file_input.updateGlobalVars()
+					update_globals = 0
+				#each engine run is segmented for its own highest frequency
+				inputs.append(self.necInputLines(sweep.midFrequency(), segmentation_frequency=sweep.maxFrequency(), update_globals=0))
+			except InputError:
+				raise
+			except:
+				if not self.options.quiet: traceback.print_exc()
+				return None
+		return inputs
+
 	def runSweeps(self, get_agt_scores = 0, use_agt = None, id = ""):
 		#if self.options.cleanup:
 		#	self.cleanupOutput(self.options.cleanup)
+		inputs = self.sweepInputLines()
+		if inputs is None: return
+		return self.runSweepInputs(inputs, get_agt_scores, use_agt, id)
+
+	def runSweepInputs(self, inputs, get_agt_scores = 0, use_agt = None, id = ""):
 		results={}
 		number=0
 
@@ -556,26 +674,14 @@ class NecEvaluator:
 		threads = []
 		for i in range(len(self.sweeps)-1):
 			sweep = self.sweeps[i]
-			try:
-				nec_input_lines = self.necInputLines(sweep.midFrequency())
-			except InputError:
-				raise
-			except:
-				if not self.options.quiet: traceback.print_exc()
-				return
+			nec_input_lines = inputs[i]
 			threads.append(Thread(target=self.runSweepT, args=(nec_input_lines, sweep, number,results, result_lock,get_agt_scores,use_agt,id )))
 			threads[-1].start()
 			number = number+1
 
 		r = None
 		sweep = self.sweeps[-1]
-		try:
-			nec_input_lines = self.necInputLines(sweep.midFrequency())
-		except InputError:
-			raise
-		except:
-			if not self.options.quiet: traceback.print_exc()
-			return
+		nec_input_lines = inputs[-1]
 		try:
 			ua = None
 			if use_agt and number in use_agt:
@@ -607,7 +713,7 @@ class NecEvaluator:
 		printOut("Input file : %s"%self.options.input )
 		printOut("Freq sweeps: %s"%str(self.options.sweeps) )
 		if self.nec_file_input.autosegment[0]:
-			printOut("Autosegmentation: %d per %g"%self.nec_file_input.autosegment)
+			printOut("Autosegmentation: %d per half wave at the highest frequency of each engine run"%self.nec_file_input.autosegment[0])
 		else:
 			printOut("Autosegmentation: NO")
 		printOut("\n")
@@ -653,6 +759,10 @@ class OptionParser(optparse.OptionParser):
 		self.add_option("-n", "--num-cores", type="int", default=ncores, help="number of cores to be used, default=%default")
 		self.add_option("-a", "--auto-segmentation", metavar="NUM_SEGMENTS", type="int", default=autosegmentation, help="autosegmentation level - set to 0 to turn autosegmentation off, default=%default")
 		self.add_option("-e", "--engine", metavar="NEC_ENGINE", default="", help="nec engine file name, default=%default")
+		self.add_option("--workers", default="", metavar="HOST:PORT,...", help="comma separated addresses of nec.worker processes (python -m nec.worker) to run the engines on. Tasks are spread by the workers' engine slots and retried on another worker when one is lost. Engines run locally when no worker is reachable.")
+		self.add_option("--worker-timeout", default=3600, type="int", help="seconds to wait for a worker to return an engine run before it is considered lost. The default is %default")
+		self.add_option("--engine-record", default="", metavar="FILE", help="store the output of every engine run in the archive FILE (sqlite), keyed by the hash of its deck")
+		self.add_option("--engine-replay", default="", metavar="FILE", help="serve the engine runs whose deck is in the archive FILE (see --engine-record) without running the engine, to profile the rest of an evaluation. Replaying an optimization needs its --seed and options")
 		self.add_option("--engine-takes-cmd-args", default="auto", type="string", help="the nec engine takes command args, default=auto (which means no on windows yes otherwise). Other options are 'yes' or 'no'.")
 		self.add_option("-d", "--min-wire-distance", default=.005, type="float", help="minimum surface-to-surface distance allowed between non-connecting wires, default=%default")
 		self.add_option("--debug", default=0, type="int", help="turn on some logging")
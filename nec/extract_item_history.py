@@ -6,7 +6,36 @@ def floatOrNone(s):
 	if s== "None":return None
 	return float(s)
 
+def parseBinaryLog(filename, population_member):
+	#the member's records of the last run of a binary log and of the runs it resumed
+	from nec.binary_log import BinaryLog
+	log = BinaryLog(filename)
+	generations = log.generations()
+	if not generations:
+		return ()
+	#a run resumed from a checkpoint starts at the checkpoint's generation, the history goes on from the previous run
+	k = len(generations)-1
+	while k > 0 and (generations[k-1][0] == generations[k][0] or generations[k][1] > 0):
+		k -= 1
+	vars = log.vars()
+	scores = []
+	population = []
+	cr_stats=[0]
+	for r in log.records(generations[k][2], generations[-1][3]):
+		if int(r[2]) != population_member: continue
+		score = r[3]
+		if not scores or score < scores[-1]:
+			scores.append(score)
+			new_gen = [None if x != x else x for x in r[4:4+len(vars)]]
+			if population:
+				cr_stats.append(len([1 for i in range(len(vars)) if population[-1][i]!=new_gen[i]]))
+			population.append(new_gen)
+	return (vars,scores, population,cr_stats)
+
 def parseLogFile(filename, np, population_member=0, number_of_lines=None):
+	from nec.binary_log import isBinaryLog
+	if isBinaryLog(filename):
+		return parseBinaryLog(filename, population_member)
 	f = open(filename,"rt")
 	lines = f.readlines()
 	f.close()
@@ -55,7 +84,7 @@ if __name__ == "__main__":
 	import optparse 
 	options = optparse.OptionParser()
 	options.add_option("--de-np", default="50", type="int")
-	options.add_option("-l", "--log-file", default="opt.log")
+	options.add_option("-l", "--log-file", default="opt.log", help="the text log or a binary log written with --binary-log, which needs no --de-np")
 	options.add_option("-n", "--number-of-lines", default=0,type="int")
 	options.add_option("-m", "--member", default=0, type="int")
 	options.add_option("-s", "--cr-stats", default=False, action="store_true")
@@ -1,78 +1,221 @@
 from __future__ import division
+import collections
 from nec.demathutils import mean_value, min_value
 from nec.print_out import printOut
 from datetime import datetime
 
 def floatOrNone(s):
-	if s== "None":return 0
+	if s== b"None":return 0
 	return float(s)
 
-def parseLogFile(filename, full, number_of_lines, population_number):
-	f = open(filename,"rt")
-	lines = f.readlines()
-	f.close()
-	i=-1
-	for j in range(len(lines)):
-		if lines[j].find("Score")!=-1:
-			i=j
-	
-	if i==-1:
-		return ()
+def binaryColumns(record):
+	#the parameters and the range scores like the text log gives them, uncomputed range scores are 0
+	return [0 if v != v else v for v in record[4:]]
 
-	vars = lines[i].split()[1:]
-	lines = lines[i+1:]
-	
-	i=-1
-	for j in range(len(lines)):
-		if lines[j].find("#Total time")!=-1:
-			i=j
-			break
-	if i==-1:
+def parseBinaryLog(filename, full, number_of_lines, population_number):
+	#the last run of a binary log, a generation at a time. The values are those of the text
+	#log of the same run, with the full precision of the evaluation instead of the text formatting
+	from nec.binary_log import BinaryLog
+	log = BinaryLog(filename)
+	runs = log.runs()
+	if not runs:
 		return ()
-	np = int(j / 2)
-	
-	scores = []
-	population = []
-	for i in range(np):
-		ln = lines[i].split()
-		scores.append(float(ln[0]))
-		population.append(list(map(floatOrNone, ln[1:])))
-	
-	lines = lines[np:]
+	start = runs[-1][0]
+	generations = [g for g in log.generations() if g[2] >= start]
+	members = {}
 	count = 1
-	while len(lines):
-		k=[]
-		i = 0
-		while i < np and i < len(lines):
-			if lines[i] and lines[i][0]=='#':
-				del lines[i]
+	for run, generation, gstart, gend in generations:
+		k = []
+		evaluated = 0
+		for r in log.records(gstart, gend):
+			m = int(r[2])
+			if m < 0: continue
+			s = r[3]
+			if m not in members:
+				#the first record of a member is its initial score
+				members[m] = (s, binaryColumns(r))
 				continue
-			ln = lines[i].split()
-			s = float(ln[0])
-			if s < scores[i]:
-				k.append((i,"%.4g"%s))
-				scores[i] = s
-				population[i] = list(map(floatOrNone, ln[1:]))
-			i+=1
-		lines = lines[i:]
-		if not number_of_lines or len(lines) < number_of_lines*np:
-			if i==np:
+			evaluated += 1
+			if s < members[m][0]:
+				k.append((m,"%.4g"%s))
+				members[m] = (s, binaryColumns(r))
+		scores = [members[m][0] for m in sorted(members)]
+		if evaluated and (not number_of_lines or generations[-1][1]-generation < number_of_lines):
+			if evaluated >= len(members):
 				printOut("Iteration %d [%.6g:%.6g] - %d new offsprings - "%(count,min_value(scores), mean_value(scores),len(k)) + str(k).replace("'","") )
 			elif not full:
-				printOut( "(*%d)Iteration %d [%.6g, %.6g] - %d new offsprings - "%(i,count,min_value(scores), mean_value(scores),len(k)) + str(k).replace("'","") )
-				
-		count = count +1
+				printOut( "(*%d)Iteration %d [%.6g, %.6g] - %d new offsprings - "%(evaluated,count,min_value(scores), mean_value(scores),len(k)) + str(k).replace("'","") )
+		if evaluated:
+			count = count +1
 		if population_number and count == population_number:
 			break
+	if not members:
+		return ()
+	return (log.columns[4:], [members[m][0] for m in sorted(members)], [members[m][1] for m in sorted(members)])
+
+def parseLogFile(filename, full, number_of_lines, population_number, tail=0):
+	from nec.binary_log import isBinaryLog
+	if isBinaryLog(filename):
+		return parseBinaryLog(filename, full, number_of_lines, population_number)
+	f = open(filename,"rb")
+	try:
+		return parseTextLog(f, full, number_of_lines, population_number, tail)
+	finally:
+		f.close()
+
+def headerBefore(f, offset):
+	#the column names of the run the offset falls in, the last header line before it
+	block = 1<<20
+	end = offset
+	while end > 0:
+		start = max(0, end-block)
+		f.seek(start)
+		lines = f.read(end-start).split(b"\n")
+		#the first line started before the block, the next block ends with it
+		first = lines.pop(0) if start else b""
+		for line in reversed(lines):
+			if line.find(b"Score")!=-1 and line[0:1] != b"#":
+				return line.decode().split()[1:]
+		end = start+len(first) if lines else start
+	return None
+
+class TextLogReader:
+	"""The population at the end of the last run of a text log, read in one pass.
+
+	The initial population is the first half of the lines before the first
+	"#Total time" line, every following group of population size lines is a
+	generation, line i of a group being the trial of member i. A reader started
+	in the middle of a run (tail) waits for the first "#Total time" line and
+	takes the lines of the following generation as the first guess of every
+	member, which is the exact population only for the members replaced later.
+	"""
+	def __init__(self, full, number_of_lines, population_number, vars=None, aligned=1):
+		self.full = full
+		self.number_of_lines = number_of_lines
+		self.population_number = population_number
+		self.progress = []
+		if number_of_lines > 0:
+			self.progress = collections.deque(maxlen=number_of_lines)
+		self.start(vars, aligned)
+
+	def start(self, vars, aligned):
+		self.vars = vars
+		self.aligned = aligned
+		self.np = None
+		self.pending = []
+		self.scores = []
+		self.population = []
+		self.replaced = set()
+		self.progress.clear()
+		self.count = 1
+		self.k = []
+		self.i = 0
 
-	return (vars,scores, population)
+	def read(self, f):
+		in_header = 0
+		for line in f:
+			if not line.endswith(b"\n"):
+				#the line being written by a running optimizer
+				break
+			if line.find(b"============")!=-1:
+				#the comment block before the column names of a run
+				in_header = 1
+			elif line.find(b"Score")!=-1 and line[0:1] != b"#":
+				#a new run, only the last one counts
+				in_header = 0
+				self.start(line.decode().split()[1:], 1)
+			elif in_header:
+				continue
+			elif line[0:1] == b"#":
+				if self.np is None and line.startswith(b"#Total time"):
+					self.firstGenerationEnd()
+			elif not line.strip():
+				continue
+			elif self.np is None:
+				if self.aligned: self.pending.append(line)
+			elif not self.trial(line):
+				break
+		if self.i and self.np:
+			self.generationEnd()
+		for p in self.progress:
+			printOut(p)
+
+	def firstGenerationEnd(self):
+		if not self.aligned:
+			self.aligned = -1
+			return
+		lines = self.pending
+		if not lines: return
+		self.pending = []
+		if self.aligned < 0:
+			#the first whole generation of a tail
+			self.np = len(lines)
+			initial = lines
+			lines = []
+		else:
+			self.np = len(lines)//2
+			initial = lines[0:self.np]
+			lines = lines[self.np:]
+		for line in initial:
+			ln = line.split()
+			self.scores.append(float(ln[0]))
+			#discarded trials have no range scores
+			self.population.append(list(map(floatOrNone, ln[1:]))+max(0, len(self.vars or [])-len(ln)+1)*[0])
+		for line in lines:
+			self.trial(line)
+
+	def trial(self, line):
+		#returns 0 once the requested number of generations is read
+		ln = line.split()
+		s = float(ln[0])
+		i = self.i
+		if s < self.scores[i]:
+			self.k.append((i,"%.4g"%s))
+			self.scores[i] = s
+			self.population[i] = list(map(floatOrNone, ln[1:]))
+			self.replaced.add(i)
+		self.i += 1
+		if self.i < self.np:
+			return 1
+		self.generationEnd()
+		self.count = self.count +1
+		self.k = []
+		self.i = 0
+		return not (self.population_number and self.count == self.population_number)
 
+	def generationEnd(self):
+		if self.number_of_lines < 0: return
+		scores, k = self.scores, self.k
+		if self.i==self.np:
+			self.progress.append("Iteration %d [%.6g:%.6g] - %d new offsprings - "%(self.count,min_value(scores), mean_value(scores),len(k)) + str(k).replace("'","") )
+		elif not self.full:
+			self.progress.append( "(*%d)Iteration %d [%.6g, %.6g] - %d new offsprings - "%(self.i,self.count,min_value(scores), mean_value(scores),len(k)) + str(k).replace("'","") )
+
+
+def parseTextLog(f, full, number_of_lines, population_number, tail=0):
+	offset = 0
+	if tail:
+		f.seek(0, 2)
+		offset = max(0, f.tell()-tail)
+	if not offset:
+		reader = TextLogReader(full, number_of_lines, population_number)
+	else:
+		reader = TextLogReader(full, number_of_lines, population_number, headerBefore(f, offset), 0)
+		f.seek(offset)
+		#a partial line
+		f.readline()
+	reader.read(f)
+	if not reader.population or reader.vars is None:
+		return ()
+	if reader.aligned < 0 and len(reader.replaced) < reader.np:
+		printOut("%d of %d members were not replaced in the last %d bytes, they are the best trials read"%(reader.np-len(reader.replaced), reader.np, tail))
+	return (reader.vars, reader.scores, reader.population)
 
 if __name__ == "__main__":
 	import optparse 
 	options = optparse.OptionParser()
 	options.add_option("--de-np", default="50", type="int", help="deprecated, ignored")
-	options.add_option("-l", "--log-file", default="opt.log")
+	options.add_option("-l", "--log-file", default="opt.log", help="the text log or a binary log written with --binary-log")
 	options.add_option("-f", "--full", default=False,action="store_true")
 	options.add_option("-p", "--progress-only", default=False,action="store_true")
 	options.add_option("-n", "--number-of-lines", default=0,type="int")
@@ -80,8 +223,9 @@ if __name__ == "__main__":
 	options.add_option("-c", "--generation-count", default=0, type="int")
 	options.add_option("-r", "--restart-file",  default=False, action="store_true")
 	options.add_option("-s", "--stats", default=False, action="store_true")
+	options.add_option("-t", "--tail", default=0, type="int", metavar="BYTES", help="read only the last BYTES of a text log. Much faster on huge logs, but members not replaced in that part are approximated by their best trials")
 	opts, args = options.parse_args()
-	p = parseLogFile(opts.log_file, opts.full, opts.number_of_lines,opts.generation_count)
+	p = parseLogFile(opts.log_file, opts.full, opts.number_of_lines,opts.generation_count, opts.tail)
 	if opts.progress_only:exit(0)
 	if not p:
 		printOut( "Failed to extract population")
@@ -0,0 +1,163 @@
+from __future__ import division
+import math
+from threading import Lock
+from nec.output_parser import FrequencyData, NecOutputParser
+
+# Frequency interpolation of engine results.
+# The impedance and the pattern gains of a model are smooth functions of the
+# frequency, so a sweep chunk does not need an engine solution at every
+# channel. The engine first runs on --frequency-interpolation evenly spaced
+# channels of the chunk and the other channels are filled in with a
+# barycentric rational interpolant (Floater-Hormann) through the solved ones.
+# Wherever the interpolant misses a solved channel by more than
+# --interpolation-tolerance when that channel is left out, the channels half
+# way to its neighbours are solved as well and the check is repeated.
+
+DEGREE = 3
+
+def weights(x, d=DEGREE):
+	#Floater-Hormann weights of the nodes x, the interpolant has no real poles
+	n = len(x)-1
+	d = min(d, n)
+	w = []
+	for k in range(n+1):
+		s = .0
+		for i in range(max(0, k-d), min(k, n-d)+1):
+			p = 1.0
+			for j in range(i, i+d+1):
+				if j != k:
+					p /= abs(x[k]-x[j])
+			s += p
+		w.append(s if (k-d) % 2 == 0 else -s)
+	return w
+
+def coefficients(x, w, t):
+	#the interpolated value at t is sum(c[k]*y[k]) for any values y at the nodes
+	for k in range(len(x)):
+		if t == x[k]:
+			c = len(x)*[.0]
+			c[k] = 1.0
+			return c
+	c = [w[k]/(t-x[k]) for k in range(len(x))]
+	s = sum(c)
+	return [ck/s for ck in c]
+
+def interpolate(x, ys, t, w=None):
+	#ys holds one vector of values per node, all of them share the coefficients
+	if w is None:
+		w = weights(x)
+	c = coefficients(x, w, t)
+	return [sum(c[k]*ys[k][i] for k in range(len(x))) for i in range(len(ys[0]))]
+
+
+class FrequencyInterpolation:
+	def __init__(self, options):
+		self.options = options
+		self.samples = max(3, options.frequency_interpolation)
+		self.tolerance = options.interpolation_tolerance
+		self.lock = Lock()
+		self.channels = 0
+		self.engine_channels = 0
+
+	def applies(self, sweep):
+		return len(sweep.ranges) == 1 and sweep.ranges[0][1] and sweep.ranges[0][2] > self.samples
+
+	def status(self):
+		with self.lock:
+			if not self.channels:
+				return "Frequency interpolation: no engine runs"
+			return "Frequency interpolation: the engine solved %d of %d channels (%.0f%%)"%(self.engine_channels, self.channels, 100*self.engine_channels/self.channels)
+
+	def keys(self, sampled):
+		fds = list(sampled.values())
+		hkeys = set(fds[0].horizontal.keys())
+		vkeys = set(fds[0].vertical.keys())
+		for fd in fds[1:]:
+			hkeys &= set(fd.horizontal.keys())
+			vkeys &= set(fd.vertical.keys())
+		return sorted(hkeys), sorted(vkeys)
+
+	def values(self, fd, hkeys, vkeys):
+		return [fd.real, fd.imag, fd.gain]+[fd.horizontal[a] for a in hkeys]+[fd.vertical[t] for t in vkeys]
+
+	def error(self, predicted, actual):
+		#the impedance error as the error of the reflection coefficient, the gain errors
+		#as power errors relative to the pattern peak
+		z0 = self.options.char_impedance
+		dz = abs(complex(predicted[0]-actual[0], predicted[1]-actual[1]))
+		zz = abs(complex(actual[0]+z0, actual[1]))
+		err = 2*z0*dz/(zz*zz)
+		peak = math.pow(10, max(actual[2:])/10)
+		for i in range(2, len(actual)):
+			err = max(err, abs(math.pow(10, predicted[i]/10)-math.pow(10, actual[i]/10))/peak)
+		return err
+
+	def nodes(self, freqs, sampled):
+		nodes = sorted(sampled.keys())
+		hkeys, vkeys = self.keys(sampled)
+		return nodes, [freqs[i] for i in nodes], [self.values(sampled[i], hkeys, vkeys) for i in nodes], hkeys, vkeys
+
+	def refine(self, freqs, sampled):
+		#leave-one-out check of every inner node
+		nodes, x, ys, hkeys, vkeys = self.nodes(freqs, sampled)
+		todo = set()
+		for k in range(1, len(nodes)-1):
+			predicted = interpolate(x[0:k]+x[k+1:], ys[0:k]+ys[k+1:], x[k])
+			if self.error(predicted, ys[k]) <= self.tolerance: continue
+			for a, b in ((nodes[k-1], nodes[k]), (nodes[k], nodes[k+1])):
+				if b-a > 1:
+					todo.add((a+b)//2)
+		return sorted(todo)
+
+	def fill(self, freqs, sampled):
+		nodes, x, ys, hkeys, vkeys = self.nodes(freqs, sampled)
+		w = weights(x)
+		frequencies = []
+		invalid = []
+		nh = len(hkeys)
+		for i in range(len(freqs)):
+			if i in sampled:
+				frequencies.append(sampled[i])
+				continue
+			y = interpolate(x, ys, freqs[i], w)
+			if y[0] <= 0:
+				#not a physical impedance, this channel needs the engine
+				invalid.append(i)
+				continue
+			near = sampled[min(nodes, key=lambda j: abs(j-i))]
+			fd = FrequencyData(near.char_impedance)
+			fd.freq = freqs[i]
+			fd.real, fd.imag, fd.gain = y[0:3]
+			fd.horizontal = dict(zip(hkeys, y[3:3+nh]))
+			fd.vertical = dict(zip(vkeys, y[3+nh:]))
+			fd.angle = near.angle
+			fd.AGT = near.AGT
+			fd.agt = near.agt
+			frequencies.append(fd)
+		return frequencies, invalid
+
+	def sweep(self, sweep, runFrequencies, agt):
+		"""Returns the FrequencyData of all channels of the sweep.
+
+		runFrequencies(sub_sweep) runs the engine on a Sweep of single
+		frequencies and returns the name of its output file.
+		"""
+		from nec.eval import Sweep
+		start, step, count = sweep.ranges[0]
+		freqs = [start+i*step for i in range(count)]
+		sampled = {}
+		todo = sorted(set([int(round(i*(count-1)/(self.samples-1))) for i in range(self.samples)]))
+		while todo:
+			sub_sweep = Sweep([(freqs[i], 0, 1) for i in todo], len(todo)*[sweep.angles[0]], sweep.agt_freq, sweep.sweepid)
+			fds = NecOutputParser(runFrequencies(sub_sweep), agt, self.options).frequencies
+			if len(fds) != len(todo):
+				raise RuntimeError("the engine returned %d of %d frequencies"%(len(fds), len(todo)))
+			for i in range(len(todo)):
+				sampled[todo[i]] = fds[i]
+			todo = self.refine(freqs, sampled)
+			if not todo:
+				frequencies, todo = self.fill(freqs, sampled)
+		with self.lock:
+			self.channels += count
+			self.engine_channels += len(sampled)
+		return frequencies
@@ -29,6 +29,8 @@ class NecInputFile:
 		self.lineno_map = {}
 		self.paramlines={}
 		self.segment_references={}
+		self.constraints=[]
+		self.code_cache={}
 		self.autosegment=(0,0)
 		self.frequency = 585
 		self.sweeps = []
@@ -48,8 +50,16 @@ class NecInputFile:
 		if not self.lines: raise InputError("Empty input file")
 		self.parse()
 	
+	def compiled(self, x, mode="eval"):
+		#expressions are compiled once, the same tokens are evaluated for every model
+		code = self.code_cache.get((x, mode))
+		if code is None:
+			code = compile(x.replace("^","**"), "<%s>"%x, mode)
+			self.code_cache[(x, mode)] = code
+		return code
+
 	def evalVarLine(self, line, g=None, l=None):
-		ln = line.replace("^","**")
+		ln = self.compiled(line, "exec")
 		if l is None:
 			d={}
 			exec(ln, {}, d)
@@ -274,6 +284,7 @@ class NecInputFile:
 		self.globals={}
 		self.srclines=[]
 		self.segment_references={}
+		self.constraints=[]
 		self.comments = []
 		#self.fixed_segmentation = []
 		comments_allowed=1
@@ -295,8 +306,11 @@ class NecInputFile:
 			if neccard == "CM" and (ln[0:5].upper()=="CMD--" or ln[0:6].upper()=="CM D--"):
 				if not comments_allowed:
 					raise InputError("CM card after CE card")
-				ln = (ln[5:] if ln[0:5].upper()=="CMD--" else ln[6:]).split(' ')
-				if len (ln) > 1:
+				ln = (ln[5:] if ln[0:5].upper()=="CMD--" else ln[6:]).strip().split(' ')
+				if len(ln) > 1 and ln[0].upper() == "CONSTRAINT":
+					#one constraint per line, not joined like the other options
+					self.constraints.append(" ".join(ln[1:]).strip())
+				elif len (ln) > 1:
 					if ln[0] in self.cmd_options:
 						self.cmd_options[ln[0]] += " "+" ".join(ln[1:])
 					else:
@@ -350,6 +364,10 @@ class NecInputFile:
 
 		for i in self.vars.keys():
 			self.vars[i]=float(self.vars[i])
+		for c in self.constraints:
+			try: self.evalToken(c)
+			except Exception as e:
+				raise InputError("Invalid constraint '%s'\nReason: %s"%(c, str(e)))
 
 	def calcLength(self, type, line):
 		if type == "GW":
@@ -419,17 +437,81 @@ class NecInputFile:
 		finally: file.close()
 	
 	def evalToken(self, x):
-		x = x.replace("^","**")
-		return eval(x, necmath.__dict__,self.globals)
+		return eval(self.compiled(x), necmath.__dict__,self.globals)
 
-	def updateGlobalVars(self):
-		self.globals={}
-		self.globals.update(self.vars)
+	def evalGlobals(self, vars, namespace=necmath.__dict__):
+		g = dict(vars)
 		for d in self.dependent_vars:
-			try: self.evalVarLine(d,necmath.__dict__, self.globals)
+			try: self.evalVarLine(d, namespace, g)
 			except Exception as e:
 				raise EvalError("Failed to evaluate variable:  '%s'\n"%(d) + "\nReason: "+str(e))
+		return g
+
+	def updateGlobalVars(self):
+		self.globals = self.evalGlobals(self.vars)
+
+	def globalsMany(self, var_sets):
+		"""Evaluates the SY variables for several sets of independent variable values.
+
+		Returns one globals dict per set, None for the sets which fail to evaluate.
+		With numpy the dependent variables are evaluated once for all sets over
+		arrays of values; expressions which do not work elementwise, and any
+		floating point error during the array evaluation, fall back to one set
+		at a time.
+		"""
+		result = None
+		namespace = necmath.elementwise()
+		if namespace is not None and len(var_sets) > 1:
+			try:
+				result = self.globalsElementwise(var_sets, namespace)
+			except Exception:
+				result = None
+		if result is None:
+			result = len(var_sets)*[None]
+		for i in range(len(var_sets)):
+			if result[i] is not None: continue
+			try:
+				result[i] = self.evalGlobals(var_sets[i])
+			except EvalError:
+				result[i] = None
+		return result
+
+	def globalsElementwise(self, var_sets, namespace):
+		numpy = necmath.numpy
+		n = len(var_sets)
+		arrays = dict([(k, numpy.array([float(v[k]) for v in var_sets])) for k in var_sets[0].keys()])
+		errors = []
+		with numpy.errstate(divide="call", over="call", invalid="call", under="ignore", call=lambda kind, flag: errors.append(kind)):
+			g = self.evalGlobals(arrays, namespace)
+		#an error in either branch of select() raises in the scalar evaluator but numpy only flags it,
+		#without telling which sets caused it, so all of them are evaluated as scalars
+		if errors: return None
+		result = [{} for i in range(n)]
+		finite = numpy.ones(n, dtype=bool)
+		for k, v in g.items():
+			if k == "__builtins__": continue
+			if isinstance(v, numpy.ndarray):
+				if v.shape != (n,): raise ValueError("not elementwise")
+				if v.dtype.kind == "f": finite &= numpy.isfinite(v)
+				v = v.tolist()
+				for i in range(n): result[i][k] = v[i]
+			else:
+				for i in range(n): result[i][k] = v
+		#sets with a division by zero or similar are evaluated again to get the scalar error
+		for i in range(n):
+			if not finite[i]: result[i] = None
+		return result
 		
+	def violatedConstraints(self):
+		#the CMD-- CONSTRAINT expressions not satisfied by the current globals (see updateGlobalVars)
+		violated = []
+		for c in self.constraints:
+			try:
+				if not self.evalToken(c): violated.append(c)
+			except Exception:
+				violated.append(c)
+		return violated
+
 	def parametrizedLines(self, extralines=[], skiptags=[], comments=[]):
 		self.updateGlobalVars()
 		lines=[]
@@ -0,0 +1,242 @@
+from __future__ import division
+import os, sys, random, traceback
+import multiprocessing as mp
+from nec.demathutils import min_index, max_index, mean_value
+from nec.print_out import printOut
+
+# Island model: --islands independent populations of the global optimizer, one
+# process each with its own evaluator, engines and scratch directory. Every
+# --migration-interval generations an island sends its best members to the
+# next one on a ring. The islands send their log lines to the parent, which
+# writes them to the single log file one generation of all islands at a time.
+
+class QueueLog:
+	def __init__(self, queue, island):
+		self.queue = queue
+		self.island = island
+		self.lines = []
+		#the lines of the initial population, known once the first trial is evaluated
+		self.initial_lines = None
+	def write(self, text):
+		self.lines.append(text)
+	def writeFormatted(self, format, *args):
+		self.lines.append(format(*args))
+	def flush(self):
+		pass
+	def close(self):
+		pass
+	def initialPopulationEnd(self):
+		if self.initial_lines is None:
+			self.initial_lines = len([l for l in self.lines if not l.startswith("#")])
+	def endGeneration(self, minv, meanv, vector):
+		self.queue.put(("log", self.island, "".join(self.lines), minv, meanv, vector, self.initial_lines or 0))
+		self.lines = []
+		self.initial_lines = 0
+	def discard(self):
+		self.lines = []
+
+
+def scorePair(score):
+	if hasattr(score, "scores"):
+		return (float(score.scores[0]), float(score.scores[1]))
+	return (float(score), float(score))
+
+
+def islandEvaluator(nec_file_input, options, island, islands, inboxes, log_queue):
+	from nec.opt import NecFileEvaluator
+
+	class IslandEvaluator(NecFileEvaluator):
+		#the first trial ends the initial population, whatever its size (a share of a
+		#restart file, a warm start or --de-np members)
+		def testMemberAgainstScore(self, vector, score, id):
+			self.log.initialPopulationEnd()
+			return NecFileEvaluator.testMemberAgainstScore(self, vector, score, id)
+
+		def testMembersAgainstScores(self, vectors, scores, ids):
+			self.log.initialPopulationEnd()
+			return NecFileEvaluator.testMembersAgainstScores(self, vectors, scores, ids)
+
+		def iterationCallback(self, iter_no, population, scores, improved):
+			NecFileEvaluator.iterationCallback(self, iter_no, population, scores, improved)
+			self.receiveMigrants(population, scores)
+			if (iter_no+1) % max(1, options.migration_interval) == 0:
+				self.sendMigrants(population, scores)
+
+		def sendMigrants(self, population, scores):
+			order = sorted(range(len(scores)), key=lambda i: float(scores[i]))
+			migrants = [(list(population[i]), scorePair(scores[i])) for i in order[0:options.migrants]]
+			inboxes[(island+1) % islands].put(migrants)
+
+		def receiveMigrants(self, population, scores):
+			import queue
+			while True:
+				try:
+					migrants = inboxes[island].get_nowait()
+				except queue.Empty:
+					return
+				for vector, pair in migrants:
+					if vector in population: continue
+					worst = max_index(list(map(float, scores)))
+					if pair[0] < float(scores[worst]):
+						population[worst] = vector
+						scores[worst] = NecFileEvaluator.Score(pair[0], pair[1])
+
+		def print_status(self, minv, meanv, vector, count, improved):
+			NecFileEvaluator.print_status(self, minv, meanv, vector, count, improved)
+			if count == 'Final':
+				#the parent prints the final status of all islands
+				self.log.discard()
+			else:
+				self.log.endGeneration(float(minv), float(meanv), list(map(float, vector)))
+
+	return IslandEvaluator(nec_file_input, options)
+
+
+def islandMain(island, islands, argv, inboxes, log_queue):
+	sys.argv = argv
+	random.seed()
+	from nec import opt
+	nec_file_input, options = opt.loadInput()
+	if options.seed:
+		#every island draws its own sequence
+		random.seed(options.seed+island)
+	if not options.verbose:
+		sys.stdout = open(os.devnull, "wt")
+	if options.warm_start and not options.warm_start_log:
+		options.warm_start_log = [options.log_file]
+	options.log_file = ""
+	if options.binary_log:
+		options.binary_log = "%s.island%d"%(options.binary_log, island)
+	if options.trace:
+		options.trace = "%s.island%d"%(options.trace, island)
+	if options.engine_memory_budget == 0:
+		#the islands share the memory available for the engines
+		from nec.process_monitor import availableMemory, MB
+		available = availableMemory()
+		options.engine_memory_budget = max(1, int(.8*available/islands/MB)) if available else -1
+	elif options.engine_memory_budget > 0:
+		options.engine_memory_budget = max(1, options.engine_memory_budget//islands)
+	options.output = os.path.join(options.output, "island%d"%island)
+	try:
+		os.makedirs(options.output)
+	except OSError: pass
+	evaluator = islandEvaluator(nec_file_input, options, island, islands, inboxes, log_queue)
+	evaluator.log = QueueLog(log_queue, island)
+	#a restart file of an island run holds all islands, each island takes its share
+	evaluator.initial_population = evaluator.initial_population[island::islands]
+	evaluator.initial_scores = evaluator.initial_scores[island::islands]
+	ins_sol_vec = None
+	if options.seed_with_input and island == 0:
+		ins_sol_vec = evaluator.x
+	optimizer = opt.globalOptimizer(evaluator, options, ins_sol_vec)
+	try:
+		optimizer.run()
+	except KeyboardInterrupt:
+		pass
+	except:
+		traceback.print_exc()
+	finally:
+		evaluator.join()
+	population = [list(map(float, p)) for p in optimizer.population]
+	scores = [scorePair(s)[0] for s in optimizer.scores]
+	log_queue.put(("done", island, population, scores))
+
+
+def writeGeneration(evaluator, blocks):
+	#blocks are (island, lines, initial lines). The trial lines of all islands are written first
+	#and their status lines after them, so the log keeps the layout of a single population made
+	#of all island members. The first block of an island starts with the lines of its initial
+	#population, the initial populations of all islands go before the first generation.
+	initial = []
+	trials = []
+	comments = []
+	for island, lines, initial_lines in blocks:
+		t = [l for l in lines if not l.startswith("#")]
+		initial.append(t[0:initial_lines])
+		trials.append(t[initial_lines:])
+		comments += ["#Island %d: %s"%(island, l[1:]) for l in lines if l.startswith("#")]
+	for t in initial+trials:
+		for line in t:
+			evaluator.log.write(line)
+	for line in comments:
+		evaluator.log.write(line)
+
+
+def optimize(nec_file_input, options):
+	from nec.opt import NecFileEvaluator
+	islands = options.islands
+	#the islands write their own binary logs and traces
+	options.binary_log = ""
+	options.trace = ""
+	if options.resume or options.checkpoint_every or options.checkpoint_interval:
+		printOut("Checkpoints and --resume are not supported with --islands, ignored")
+	evaluator = NecFileEvaluator(nec_file_input, options)
+	#the surrogate, if any, lives in the islands
+	evaluator.surrogate = None
+	argv = list(sys.argv)
+	#spawn rather than fork, the parent already runs the process monitor thread
+	ctx = mp.get_context("spawn")
+	log_queue = ctx.Queue()
+	inboxes = [ctx.Queue() for i in range(islands)]
+	processes = []
+	for i in range(islands):
+		p = ctx.Process(target=islandMain, args=(i, islands, argv, inboxes, log_queue))
+		p.start()
+		processes.append(p)
+	if not options.quiet: printOut("Started %d islands"%islands)
+
+	pending = [[] for i in range(islands)]
+	done = {}
+	generation = 0
+	interrupted = 0
+	import queue
+	while len(done) < islands:
+		try:
+			try:
+				msg = log_queue.get(timeout=1)
+			except queue.Empty:
+				for i in range(islands):
+					if i not in done and not processes[i].is_alive():
+						done[i] = None
+						if not options.quiet: printOut("Island %d exited unexpectedly"%i)
+				continue
+			if msg[0] == "log":
+				lines = [l+"\n" for l in msg[2].split("\n") if l and not l.startswith("#Total time")]
+				pending[msg[1]].append((msg[1], lines, msg[3], msg[4], msg[5], msg[6]))
+			else:
+				done[msg[1]] = (msg[2], msg[3])
+			#a generation is written once every island still running has finished it
+			while [1 for i in range(islands) if pending[i]] and not [1 for i in range(islands) if not pending[i] and i not in done]:
+				blocks = [pending[i].pop(0) for i in range(islands) if pending[i]]
+				if evaluator.log:
+					writeGeneration(evaluator, [(b[0], b[1], b[5]) for b in blocks])
+				best = min(blocks, key=lambda b: b[2])
+				meanv = mean_value([b[3] for b in blocks])
+				evaluator.print_status(best[2], meanv, best[4], generation, 0)
+				generation += 1
+		except KeyboardInterrupt:
+			#the islands got the interrupt too, wait for their final populations
+			if interrupted: raise
+			interrupted = 1
+	for p in processes:
+		p.join()
+
+	population = []
+	scores = []
+	for i in range(islands):
+		if done.get(i):
+			population += done[i][0]
+			scores += done[i][1]
+	try:
+		if not population:
+			return
+		if interrupted:
+			evaluator.saveRestart(population, scores)
+		best = min_index(scores)
+		#the final status of all islands, like the optimizer prints it in a single process
+		evaluator.print_status(scores[best], mean_value(scores), population[best], 'Final', 0)
+		evaluator.x = population[best]
+		evaluator.best_score = scores[best]
+		evaluator.evaluateFinalSolution(interrupted)
+	finally:
+		evaluator.join()
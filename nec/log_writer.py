@@ -0,0 +1,111 @@
+from __future__ import division
+import time, atexit, traceback
+import queue
+from threading import Thread, Event
+
+# Buffered log writer: the evaluations put their log lines in a bounded queue
+# and a background thread formats and writes them in batches. The file is
+# flushed at most --log-flush-interval seconds after a line was queued, on
+# flush() (the end of every generation) and on close() or at exit, so a crash
+# loses at most the lines of the last interval. A write error (disk full)
+# stops the writing, the writer thread keeps emptying the queue so nobody
+# blocks on it and the error is raised by the next write(), flush() or close().
+
+QUEUE_SIZE = 10000
+
+class LogWriter:
+	def __init__(self, filename, interval=1.0):
+		self.file = open(filename, "at")
+		self.interval = interval
+		self.queue = queue.Queue(QUEUE_SIZE)
+		self.closed = 0
+		self.error = None
+		self.error_raised = 0
+		self.thread = Thread(target=self.run, name="log writer")
+		self.thread.daemon = True
+		self.thread.start()
+		atexit.register(self.close)
+
+	def checkError(self):
+		if self.error is not None:
+			self.error_raised = 1
+			raise self.error
+
+	def write(self, text):
+		if self.closed: raise ValueError("write to a closed log")
+		self.checkError()
+		self.queue.put(text)
+
+	def writeFormatted(self, format, *args):
+		#the line is formatted by the writer thread, format(*args) returns it
+		if self.closed: raise ValueError("write to a closed log")
+		self.checkError()
+		self.queue.put((format, args))
+
+	def flush(self):
+		#returns once everything written so far is flushed to the file
+		if self.closed: return
+		self.checkError()
+		done = Event()
+		self.queue.put(done)
+		done.wait()
+		self.checkError()
+
+	def close(self):
+		if self.closed: return
+		self.closed = 1
+		self.queue.put(None)
+		self.thread.join()
+		try:
+			self.file.close()
+		except (IOError, OSError) as e:
+			if self.error is None: self.error = e
+		#an error already raised by write or flush is not raised again at exit
+		if not self.error_raised: self.checkError()
+
+	def run(self):
+		last_flush = time.time()
+		dirty = 0
+		while True:
+			timeout = None
+			if dirty:
+				timeout = max(.001, last_flush+self.interval-time.time())
+			batch = []
+			try:
+				batch.append(self.queue.get(timeout=timeout))
+				while True:
+					batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+			lines = []
+			waiting = []
+			stop = 0
+			for item in batch:
+				if item is None:
+					stop = 1
+				elif isinstance(item, Event):
+					waiting.append(item)
+				elif isinstance(item, tuple):
+					try:
+						lines.append(item[0](*item[1]))
+					except Exception:
+						traceback.print_exc()
+				else:
+					lines.append(item)
+			try:
+				if self.error is not None:
+					#the lines queued after a write error are dropped
+					lines = []
+				if lines:
+					self.file.write("".join(lines))
+					dirty = 1
+				if dirty and (waiting or stop or time.time()-last_flush >= self.interval):
+					self.file.flush()
+					last_flush = time.time()
+					dirty = 0
+			except Exception as e:
+				self.error = e
+				dirty = 0
+			for e in waiting:
+				e.set()
+			if stop: return
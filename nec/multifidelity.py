@@ -0,0 +1,172 @@
+from __future__ import division
+import copy, random, math
+from nec.print_out import printOut
+
+# Multi-fidelity optimization: the global optimizer first runs with coarse
+# autosegmentation (and optionally a coarser radiation pattern grid). Every
+# --fidelity-check-interval generations a sample of the population is also
+# evaluated with the production settings. When the coarse and fine scores of
+# the sample stop ranking the members alike, or after --coarse-max-generations
+# (by default half of --max-iter, the rest is left to the production phase),
+# the population is rescored with the production settings and a new optimizer
+# continues from it.
+
+class SwitchFidelity(Exception):
+	pass
+
+def ranks(values):
+	order = sorted(range(len(values)), key=lambda i: values[i])
+	r = [0.0]*len(values)
+	i = 0
+	while i < len(order):
+		j = i
+		while j+1 < len(order) and values[order[j+1]] == values[order[i]]:
+			j += 1
+		for k in range(i, j+1):
+			r[order[k]] = (i+j)/2
+		i = j+1
+	return r
+
+def spearman(a, b):
+	ra = ranks(a)
+	rb = ranks(b)
+	n = len(a)
+	ma = sum(ra)/n
+	mb = sum(rb)/n
+	cov = sum((ra[i]-ma)*(rb[i]-mb) for i in range(n))
+	va = sum((x-ma)**2 for x in ra)
+	vb = sum((x-mb)**2 for x in rb)
+	if va == 0 or vb == 0:
+		return 1.0
+	return cov/math.sqrt(va*vb)
+
+#the evaluator state changed by an evaluation besides the log and the best score
+SIDE_EFFECTS = ("agt_score_threshold", "agt_score_threshold_stat1", "agt_score_threshold_stat_count1", "agt_score_threshold_stat2", "agt_score_threshold_stat_count2", "constraint_rejects")
+
+class Fidelity:
+	def __init__(self, evaluator, options):
+		self.evaluator = evaluator
+		self.options = options
+		nfi = evaluator.nec_file_input
+		self.fine_autosegment = nfi.autosegment
+		self.fine_angle_step = nfi.angle_step
+		self.is_coarse = 0
+		self.fine_scores = {}
+		self.generations = 0
+		self.max_generations = options.coarse_max_generations or max(1, options.max_iter//2)
+
+	def coarse(self):
+		nfi = self.evaluator.nec_file_input
+		with self.evaluator.lock:
+			nfi.autosegment = (self.options.coarse_segmentation, self.fine_autosegment[1])
+			if self.options.coarse_angle_step:
+				nfi.angle_step = self.options.coarse_angle_step
+				self.options.angle_step = nfi.angle_step
+			self.is_coarse = 1
+
+	def fine(self):
+		nfi = self.evaluator.nec_file_input
+		with self.evaluator.lock:
+			nfi.autosegment = self.fine_autosegment
+			nfi.angle_step = self.fine_angle_step
+			self.options.angle_step = nfi.angle_step
+			self.is_coarse = 0
+
+	def evaluateFine(self, vectors):
+		#fine evaluations of the coarse phase are not logged, do not change the best score or the
+		#agt and constraint statistics and are not given to the surrogate
+		ev = self.evaluator
+		saved = dict((k, getattr(ev, k)) for k in SIDE_EFFECTS)
+		surrogate = ev.surrogate
+		ev.surrogate = None
+		ev.unlogged = 1
+		self.fine()
+		try:
+			todo = [v for v in vectors if tuple(v) not in self.fine_scores]
+			if todo:
+				scores = ev.targetMany(todo, ["f%d"%i for i in range(len(todo))])
+				for i in range(len(todo)):
+					self.fine_scores[tuple(todo[i])] = scores[i]
+			return [self.fine_scores[tuple(v)] for v in vectors]
+		finally:
+			self.coarse()
+			ev.unlogged = 0
+			ev.surrogate = surrogate
+			for k in SIDE_EFFECTS:
+				setattr(ev, k, saved[k])
+
+	def check(self, iter_no, population, scores):
+		if not self.is_coarse: return
+		self.generations = iter_no+1
+		if self.generations >= self.max_generations:
+			self.report("#Coarse phase generation limit reached")
+			raise SwitchFidelity()
+		if self.generations % max(1, self.options.fidelity_check_interval):
+			return
+		n = len(population)
+		m = min(n, max(3, self.options.fidelity_samples))
+		#the best half of the sample plus random members, the ranking among good members matters most
+		order = sorted(range(n), key=lambda i: float(scores[i]))
+		sample = order[0:m//2]
+		rest = order[m//2:]
+		random.shuffle(rest)
+		sample += rest[0:m-len(sample)]
+		fine = self.evaluateFine([population[i] for i in sample])
+		rho = spearman([float(scores[i]) for i in sample], [float(s) for s in fine])
+		self.report("#Fidelity check: rank correlation %.3f over %d members"%(rho, m))
+		if rho < self.options.fidelity_correlation:
+			raise SwitchFidelity()
+
+	def report(self, text):
+		if self.evaluator.log:
+			self.evaluator.log.write(text+"\n")
+			self.evaluator.log.flush()
+		if not self.options.quiet:
+			printOut("\n"+text[1:])
+
+
+class MultiFidelityOptimizer:
+	name = "multi-fidelity (--coarse-segmentation)"
+
+	def __init__(self, evaluator, options, ins_sol_vec, global_optimizer):
+		self.evaluator = evaluator
+		self.options = options
+		self.fidelity = Fidelity(evaluator, options)
+		self.global_optimizer = global_optimizer
+		self.fidelity.coarse()
+		evaluator.fidelity = self.fidelity
+		self.optimizer = global_optimizer(evaluator, options, ins_sol_vec)
+
+	@property
+	def population(self):
+		return self.optimizer.population
+
+	@property
+	def scores(self):
+		return self.optimizer.scores
+
+	def run(self):
+		try:
+			self.optimizer.run()
+		except SwitchFidelity:
+			pass
+		population = [list(p) for p in self.optimizer.population]
+		self.fidelity.fine()
+		self.fidelity.report("#Switching to production segmentation after %d generations, rescoring %d members"%(self.fidelity.generations, len(population)))
+		ev = self.evaluator
+		#coarse scores are not comparable with fine ones
+		ev.best_score = 999.0
+		if ev.surrogate:
+			ev.surrogate.samples = []
+			ev.surrogate.scores = []
+		#the rescored population is handed to the new optimizer like a warm start
+		ev.initial_population = population
+		ev.initial_scores = len(population)*[None]
+		for i in range(len(population)):
+			if tuple(population[i]) in self.fidelity.fine_scores:
+				ev.initial_scores[i] = self.fidelity.fine_scores[tuple(population[i])]
+		ev.initial_scores_reusable = 1
+		options = copy.copy(self.options)
+		options.max_iter = max(1, self.options.max_iter-self.fidelity.generations)
+		self.optimizer = self.global_optimizer(ev, options, None)
+		self.optimizer.run()
@@ -36,3 +36,30 @@ def normalizeDegree(ang, start = 0):
 	end = start+360
 	while ang >= end:
 		end -=360
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def elementwise():
+	#the functions above working on numpy arrays of values, None without numpy.
+	#functions missing here (min, max, int, ...) fail on arrays and callers fall back to scalars
+	if numpy is None: return None
+	d = dict(globals())
+	d.update({
+		"sin":lambda a: numpy.sin(numpy.radians(a)),
+		"cos":lambda a: numpy.cos(numpy.radians(a)),
+		"tan":lambda a: numpy.tan(numpy.radians(a)),
+		"asin":lambda x: numpy.degrees(numpy.arcsin(x)),
+		"acos":lambda x: numpy.degrees(numpy.arccos(x)),
+		"atan":lambda x: numpy.degrees(numpy.arctan(x)),
+		"atan2":lambda y,x: numpy.degrees(numpy.arctan2(y,x)),
+		"sqrt":numpy.sqrt, "exp":numpy.exp, "log":numpy.log, "log10":numpy.log10,
+		"pow":numpy.power, "fabs":numpy.fabs, "floor":numpy.floor, "ceil":numpy.ceil,
+		"hypot":numpy.hypot, "radians":numpy.radians, "degrees":numpy.degrees,
+		"sgn":numpy.sign, "select":numpy.where,
+	})
+	d["atn"] = d["atan"]
+	d["sqr"] = d["sqrt"]
+	return d
@@ -5,10 +5,13 @@
 from __future__ import division
 import nec.differential_evolution as DE
 import os, math,sys,traceback,time,random
+from threading import RLock
 from nec import eval as ne
 from nec.print_out import printOut
 from datetime import datetime
-from nec.input import NecInputFile, InputError
+from nec.input import NecInputFile, InputError, EvalError
+from nec.binary_log import memberIndex
+from nec.timing import Timing, clock
 
 class NecFileEvaluator:
 
@@ -65,18 +68,63 @@ class NecFileEvaluator:
 			f.write(self.nec_evaluator.formatNumber(float(scores[i]))+"\t"+"\t".join(map(self.nec_evaluator.formatNumber, population[i]))+"\n")
 		f.close()
 
+	#the evaluator part of a checkpoint, see nec.checkpoint
+	checkpoint_state = ("x", "best_score", "errors", "generation", "agt_score_threshold", "agt_score_threshold_stat1", "agt_score_threshold_stat_count1", "agt_score_threshold_stat2", "agt_score_threshold_stat_count2", "surrogate")
+
+	def state(self):
+		state = dict((k, getattr(self, k)) for k in self.checkpoint_state)
+		state["elapsed"] = time.time()-self.start_time
+		return state
+
+	def restoreState(self, state):
+		for k in self.checkpoint_state:
+			setattr(self, k, state[k])
+		self.time = time.time()
+		self.start_time = self.time-state["elapsed"]
+
+	def logPopulation(self, population, scores):
+		if not self.log and not self.binary_log: return
+		for i in range(len(population)):
+			z = sorted(zip(self.opt_vars, self.paramsTransform(population[i])))
+			self.logParamVector([x[1] for x in z], float(scores[i]), None, i)
+
 	def join(self):
 		self.nec_evaluator.process_monitor.join()
+		if self.nec_evaluator.engine_archive:
+			if not self.options.quiet: printOut(self.nec_evaluator.engine_archive.status())
+			self.nec_evaluator.engine_archive.close()
+		if self.options.timing:
+			for line in self.timing.histogram():
+				if self.log: self.log.write("#"+line+"\n")
+				if not self.options.quiet: printOut(line)
+		self.timing.close()
+		if self.log:
+			self.log.close()
+		if self.binary_log:
+			self.binary_log.close()
 		
 	def __init__(self, nec_file_input, options):
 			#.input, options.output,options.auto_segmentation, options.sweeps, options.target_levels,options.num_cores, options.log_file, options.target_function
 		self.log = None
+		self.binary_log = None
+		#generations completed by the optimizer, recorded in the binary log
+		self.generation = 0
+		self.stdout_flush_time = 0
+		#while concurrent evaluations run, their log lines wait here to be written in member order
+		self.log_slots = None
+		self.deferred_log = []
+		#side evaluations (the multi-fidelity checks) are not logged and do not count as the best
+		self.unlogged = 0
 		self.options = options
+		#guards the shared NecInputFile variables, the agt statistics and the log when evaluations run concurrently
+		self.lock = RLock()
 		self.char_impedance = options.char_impedance
 		self.nec_file_input = nec_file_input
 		self.nec_evaluator = ne.NecEvaluator(nec_file_input, options)
-		from nec.process_monitor import ProcessMonitor
-		self.nec_evaluator.process_monitor = ProcessMonitor(options.engine_kill_time)
+		self.timing = Timing(options.timing, options.trace)
+		self.nec_evaluator.timing = self.timing
+		from nec.process_monitor import ProcessMonitor, MB
+		self.nec_evaluator.process_monitor = ProcessMonitor(options.engine_kill_time, options.engine_memory_limit*MB, options.engine_cpu_limit, options.engine_memory_budget*MB if options.engine_memory_budget > 0 else options.engine_memory_budget)
 		#print "calculate_gain set to: %d"%self.options.calc.gain
 		
 		self.opt_vars = []
@@ -95,6 +143,8 @@ class NecFileEvaluator:
 			self.x.append(self.nec_file_input.vars[var])
 
 		self.x = self.paramsBackTransform(self.x)
+		#restart scores are not reused, the population is rescored
+		self.initial_scores_reusable = 0
 		if options.restart:
 			self.initial_population, self.initial_scores = self.parseInitialPopulation(options.restart)
 		else:
@@ -115,46 +165,146 @@ class NecFileEvaluator:
 		self.comments.append("SWR target: %s"%str(self.options.swr_target) )
 		self.comments.append("Target function: %s"%self.options.target_function)
 		if self.nec_file_input.autosegment[0]:
-			printOut("Autosegmentation: %d per %g"%self.nec_file_input.autosegment)
-			self.comments.append("Autosegmentation: %d per %g"%self.nec_file_input.autosegment)
+			printOut("Autosegmentation: %d per half wave at the highest frequency of each engine run"%self.nec_file_input.autosegment[0])
+			self.comments.append("Autosegmentation: %d per half wave at the highest frequency of each engine run"%self.nec_file_input.autosegment[0])
 		else:
 			printOut("Autosegmentation: NO")
 			self.comments.append("Autosegmentation: NO")
 		printOut("\n")
-		self.comments.append("")
 		self.agt_score_threshold = .0
 		self.agt_score_threshold_stat1 = .0
 		self.agt_score_threshold_stat_count1 = 0
 		self.agt_score_threshold_stat2 = .0
 		self.agt_score_threshold_stat_count2 = 0
-			
-
-		if options.log_file:
-			self.log = open(options.log_file,"at")
-			self.log.write("============"*10+"\n")
-			self.log.write("\n".join(self.comments))
-			
-			self.log.write("============"*10+"\n")
+		self.constraint_rejects = 0
+		if self.nec_file_input.constraints:
+			self.comments.append("Constraints: "+"; ".join(self.nec_file_input.constraints))
+		self.surrogate = None
+		if options.surrogate:
+			from nec.surrogate import Surrogate
+			self.surrogate = Surrogate(self.domain, options.surrogate, options.surrogate_neighbors, options.surrogate_recheck, options.surrogate_confidence, seed=options.seed or None)
+			self.comments.append("Surrogate pre-screening: %s"%options.surrogate)
+		if options.frequency_interpolation and not options.frequency_data:
+			from nec.freq_interpolation import FrequencyInterpolation
+			self.nec_evaluator.interpolation = FrequencyInterpolation(options)
+			self.comments.append("Frequency interpolation: %d channels per chunk first, tolerance %g"%(options.frequency_interpolation, options.interpolation_tolerance))
+		self.fidelity = None
+		if options.coarse_segmentation and not options.local_search:
+			self.comments.append("Multi-fidelity: coarse autosegmentation %d, angle step %g"%(options.coarse_segmentation, options.coarse_angle_step or self.nec_file_input.angle_step))
+		if options.islands > 1 and not options.local_search:
+			self.comments.append("Islands: %d, %d migrants every %d generations"%(options.islands, options.migrants, options.migration_interval))
+		self.comments.append("")
 
-			range_scores = []
-			for i in range(len(self.options.sweeps)):
-				range_scores.append( "R%dmg"%i)
-				range_scores.append( "R%dag"%i)
-				range_scores.append( "R%dms"%i)
-				range_scores.append( "R%das"%i)
+		if options.warm_start and not options.restart:
+			self.initial_population, self.initial_scores = self.warmStartPopulation()
+			self.initial_scores_reusable = 1
 
-			self.log.write(self.nec_evaluator.formatName("Score")+"\t"+"\t".join(map(self.nec_evaluator.formatName, sorted(self.opt_vars)))+"\t"+"\t".join(map(self.nec_evaluator.formatName, range_scores))+"\n")
-			self.log.flush()
+		if options.log_file:
+			from nec.log_writer import LogWriter
+			self.log = LogWriter(options.log_file, options.log_flush_interval)
+			self.writeLogHeader()
+		if options.binary_log:
+			from nec.binary_log import BinaryLogWriter
+			self.binary_log = BinaryLogWriter(options.binary_log, ["Score"]+sorted(self.opt_vars)+self.rangeScoreNames())
 		self.time = time.time()
 		self.start_time = self.time
 
+	def writeLogHeader(self):
+		self.log.write("============"*10+"\n")
+		self.log.write("\n".join(self.comments))
+		
+		self.log.write("============"*10+"\n")
+
+		self.log.write(self.nec_evaluator.formatName("Score")+"\t"+"\t".join(map(self.nec_evaluator.formatName, sorted(self.opt_vars)))+"\t"+"\t".join(map(self.nec_evaluator.formatName, self.rangeScoreNames()))+"\n")
+		self.log.flush()
+
+	def rangeScoreNames(self):
+		range_scores = []
+		for i in range(len(self.options.sweeps)):
+			range_scores.append( "R%dmg"%i)
+			range_scores.append( "R%dag"%i)
+			range_scores.append( "R%dms"%i)
+			range_scores.append( "R%das"%i)
+		return range_scores
+
 	def __del__(self):
 		if self.log:
 			self.log.close()
 
 	def initialPopulation(self):
+		if not self.initial_scores_reusable:
+			return (list(self.initial_population),[])
+		#the reused members go to the log as if they were evaluated now, the others are logged when scored
+		for i in range(len(self.initial_population)):
+			if self.initial_scores[i] is not None:
+				self.logPopulation([self.initial_population[i]], [self.initial_scores[i]])
 		return (list(self.initial_population),list(self.initial_scores))
 
+	def logHeaderKey(self, header):
+		#the header lines which must match for logged scores to be reused
+		skip = ("Input file:", "Surrogate pre-screening:", "Islands:")
+		return [l.strip() for l in header if l.strip() and not l.strip().startswith(skip)]
+
+	def warmStartSize(self):
+		#the initial population size of the active global optimizer
+		if self.options.optimizer == "cmaes":
+			return self.options.cma_lambda if self.options.cma_lambda > 0 else 4+int(3*math.log(self.n))
+		return self.options.de_np
+
+	def warmStartPopulation(self):
+		from nec.parse_log_file import logRuns
+		files = self.options.warm_start_log or [self.options.log_file]
+		key = self.logHeaderKey(self.comments)
+		sorted_vars = sorted(self.opt_vars)
+		columns_count = 1+len(sorted_vars)+4*len(self.options.sweeps)
+		scored = {}
+		unscored = {}
+		for fn in files:
+			for header, columns, rows in logRuns(fn):
+				if columns[1:1+len(sorted_vars)] != sorted_vars:
+					continue
+				reuse = self.logHeaderKey(header) == key and len(columns) == columns_count
+				for row in rows:
+					#rows without range scores are discarded trials logged with a fake score
+					if len(row) != len(columns) or row[0] >= 1000:
+						continue
+					vector = [row[1+sorted_vars.index(v)] for v in self.opt_vars]
+					clamped = self.paramsBackTransform(vector)
+					t = tuple(clamped)
+					if reuse and clamped == vector:
+						scored[t] = min(row[0], scored.get(t, row[0]))
+					else:
+						unscored[t] = min(row[0], unscored.get(t, row[0]))
+		candidates = sorted([(s, v, 1) for v, s in scored.items()])+sorted([(s, v, 0) for v, s in unscored.items() if v not in scored])
+		size = self.warmStartSize()
+
+		population = []
+		scores = []
+		normalized = []
+		d = self.options.warm_start_distance
+		for s, v, reuse in candidates:
+			x = [(v[i]-self.domain[i][0])/(self.domain[i][1]-self.domain[i][0]) if self.domain[i][1] > self.domain[i][0] else 0 for i in range(self.n)]
+			if [1 for y in normalized if max([abs(x[i]-y[i]) for i in range(self.n)]) < d]:
+				continue
+			normalized.append(x)
+			population.append(list(v))
+			scores.append(NecFileEvaluator.Score(s, None) if reuse else None)
+			if len(population) == size:
+				break
+		#members with reused scores first, so the log keeps the order of the population
+		order = sorted(range(len(population)), key=lambda i: scores[i] is None)
+		population = [population[i] for i in order]
+		scores = [scores[i] for i in order]
+		while len(population) < size:
+			population.append([random.uniform(self.domain[i][0], self.domain[i][1]) for i in range(self.n)])
+			scores.append(None)
+		if self.surrogate:
+			for v, s in scored.items():
+				self.surrogate.add(list(v), s)
+		reused = len([1 for s in scores if s is not None])
+		printOut("Warm start: %d logged vectors, %d members with reused scores, %d to evaluate"%(len(scored)+len(unscored), reused, len(population)-reused))
+		return (population, scores)
+
 	def targetLevel(self, rangeno, freqno, levels):
 		r = self.options.sweeps[rangeno]
 		t = levels[rangeno]
@@ -192,11 +342,14 @@ class NecFileEvaluator:
 
 		raise RuntimeError("frequence %.3f out of all ranges"%freq)
 
-	def evaluateFinalSolution(self, interrupted=0):
-		vector = self.paramsTransform(self.x)
+	def setVars(self, vector):
 		for i in range(len(self.opt_vars)):
 			var = self.opt_vars[i]
 			self.nec_file_input.vars[var]=vector[i]
+
+	def evaluateFinalSolution(self, interrupted=0):
+		vector = self.paramsTransform(self.x)
+		self.setVars(vector)
 		fn = ("%.3f"%self.best_score)
 		fn = fn.replace(".-","-")
 		fn = fn.replace(".","_")
@@ -205,9 +358,14 @@ class NecFileEvaluator:
 		self.nec_evaluator.writeNecInput("final"+fn)
 		self.nec_evaluator.writeParametrized("output"+fn, comments = self.comments+["Score %g"%self.best_score,""])
 		if interrupted: return
+		#the final results come from the engine at every frequency
+		self.nec_evaluator.interpolation = None
 		self.nec_evaluator.evaluate()
 	
 	def iterationCallback(self, iter_no, population, scores, improved):
+		self.generation = iter_no+1
+		if self.fidelity:
+			self.fidelity.check(iter_no, population, scores)
 		return
 		if not self.log or not self.options.output_population: return
 		self.log.write("-------------------------Population on Iteration # %d-------------------------\n"%iter_no)
@@ -216,21 +374,25 @@ class NecFileEvaluator:
 		self.log.write("--------------------------------------------------------------------------------\n")
 		self.log.flush()
 
-	def logParamVector(self, vector, score, range_results=None):
+	def logParamVector(self, vector, score, range_results=None, member=-1):
+		range_scores=[]
 		if range_results:
-			range_scores=[]
 			for i in range(len(self.options.sweeps)):
 				range_scores.append(range_results[i].max("gain_diff"))
 				range_scores.append(range_results[i].aveLog("gain_diff"))
 				range_scores.append(range_results[i].max("swr"))
 				range_scores.append(range_results[i].ave("swr"))
+		if self.binary_log:
+			self.binary_log.append(self.generation, member, float(score), vector, range_scores)
+		if not self.log: return
+		#formatted by the log writer thread
+		self.log.writeFormatted(self.formatParamVector, score, vector, range_scores)
 
-			range_scores = "\t"+"\t".join(map(self.nec_evaluator.formatNumber, range_scores))
-				
-		else:
-			range_scores=""
-		self.log.write(self.nec_evaluator.formatNumber(score)+"\t"+"\t".join(map(self.nec_evaluator.formatNumber, vector))+range_scores+"\n")
-		self.log.flush()
+	def formatParamVector(self, score, vector, range_scores):
+		line = self.nec_evaluator.formatNumber(score)+"\t"+"\t".join(map(self.nec_evaluator.formatNumber, vector))
+		if range_scores:
+			line += "\t"+"\t".join(map(self.nec_evaluator.formatNumber, range_scores))
+		return line+"\n"
 
 	class Score:
 		def __init__(self, score, agt_score):
@@ -245,64 +407,264 @@ class NecFileEvaluator:
 	def targetFunctionIsStrictlyMax(self):
 		return self.options.strict_max_target
 
+	def engineRunsPerEvaluation(self):
+		runs = len(self.nec_evaluator.sweeps)
+		if self.options.agt_correction and self.options.calc.gain:
+			runs = 2*runs
+		return runs
+
+	def engineSlots(self):
+		#the engines which can run at once: every concurrent evaluation runs up to --num-cores of them
+		if self.nec_evaluator.workers:
+			return self.nec_evaluator.workers.slots()
+		return max(1, self.options.parallel_evaluations)*self.options.num_cores
+
+	def constraintPenalty(self, vector, id=None):
+		#the score of a vector violating the constraints of the input file, None if it satisfies them
+		if not self.nec_file_input.constraints: return None
+		vector = self.paramsTransform(vector)
+		with self.lock:
+			self.setVars(vector)
+			try:
+				self.nec_file_input.updateGlobalVars()
+			except EvalError:
+				#target_ handles models which fail to evaluate
+				return None
+			violated = self.nec_file_input.violatedConstraints()
+			if not violated: return None
+			self.constraint_rejects += 1
+			#the more constraints violated the worse
+			score = 1000.0+len(violated)
+			if self.options.debug: sys.stderr.write("debug: violated constraints: %s\n"%"; ".join(violated))
+			self.printLog(vector, score, None, id)
+		return score
+
+	def constraintStatus(self):
+		return "Constraints: %d vectors rejected (%d engine runs saved)"%(self.constraint_rejects, self.constraint_rejects*self.engineRunsPerEvaluation())
+
+	def screenMember(self, vector, score, id):
+		#the checks made before any deck is generated, returns (decided, result, rechecking)
+		penalty = self.constraintPenalty(vector, id)
+		if penalty is not None:
+			if penalty <= float(score): return (1, NecFileEvaluator.Score(penalty, penalty), 0)
+			return (1, None, 0)
+		rechecking = 0
+		if self.surrogate:
+			with self.lock:
+				evaluate, rechecking = self.surrogate.promising(vector, score)
+			if not evaluate:
+				if self.options.debug: sys.stderr.write("debug: surrogate skipped trial for member %s\n"%str(id))
+				#logged like a discarded trial, the log has a line for every trial of a generation
+				with self.lock:
+					self.printLog(self.paramsTransform(vector), float(score)+1, None, id)
+				return (1, None, 0)
+		return (0, None, rechecking)
+
+	def evaluateMember(self, vector, score, id, rechecking, prepared=None):
+		res = self.testMemberAgainstScore_(vector, score, id, prepared)
+		if rechecking and res is not None:
+			with self.lock:
+				self.surrogate.falseReject()
+		return res
+
 	def testMemberAgainstScore(self, vector, score, id):
+		decided, res, rechecking = self.screenMember(vector, score, id)
+		if decided: return res
+		return self.evaluateMember(vector, score, id, rechecking)
+
+	def testMembersAgainstScores(self, vectors, scores, ids):
+		"""testMemberAgainstScore for several members at once.
+
+		With --parallel-evaluations > 1 the members go through a pipeline: this
+		thread screens them and generates their decks a batch at a time while
+		--parallel-evaluations worker threads run the engines, parse the outputs
+		and score them. A bounded queue between the two keeps the engines busy
+		with at most two batches of decks waiting.
+		"""
+		jobs = self.options.parallel_evaluations
+		if jobs <= 1 or len(vectors) <= 1:
+			return [self.testMemberAgainstScore(vectors[i], scores[i], ids[i]) for i in range(len(vectors))]
+		self.deferLog(ids)
+		try:
+			return self.testMembersAgainstScores_(vectors, scores, ids, jobs)
+		finally:
+			self.writeDeferredLog()
+
+	def testMembersAgainstScores_(self, vectors, scores, ids, jobs):
+		import queue
+		from threading import Thread
+		results = len(vectors)*[None]
+		pending = queue.Queue(2*jobs)
+		errors = []
+		stop = []
+
+		def consume():
+			while True:
+				item = pending.get()
+				if item is None: return
+				i, rechecking, prepared = item
+				if stop: continue
+				try:
+					results[i] = self.evaluateMember(vectors[i], scores[i], ids[i], rechecking, prepared)
+				except BaseException as e:
+					errors.append(e)
+					stop.append(1)
+
+		def flush(batch):
+			prepared = self.prepareMany([vectors[i] for i, rechecking in batch])
+			for k in range(len(batch)):
+				pending.put((batch[k][0], batch[k][1], prepared[k]))
+
+		workers = [Thread(target=consume) for j in range(min(jobs, len(vectors)))]
+		for w in workers: w.start()
+		try:
+			batch = []
+			for i in range(len(vectors)):
+				if stop: break
+				decided, res, rechecking = self.screenMember(vectors[i], scores[i], ids[i])
+				if decided:
+					results[i] = res
+					continue
+				batch.append((i, rechecking))
+				if len(batch) == jobs:
+					flush(batch)
+					batch = []
+			if batch and not stop:
+				flush(batch)
+		except BaseException:
+			stop.append(1)
+			raise
+		finally:
+			for w in workers: pending.put(None)
+			for w in workers: w.join()
+		if errors:
+			raise errors[0]
+		return results
+
+	def testMemberAgainstScore_(self, vector, score, id, prepared=None):
 		#print "in testMemberAgainstScore: self.options.calc.gain = %d"%self.options.calc.gain
+		if prepared is None:
+			prepared = self.prepareMany([vector])[0]
 		if self.options.frequency_data and not self.targetFunctionIsStrictlyMax() or not self.options.calc.gain or self.options.noagt_correction:
-			s = self.target_(vector,0,None, id)
+			s = self.target_(vector,0,None, id, prepared)
 			if s <= float(score):
 				return NecFileEvaluator.Score(s,s)
 			return None
-		if self.agt_score_threshold == .0:
-			self.agt_score_threshold = max(self.agt_score_threshold_stat1,self.agt_score_threshold_stat2 )*1.1
-			if self.options.debug: sys.stderr.write("debug: agt threshold = %.6g\n"%self.agt_score_threshold)
-			self.agt_score_threshold_stat_count1 = 0
-			self.agt_score_threshold_stat_count2 = 0
-			self.agt_score_threshold_stat1 = 0
-			self.agt_score_threshold_stat2 = 0
-		s, agts = self.target_(vector, 1,None, id)
+		with self.lock:
+			if self.agt_score_threshold == .0:
+				self.agt_score_threshold = max(self.agt_score_threshold_stat1,self.agt_score_threshold_stat2 )*1.1
+				if self.options.debug: sys.stderr.write("debug: agt threshold = %.6g\n"%self.agt_score_threshold)
+				self.agt_score_threshold_stat_count1 = 0
+				self.agt_score_threshold_stat_count2 = 0
+				self.agt_score_threshold_stat1 = 0
+				self.agt_score_threshold_stat2 = 0
+		s, agts = self.target_(vector, 1,None, id, prepared)
 		if self.options.debug: sys.stderr.write("debug: agt score = %g\n"%s)
 		if self.options.debug: sys.stderr.write("debug: agts = "+str(agts)+"\n")
-		if self.options.debug: sys.stderr.write("debug: prev agt score = %g\n"%score.scores[1])
+		if self.options.debug: sys.stderr.write("debug: prev agt score = %s\n"%str(score.scores[1]))
 		if self.options.debug: sys.stderr.write("debug: prev  score = %g\n"%float(score))
-		if self.targetFunctionIsStrictlyMax() and s > score.scores[0] or s > score.scores[1]+self.agt_score_threshold:
+		#members with warm start scores have no agt score, their trials are always fully evaluated
+		if self.targetFunctionIsStrictlyMax() and s > score.scores[0] or score.scores[1] is not None and s > score.scores[1]+self.agt_score_threshold:
 			if self.options.debug: sys.stderr.write("debug: Discarding(%d, %d, %.6g, %.6g)\n"%(self.agt_score_threshold_stat_count1, self.agt_score_threshold_stat_count2,self.agt_score_threshold_stat1,self.agt_score_threshold_stat2 ))
-			self.printLog(self.paramsTransform(vector), float(score)+1, None)
+			with self.lock:
+				self.printLog(self.paramsTransform(vector), float(score)+1, None, id)
+			return None
+		sc = self.target_(vector, 0, agts, id, prepared)
+		if score.scores[1] is None:
+			if sc <= float(score): return NecFileEvaluator.Score(sc,s)
 			return None
-		sc = self.target_(vector, 0, agts, id)
-		self.agt_score_threshold_stat_count2+=1
-		self.agt_score_threshold_stat2=max(self.agt_score_threshold_stat2,s - score.scores[1] - sc + score.scores[0])
 		if self.options.debug: sys.stderr.write("debug: real score = %g\n"%sc)
+		with self.lock:
+			self.agt_score_threshold_stat_count2+=1
+			self.agt_score_threshold_stat2=max(self.agt_score_threshold_stat2,s - score.scores[1] - sc + score.scores[0])
+			if sc <= float(score): 
+				self.agt_score_threshold_stat_count1+=1
+				self.agt_score_threshold_stat1=max(self.agt_score_threshold_stat1,s - score.scores[1])
+				if self.agt_score_threshold_stat_count1 > 20 and self.agt_score_threshold_stat_count2 > 100:
+					self.agt_score_threshold_stat_count1 = 0
+					self.agt_score_threshold_stat_count2 = 0
+					self.agt_score_threshold = min(1, (max(self.agt_score_threshold_stat1,self.agt_score_threshold_stat2 ))*1.1)
+					self.agt_score_threshold_stat1 = 0
+					self.agt_score_threshold_stat2 = 0
+					if self.options.debug: 
+						sys.stderr.write("new agt threshold = %.6g\n"%self.agt_score_threshold)
+					if self.log:
+						self.log.write("#new agt threshold = %.6g\n"%self.agt_score_threshold)
 		if sc <= float(score): 
-			self.agt_score_threshold_stat_count1+=1
-			self.agt_score_threshold_stat1=max(self.agt_score_threshold_stat1,s - score.scores[1])
-			if self.agt_score_threshold_stat_count1 > 20 and self.agt_score_threshold_stat_count2 > 100:
-				self.agt_score_threshold_stat_count1 = 0
-				self.agt_score_threshold_stat_count2 = 0
-				self.agt_score_threshold = min(1, (max(self.agt_score_threshold_stat1,self.agt_score_threshold_stat2 ))*1.1)
-				self.agt_score_threshold_stat1 = 0
-				self.agt_score_threshold_stat2 = 0
-				if self.options.debug: 
-					sys.stderr.write("new agt threshold = %.6g\n"%self.agt_score_threshold)
-				if self.log:
-					self.log.write("#new agt threshold = %.6g\n"%self.agt_score_threshold)
-
 			return NecFileEvaluator.Score(sc,s)
 		if self.options.debug: sys.stderr.write("debug: Discarding(%d, %d, %.6g, %.6g)\n"%(self.agt_score_threshold_stat_count1, self.agt_score_threshold_stat_count2,self.agt_score_threshold_stat1,self.agt_score_threshold_stat2 ))
-	def target(self, vector, id="id"):
+	def prepareMany(self, vectors):
+		#the engine inputs of several vectors generated in one pass, with the SY variables evaluated
+		#for all of them at once. target_ reuses them for the agt and the real engine runs
+		with self.lock:
+			var_sets = []
+			for v in vectors:
+				self.setVars(self.paramsTransform(v))
+				var_sets.append(dict(self.nec_file_input.vars))
+			with self.timing.phase("deck"):
+				all_globals = self.nec_file_input.globalsMany(var_sets)
+			prepared = []
+			for i in range(len(vectors)):
+				if all_globals[i] is None:
+					#fails again, reporting the error as a single evaluation would
+					self.setVars(self.paramsTransform(vectors[i]))
+					prepared.append((self.nec_evaluator.sweepInputLines(), dict(self.nec_file_input.globals)))
+					continue
+				self.nec_file_input.globals = all_globals[i]
+				prepared.append((self.nec_evaluator.sweepInputLines(0), dict(all_globals[i])))
+		return prepared
+
+	def target(self, vector, id="id", prepared=None):
+		penalty = self.constraintPenalty(vector, id)
+		if penalty is not None:
+			return NecFileEvaluator.Score(penalty, penalty)
+		if prepared is None:
+			prepared = self.prepareMany([vector])[0]
 		if self.options.frequency_data or not self.options.calc.gain or self.options.noagt_correction:
-			s = self.target_(vector,0,None, id)
+			s = self.target_(vector,0,None, id, prepared)
 			return NecFileEvaluator.Score(s,s)
-		s, agts = self.target_(vector, 1,None, id)
+		s, agts = self.target_(vector, 1,None, id, prepared)
 		if self.options.debug: sys.stderr.write("debug: agt score = %g\n"%s)
 		if self.options.debug: sys.stderr.write("debug: agts = "+str(agts)+"\n")
-		sc = self.target_(vector, 0, agts, id)
+		sc = self.target_(vector, 0, agts, id, prepared)
 		if self.options.debug: sys.stderr.write("debug: real score = %g\n"%sc)
-		if self.agt_score_threshold == .0:
-			self.agt_score_threshold_stat2=max(self.agt_score_threshold_stat2, sc - s)
-			if self.options.debug: sys.stderr.write("debug: expected agt threshold = %.6g\n"%self.agt_score_threshold_stat2)
+		with self.lock:
+			if self.agt_score_threshold == .0:
+				self.agt_score_threshold_stat2=max(self.agt_score_threshold_stat2, sc - s)
+				if self.options.debug: sys.stderr.write("debug: expected agt threshold = %.6g\n"%self.agt_score_threshold_stat2)
 		return NecFileEvaluator.Score(sc,s)
 
-	def target_(self, vector, get_agt_score, use_agt,id ):
+	def targetMany(self, vectors, ids=None):
+		if ids is None:
+			ids = ["p%d"%i for i in range(len(vectors))]
+		prepared = self.prepareMany(vectors)
+		jobs = self.options.parallel_evaluations
+		if jobs <= 1 or len(vectors) <= 1:
+			return [self.target(vectors[i], ids[i], prepared[i]) for i in range(len(vectors))]
+		from concurrent.futures import ThreadPoolExecutor
+		self.deferLog(ids)
+		try:
+			with ThreadPoolExecutor(min(jobs, len(vectors))) as executor:
+				futures = [executor.submit(self.target, vectors[i], ids[i], prepared[i]) for i in range(len(vectors))]
+				return [f.result() for f in futures]
+		finally:
+			self.writeDeferredLog()
+
+	def deferLog(self, ids):
+		#the log readers take line i of a generation for member i, concurrent evaluations finish in any order
+		with self.lock:
+			self.log_slots = dict((ids[i], i) for i in range(len(ids)))
+			self.deferred_log = []
+
+	def writeDeferredLog(self):
+		with self.lock:
+			deferred = sorted(self.deferred_log, key=lambda d: d[0])
+			self.log_slots = None
+			self.deferred_log = []
+			for d in deferred:
+				self.printLog(*d[1:])
+
+	def target_(self, vector, get_agt_score, use_agt,id, prepared=None):
 		class ExtensibleRangeResult:
 			def __init__(self):
 				self.data = {}
@@ -345,17 +707,25 @@ class NecFileEvaluator:
 		for i in range(len(self.options.sweeps)): range_results.append(ExtensibleRangeResult())
 
 		vector = self.paramsTransform(vector)
-		for i in range(len(self.opt_vars)):
-			var = self.opt_vars[i]
-			self.nec_file_input.vars[var]=vector[i]
+		if prepared is not None:
+			inputs, nec_globals = prepared
+		else:
+			with self.lock:
+				self.setVars(vector)
+				inputs = self.nec_evaluator.sweepInputLines()
+				nec_globals = dict(self.nec_file_input.globals)
 		#print "in target_ : Get agt score = %d"%get_agt_score
-		results = self.nec_evaluator.runSweeps(get_agt_score, use_agt,id)
+		results = None
+		if inputs is not None:
+			results = self.nec_evaluator.runSweepInputs(inputs, get_agt_score, use_agt,id)
 		res = -1000
 		agts = {}
 		if not results:
 			if self.options.verbose: printOut( "writing erroneous file...")
 			try:
-				self.nec_evaluator.writeParametrized("error%d.nec"%self.errors)
+				with self.lock:
+					self.setVars(vector)
+					self.nec_evaluator.writeParametrized("error%d.nec"%self.errors)
 				if self.options.verbose: printOut("done")
 			except:
 				if self.options.verbose: printOut("failed")
@@ -364,9 +734,14 @@ class NecFileEvaluator:
 			#agts = [1.0]*len(results)
 
 			NOP = ne.NecOutputParser
+			start = clock()
+			parse_time = 0
 			try:
 				for r in results:
+					t = clock()
 					nop = NOP(r[0], r[2],self.options)
+					self.timing.add("parse", clock()-t)
+					parse_time += clock()-t
 					#print "output parsed"
 					sweepid = r[1]
 					agts[r[3]] = r[2]
@@ -499,8 +874,9 @@ class NecFileEvaluator:
 
 	
 				if self.options.debug > 1 : pprint.pprint(d)
-				d.update(self.nec_file_input.globals)
+				d.update(nec_globals)
 				res = eval(self.options.target_function, d)
+				self.timing.add("target", clock()-start-parse_time)
 	
 			except:
 				if not self.options.verbose: sys.stderr.write('\n')
@@ -512,10 +888,19 @@ class NecFileEvaluator:
 
 		if get_agt_score:
 			return (res,agts)
-		self.printLog(vector, res,range_results)
+		self.timing.evaluation()
+		with self.lock:
+			if self.surrogate:
+				self.surrogate.add(vector, res)
+			with self.timing.phase("log"):
+				self.printLog(vector, res,range_results, id)
 		return res
 
-	def printLog(self, vector, res,range_results):
+	def printLog(self, vector, res,range_results, id=None):
+		if self.unlogged: return
+		if self.log_slots is not None and id in self.log_slots:
+			self.deferred_log.append((self.log_slots[id], vector, res, range_results, id))
+			return
 		z = sorted(zip(self.opt_vars,vector))
 		sorted_vars = [x[0] for x in z]
 		sorted_vect = [x[1] for x in z]
@@ -527,10 +912,13 @@ class NecFileEvaluator:
 			printOut( "\n" )
 		elif not self.options.quiet:
 			sys.stdout.write('.')
-			sys.stdout.flush()
-		if self.log:
-			self.logParamVector(sorted_vect,res, range_results)
-			self.log.flush()
+			#the dots of fast evaluations are flushed a few times a second
+			t = time.time()
+			if t-self.stdout_flush_time > .2:
+				sys.stdout.flush()
+				self.stdout_flush_time = t
+		if self.log or self.binary_log:
+			self.logParamVector(sorted_vect,res, range_results, memberIndex(id))
 
 		if res < self.best_score:
 			self.best_score = res
@@ -539,6 +927,7 @@ class NecFileEvaluator:
 				fn = fn.replace(".-","-")
 				fn = fn.replace(".","_")
 				fn = fn+".nec"
+				self.setVars(vector)
 				self.nec_evaluator.writeParametrized(fn, comments = self.comments+["Score %g"%res,""])
 			if self.options.quiet :
 				printOut("Best score : %.5f"%res)
@@ -549,8 +938,29 @@ class NecFileEvaluator:
 		t = time.time()
 		t-=self.time
 		self.time+=t
+		#the phases since the previous generation
+		timing = self.timing.status(self.engineSlots()) if self.options.timing else None
+		self.timing.mark("generation %s"%str(count))
+		#the engine totals go with the timing of a generation, not again with the final status
+		engines = self.nec_evaluator.process_monitor.status() if timing and self.nec_evaluator.process_monitor else None
+		archive = self.nec_evaluator.engine_archive.status() if self.nec_evaluator.engine_archive else None
 		if self.log:
 			self.log.write("#Total time %d sec., Iteration time %d sec.\n"%(int(self.time-self.start_time), t))
+			if self.surrogate:
+				self.log.write("#"+self.surrogate.status(self.engineRunsPerEvaluation())+"\n")
+			if self.nec_evaluator.interpolation:
+				self.log.write("#"+self.nec_evaluator.interpolation.status()+"\n")
+			if self.constraint_rejects:
+				self.log.write("#"+self.constraintStatus()+"\n")
+			if timing:
+				self.log.write("#"+timing+"\n")
+			if engines:
+				self.log.write("#"+engines+"\n")
+			if archive:
+				self.log.write("#"+archive+"\n")
+			self.log.flush()
+		if self.binary_log:
+			self.binary_log.flush()
 		if self.options.quiet: return
 		vector = self.paramsTransform(vector)
 		z = sorted(zip(self.opt_vars,vector))
@@ -560,6 +970,12 @@ class NecFileEvaluator:
 		else: sys.stdout.write('\n')
 		if not improved: printOut( "% 5s. Min score %g, Mean score %g, IterTime(%d sec)"%(str(count), minv, meanv, int(t)) )
 		else : printOut( "% 5s. Min score %g, Mean score %g, Improved %d members, IterTime(%d sec)"%(str(count), minv, meanv, improved, int(t)))
+		if self.surrogate: printOut( "       "+self.surrogate.status(self.engineRunsPerEvaluation()) )
+		if self.nec_evaluator.interpolation: printOut( "       "+self.nec_evaluator.interpolation.status() )
+		if self.constraint_rejects: printOut( "       "+self.constraintStatus() )
+		if timing: printOut( "       "+timing )
+		if engines: printOut( "       "+engines )
+		if archive: printOut( "       "+archive )
 		if self.options.verbose:printOut( "\t".join(map(self.nec_evaluator.formatName, sorted_vars)) )
 		if self.options.verbose:printOut( "\t".join(map(self.nec_evaluator.formatNumber, sorted_vect)) )
 		if self.options.verbose:printOut( "=====================================================================" )
@@ -571,11 +987,26 @@ def optionParser():
 			ne.OptionParser.__init__(self)
 			self.add_option("--noagt-correction", default=False, action="store_true")
 			self.add_option("-l", "--log-file", default="",metavar="FILE", help="log file. The default is your_input_file.opt_log.")
+			self.add_option("--binary-log", default="", metavar="FILE", help="also record every evaluation in an indexed binary log of float64 records, readable without parsing text (see nec.binary_log). With --islands every island writes FILE.islandN. The default is no binary log")
+			self.add_option("--timing", default=False, action="store_true", help="time the phases of every evaluation (deck generation, geometry validation, engine runs, output parsing, target function, logging). Every generation prints the time spent in each phase, the evaluation rate and the engine utilisation, the duration histograms are written to the log at exit")
+			self.add_option("--trace", default="", metavar="FILE", help="write the start and duration of every engine run, deck generation, output parse and target function evaluation to FILE as Chrome trace events, one track per thread, to be opened in chrome://tracing or ui.perfetto.dev. With --islands every island writes FILE.islandN")
+			self.add_option("--log-flush-interval", default=1.0, type="float", metavar="SECONDS", help="the log lines are written by a background thread and flushed to the file at least every SECONDS and at the end of every generation. The default is %default")
+			self.add_option("--seed", default=0, type="int", help="seed of the random number generator, 0 for a random seed. A run repeats with the same seed and options, e.g. to replay it with --engine-replay. The default is %default")
 			self.add_option("-S", "--seed-with-input", default=False, action="store_true", help="use the input file as one of the population members (creates bias towards the input file if it has a good score)")
 			self.add_option("-t", "--target-level", dest="target_levels", default=[], metavar="TARGET_LEVEL", action="append", type="string", help="appends target level(s) for a sweep, the number of target levels must match the number of sweeps and they are paired positionally. Examples1: -s (174,6,8) -t (8,9) means target levels linearly increasing from 8 to 9 for the frequencies from 174 to 216. Example2: -s (174,6,8) -t (8, 8.5, 9.5, 9) means target levels of 8 for 174, 9 for 216 and gradually increasing levels from 8.5 to 9.5 for the range 180 to 210")
 			self.add_option("-M", "--max-iter", default=10000, type="int", help="The default is %default. The script can be interrupted with Ctrl+C at any time and it will output its current best result as 'output.nec'")
 			self.add_option("-L", "--local-search", action="store_true", default = False)
+			self.add_option("--optimizer", default="de", type="choice", choices=["de", "cmaes"], help="the global optimizer: differential evolution (de) or CMA-ES with restarts (cmaes). Ignored with --local-search. The default is %default")
+			self.add_option("--cma-sigma", default=.3, type="float", help="CMA-ES initial step size as a fraction of the parameter ranges. The default is %default")
+			self.add_option("--cma-lambda", default=0, type="int", help="CMA-ES initial number of samples per generation. The default (0) is 4+3*ln(optimization parameters)")
+			self.add_option("--cma-restarts", default=4, type="int", help="number of CMA-ES restarts with doubled population size. The default is %default")
+			self.add_option("--islands", default=1, type="int", help="number of independent populations of the global optimizer, each run in its own process with its own engines (--num-cores each) and scratch directory under the output directory. Members are migrated between the islands and all of them log to the same log file. The default is %default")
+			self.add_option("--migration-interval", default=10, type="int", help="number of generations between migrations of the best members to the next island. The default is %default")
+			self.add_option("--migrants", default=2, type="int", help="number of best members sent to the next island on each migration. The default is %default")
+			self.add_option("--parallel-evaluations", default=1, type="int", help="number of models evaluated concurrently by optimizers which can evaluate several vectors at once (the trials of a DE generation, cmaes and the speculative parallel Nelder-Mead used by --local-search when this is >1). DE trials are evaluated in a pipeline which generates the next decks while the engines run. Each evaluation uses up to --num-cores engines. The default is %default")
 			self.add_option("-T", "--local-search-tolerance", default = .0001, type="float")
+			self.add_option("--local-search-method", default="nm", type="choice", choices=["nm", "mads"], help="local search algorithm: Nelder-Mead simplex (nm) or mesh adaptive direct search (mads), which polls --parallel-evaluations directions at once. The default is %default")
+			self.add_option("--mads-initial-step", default=.1, type="float", help="initial poll size of the mads local search as a fraction of each parameter range. The local search tolerance is the final poll size in the same units. The default is %default")
 			self.add_option("-F", "--target-function", default = "max(max_gain_diff, max_swr_diff)", type='string', help="An expression composed of statistical tokens and any of the nec file parameters, by default it is '%default'. All statistical tokens are of the form min_\"value\", max_\"value\", ave_\"value\", min_ave_\"value\", max_ave_\"value\", ave_min_\"value\" and ave_max_\"value\", where \"value\" is one of the following: gain_diff, swr_diff, f2r_diff, f2b_diff, net_gain, raw_gain, ml, swr, agt_correction, f2r, f2b, real and  imag. A full access to all results per frequency is also provided for the same tokens. For example, results[0] gives access to all results for the first sweep, results[0][\"net_gain\"] is an array of all net gains for all frequencies of the first sweep, and finally results[0][\"net_gain\"][0] gives the net gain for the first frequency of the first sweep. The numeric indices are from 0 to count-1, where count is the number of sweeps for the first index and the number of frequencies for the second.")
 			self.add_option( "--swr-target", default=[], type='string', action="append", help="defines the swr target curve in the same way as target gain is defined. the default value is flat swr (2,2). One per sweep can be specified. The last one defined is used as default if the sweeps are more.")
 			self.add_option( "--f2r-target", default=[], type='string', action="append", help="defines the f2r target curve in the same way as target gain is defined. the default value is flat f2r (15,15). One per sweep can be specified. The last one defined is used as default if the sweeps are more.")
@@ -584,9 +1015,28 @@ def optionParser():
 			self.add_option( "--de-f", default = 0.55, type="float", help="The DE's differential parameter. Should be >.5, the default is %default")
 			self.add_option( "--de-cr", default = .9, type="float", help = "The DE's crossover parameter, the default is %default")
 			self.add_option( "--de-np", default = 50, type="int", help="The DE's population size parameter. The literature recommends to use 10*(optimization_parameters). The defaults is %default")
+			self.add_option( "--de-strategy", default = "rand1", type="choice", choices=["rand1", "shade"], help="The DE variant. 'rand1' is the classic DE/rand/1/bin with fixed --de-f and --de-cr, 'shade' adapts F and CR from the history of successful trials, uses current-to-pbest mutation with an archive and linearly reduces the population from --de-np to --de-min-np. The default is %default")
+			self.add_option( "--de-min-np", default = 4, type="int", help="The final population size for --de-strategy=shade. The default is %default")
+			self.add_option( "--de-max-evaluations", default = 0, type="int", help="The evaluation budget for --de-strategy=shade, the population reaches --de-min-np when it is spent. The default (0) is 2000 evaluations per optimization parameter, at most --max-iter*--de-np")
+			self.add_option( "--de-memory-size", default = 6, type="int", help="The size of the F/CR success history for --de-strategy=shade. The default is %default")
 			self.add_option("-P", "--output-population", default = False, action="store_true", help="IGNORED")
 			self.add_option("-b", "--output-best", default = -1, help="set to 0 or 1 to output the best score nec file as 'best.nec'. Default is -1 (output if not in local search)." )
 			self.add_option("-p", "--parameters", default = "", help="If not empty restrict the list of optimization parameters to this list." )
+			self.add_option("--checkpoint-every", default=0, type="int", metavar="N", help="save the complete optimizer and evaluator state every N generations (DE only). The default is %default (off)")
+			self.add_option("--checkpoint-interval", default=0, type="int", metavar="SECONDS", help="save the complete optimizer and evaluator state after the first generation that ends at least SECONDS after the previous checkpoint (DE only). The default is %default (off)")
+			self.add_option("--checkpoint-file", default="", metavar="FILE", help="checkpoint file. The default is your_input_file.checkpoint")
+			self.add_option("--resume", default=False, action="store_true", help="continue the run saved in the checkpoint file. The population is not rescored")
+			self.add_option("--coarse-segmentation", default=0, type="int", metavar="NUM_SEGMENTS", help="multi-fidelity optimization: run the global optimizer with this autosegmentation level first and switch to the --auto-segmentation level when the coarse scores no longer rank the population like the production ones. The default is %default (off)")
+			self.add_option("--coarse-angle-step", default=0, type="float", help="radiation pattern angle step used during the coarse phase. The default (0) is the step of the input file")
+			self.add_option("--coarse-max-generations", default=0, type="int", help="switch to the production segmentation after this many generations at the latest. The default (0) is half of --max-iter, leaving the other half to the production phase")
+			self.add_option("--fidelity-check-interval", default=5, type="int", help="generations between comparisons of coarse and production scores in the coarse phase. The default is %default")
+			self.add_option("--fidelity-samples", default=8, type="int", help="number of members also evaluated with the production segmentation on each comparison. The default is %default")
+			self.add_option("--fidelity-correlation", default=.8, type="float", help="the coarse phase ends when the rank correlation of coarse and production scores drops below this. The default is %default")
+			self.add_option("--frequency-interpolation", default=0, type="int", metavar="NUM_FREQS", help="run the engine on this many evenly spaced channels of each sweep chunk and interpolate the impedance and gains of the other channels with rational functions of the frequency. More channels are solved where the interpolation misses a solved one by more than --interpolation-tolerance. The final evaluation always solves all channels. The default is %default (off)")
+			self.add_option("--interpolation-tolerance", default=.01, type="float", help="the largest error of the reflection coefficient and of the pattern power (relative to the pattern peak) accepted from the frequency interpolation. The default is %default")
+			self.add_option("--warm-start", default=False, action="store_true", help="build the initial population from the vectors in the log file(s) of previous runs: the best ones at least --warm-start-distance apart. Logged scores are reused without engine runs when the sweeps, targets and target function of the logged run match this one, other vectors are rescored. The population has --de-np members, --cma-lambda with --optimizer cmaes. Ignored with --restart and --local-search")
+			self.add_option("--warm-start-log", default=[], action="append", metavar="FILE", help="log file to warm start from, can be given more than once. The default is the log file")
+			self.add_option("--warm-start-distance", default=.02, type="float", help="minimum distance of warm start members as a fraction of the parameter ranges. The default is %default")
 			self.add_option("-r", "--restart", default = "", metavar="RESTART_FILE", help="restart from population saved in a file." )
 			self.add_option("--omni", default=0, action="store_true", help="parse all horizontal angles")
 			self.add_option("--quiet", default=False, action="store_true", help="disable all output but errors")
@@ -594,7 +1044,14 @@ def optionParser():
 			self.add_option("--strict-max-target", default=False, action="store_true", help="use if your target function has no averaging i.e. if the result for a single frequency can be used to declare a model as worse in comparison with the score of another model. The default target function max(max_swr_diff,max_gain_diff) is an example of such function. Setting this option will speed up the optimization, but it has to be used correctly.")
 			self.add_option("--profile", default=False, action="store_true")
 			self.add_option("--engine-kill-time", type="int", default=3600, help="Maximum time the nec engine is allowed to run before it is considered hanging and killed. After 100 successful engine invocations this value is updated with 10x the actual maximum running time of all previous engine invocations")
+			self.add_option("--engine-memory-limit", type="int", default=0, metavar="MB", help="address space limit of every engine process in MB, 0 for none. The default is %default")
+			self.add_option("--engine-cpu-limit", type="int", default=0, metavar="SECONDS", help="CPU time limit of every engine process, 0 for none. The default is %default")
+			self.add_option("--engine-memory-budget", type="int", default=-1, metavar="MB", help="memory in MB the engines running at once may use. Engines wait while their predicted memory (the peak memory of previous runs of the engine, scaled by the square of the segments) does not fit. 0 uses 80 percent of the available memory, -1 disables the limit. The default is %default")
 			self.add_option("--stop-on-error", default=False, action="store_true")
+			self.add_option("--surrogate", default="", type="choice", choices=["", "knn", "rbf"], help="pre-screen DE trial vectors with a surrogate model (knn or rbf) trained on all evaluated vectors. Trials predicted to lose against their parent are not sent to the engine.")
+			self.add_option("--surrogate-recheck", default=.1, type="float", help="probability of evaluating a trial rejected by the surrogate anyway, to keep the surrogate honest. The default is %default")
+			self.add_option("--surrogate-neighbors", default=0, type="int", help="number of nearest evaluated vectors used by the surrogate. The default (0) is max(5, 2*(optimization parameters)+1)")
+			self.add_option("--surrogate-confidence", default=1.0, type="float", help="a trial is rejected only if its predicted score minus this many spreads is worse than its parent's score. The default is %default")
 
 		def convertToListOfLists(self, _list, size=None, default=None):
 			if size is not None and len(_list) < size:
@@ -623,6 +1080,9 @@ def optionParser():
 			if options.quiet and options.verbose:
 				sys.stderr.write("WARNING: Both quite and verbose mode specified. Will use verbose.\n")
 				options.quiet = False
+			if options.warm_start and options.local_search:
+				sys.stderr.write("WARNING: --warm-start is IGNORED with --local-search.\n")
+				options.warm_start = False
 			if options.parameters:
 				if not options.quiet: printOut( "Parameters restricted to "+str(options.parameters) )
 			if options.output_best == -1:
@@ -674,16 +1134,34 @@ def optionParser():
 	return MainOptionParser()
 
 
+def globalOptimizer(evaluator, options, ins_sol_vec=None):
+	if options.optimizer == "cmaes":
+		from nec.cmaes import cmaes_optimizer
+		return cmaes_optimizer(evaluator, population_size = options.cma_lambda, sigma = options.cma_sigma, restarts = options.cma_restarts, show_progress=1, insert_solution_vector=ins_sol_vec, max_iter=options.max_iter)
+	if options.de_strategy == "shade":
+		return DE.shade_optimizer(evaluator, population_size = options.de_np, min_population_size = options.de_min_np, max_evaluations = options.de_max_evaluations, memory_size = options.de_memory_size, show_progress=1, insert_solution_vector=ins_sol_vec, max_iter=options.max_iter)
+	return DE.differential_evolution_optimizer(evaluator, population_size = options.de_np, f = options.de_f, cr = options.de_cr, show_progress=1, insert_solution_vector=ins_sol_vec, max_iter=options.max_iter, dither=options.de_dither)
+
 def optimize(nec_file_input, options):
+	if options.islands > 1 and not options.local_search:
+		from nec import islands
+		islands.optimize(nec_file_input, options)
+		return
 	evaluator = NecFileEvaluator(nec_file_input, options)
 	ins_sol_vec = None
 	if options.seed_with_input:
 		ins_sol_vec = evaluator.x
 	try:
 		if not options.local_search:
-			de_plugin = None
+			if options.coarse_segmentation:
+				from nec.multifidelity import MultiFidelityOptimizer
+				optimizer = MultiFidelityOptimizer(evaluator, options, ins_sol_vec, globalOptimizer)
+			else:
+				optimizer = globalOptimizer(evaluator, options, ins_sol_vec)
+			if options.resume or options.checkpoint_every or options.checkpoint_interval:
+				from nec import checkpoint
+				checkpoint.attach(optimizer, evaluator, options)
 			try:
-				optimizer = DE.differential_evolution_optimizer(evaluator, population_size = options.de_np, f = options.de_f, cr = options.de_cr, show_progress=1, insert_solution_vector=ins_sol_vec, max_iter=options.max_iter, dither=options.de_dither)
 				optimizer.run()
 			except KeyboardInterrupt:
 				evaluator.saveRestart(optimizer.population, optimizer.scores)
@@ -691,7 +1169,13 @@ def optimize(nec_file_input, options):
 		else:
 			from nec import simplex
 			if not options.quiet: printOut( "N=%d"%len(evaluator.x))
-			evaluator.x = simplex.fmin(evaluator, ftol=options.local_search_tolerance, xtol=options.local_search_tolerance, maxfun=options.max_iter)
+			if options.local_search_method == "mads":
+				from nec import pattern_search
+				evaluator.x = pattern_search.mads(evaluator, xtol=options.local_search_tolerance, maxfun=options.max_iter, initial_step=options.mads_initial_step, parallel=options.parallel_evaluations)
+			elif options.parallel_evaluations > 1:
+				evaluator.x = simplex.fmin_parallel(evaluator, ftol=options.local_search_tolerance, xtol=options.local_search_tolerance, maxfun=options.max_iter)
+			else:
+				evaluator.x = simplex.fmin(evaluator, ftol=options.local_search_tolerance, xtol=options.local_search_tolerance, maxfun=options.max_iter)
 		#evaluator.nec_file.writeNecInput("final.nec")
 		evaluator.evaluateFinalSolution()
 	except KeyboardInterrupt:
@@ -700,18 +1184,24 @@ def optimize(nec_file_input, options):
 		evaluator.join()
 		
 
+def loadInput():
+	options, inputs = optionParser().parse_args()
+	nec_file_input = NecInputFile(options.input, options.debug)
+	if  "OPT" in nec_file_input.cmd_options:
+		import shlex
+		options, args = optionParser().parse_args(shlex.split(nec_file_input.cmd_options["OPT"] ) )
+	options.agt_correction = not options.noagt_correction
+	options.angle_step = nec_file_input.angle_step
+	if options.log_file=="":
+		options.log_file = options.input+".opt_log"
+	return (nec_file_input, options)
+
 def main():
 	random.seed()
-	options, inputs = optionParser().parse_args()
 	try:
-		nec_file_input = NecInputFile(options.input, options.debug)
-		if  "OPT" in nec_file_input.cmd_options:
-			import shlex
-			options, args = optionParser().parse_args(shlex.split(nec_file_input.cmd_options["OPT"] ) )
-		options.agt_correction = not options.noagt_correction
-		options.angle_step = nec_file_input.angle_step
-		if options.log_file=="":
-			options.log_file = options.input+".opt_log"
+		nec_file_input, options = loadInput()
+		if options.seed:
+			random.seed(options.seed)
 		if options.profile:
 			import cProfile
 			cProfile.runctx('optimize(nec_file_input, options)',globals(), locals())
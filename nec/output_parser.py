@@ -125,7 +125,10 @@ class NecOutputParser:
 		self.AGT = agt
 		self.agt = 10*necmath.log10(agt)
 		self.options = options
-		if output:
+		if isinstance(output, list):
+			#already parsed (or interpolated) frequencies
+			self.frequencies = output
+		elif output:
 			self.parse(output)
 
 	def printFreqs(self, header=1):
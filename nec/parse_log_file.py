@@ -1,6 +1,12 @@
 from __future__ import division
+import array
 from nec.print_out import printOut
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 def distance(m1, m2, min_dif, num_calculated):
 	d = 0
 	for i in range(1, len(m1)-num_calculated):
@@ -16,39 +22,162 @@ def isAway(population, member, min_distance, min_dif,num_calculated):
 			return 0
 	return 1
 	
-def parseLogFile(filename, np, min_distance, min_dif,num_calculated):
-	f = open(filename,"rt")
-	lines = f.readlines()
-	f.close()
-	i=-1
-	for j in xrange(len(lines)):
-		if lines[j].find("Score")!=-1:
-			i=j
-	
-	if i==-1:
-		return ()
+def logRuns(filename):
+	"""Splits an optimizer log into its runs.
+	Returns a list of (header lines, column names, rows) with the rows as lists of floats."""
+	from nec.binary_log import isBinaryLog
+	if isBinaryLog(filename):
+		return binaryLogRuns(filename)
+	runs = []
+	try:
+		f = open(filename,"rt")
+	except IOError:
+		return runs
+	header = None
+	in_header = 0
+	try:
+		for line in f:
+			sep = line.find("============")
+			if sep != -1:
+				if in_header:
+					if line[0:sep].strip(): header.append(line[0:sep].strip())
+					in_header = 0
+				else:
+					header = []
+					runs.append((header, [], []))
+					in_header = 1
+				continue
+			if in_header:
+				header.append(line.strip())
+				continue
+			if not runs or not line.strip() or line[0] == '#':
+				continue
+			columns, rows = runs[-1][1], runs[-1][2]
+			sl = line.split()
+			if not columns:
+				if sl[0] == "Score": columns.extend(sl)
+				continue
+			try:
+				rows.append(list(map(float, sl)))
+			except ValueError:
+				pass
+	finally:
+		f.close()
+	return runs
 
-	printOut( i )
+def binaryLogRuns(filename):
+	#the runs of a binary log have no header lines, the range scores of discarded trials are NaN
+	from nec.binary_log import BinaryLog
+	log = BinaryLog(filename)
+	runs = []
+	for start, end in log.runs():
+		rows = []
+		for r in log.records(start, end):
+			row = list(r[3:])
+			while row and row[-1] != row[-1]:
+				row.pop()
+			rows.append(row)
+		runs.append(([], log.columns[3:], rows))
+	return runs
 
-	vars = lines[i].split()
-	lines = lines[i+1:]
-	for l in range(len(lines)):
-		try:
-			lines[l] = map(float, lines[l].split())
-		except:
-			lines[l] = lines[l].replace("None", "0")
-			lines[l] = map(float, lines[l].split())
+def lastRunRows(filename):
+	"""The column names and the rows of the last run of a text or binary log.
 
-	lines.sort()
-	population = []
+	Rows without the calculated columns (discarded trials with fake scores) are
+	left out. The rows are a numpy array when numpy is available, a list of
+	lists otherwise. The text lines are not kept, only the numbers."""
+	from nec.binary_log import isBinaryLog, BinaryLog
+	if isBinaryLog(filename):
+		log = BinaryLog(filename)
+		runs = log.runs()
+		if not runs:
+			return None, []
+		start, end = runs[-1]
+		if numpy is not None:
+			rows = log.array()[start:end, 3:]
+			return log.columns[3:], numpy.array(rows[~numpy.isnan(rows[:,-1])])
+		return log.columns[3:], [list(r[3:]) for r in log.records(start, end) if r[-1] == r[-1]]
+	vars = None
+	rows = []
+	in_header = 0
+	f = open(filename,"rt")
+	try:
+		for line in f:
+			if line.find("============") != -1:
+				in_header = 1
+			elif line.find("Score") != -1 and line[0] != '#':
+				#a new run, only the last one counts
+				in_header = 0
+				vars = line.split()
+				rows = array.array("d") if numpy is not None else []
+			elif in_header or vars is None or line[0] == '#':
+				continue
+			else:
+				sl = line.split()
+				if len(sl) != len(vars): continue
+				try:
+					row = [0 if x == "None" else float(x) for x in sl]
+				except ValueError:
+					continue
+				if numpy is not None:
+					rows.extend(row)
+				else:
+					rows.append(row)
+	finally:
+		f.close()
+	if vars is None:
+		return None, []
+	if numpy is not None:
+		return vars, numpy.frombuffer(rows, dtype=float).reshape(-1, len(vars))
+	return vars, rows
 
-	for l in lines:
-		if isAway(population, l, min_distance, min_dif,num_calculated):
-			population.append(l)
-			if len(population) == np:
-				break
-	return vars, population
+def selectDiverse(rows, np, min_distance, min_dif, num_calculated):
+	"""Up to np of the best rows, each at a distance of at least min_distance from
+	the others. The best row of the log is always taken, then the rows in order
+	of their scores (ties by the parameters) if they are away from all taken ones.
+	The calculated columns at the end of the rows are not compared."""
+	if numpy is None:
+		rows.sort()
+		population = []
+		for l in rows:
+			if isAway(population, l, min_distance, min_dif,num_calculated):
+				population.append(l)
+				if len(population) == np:
+					break
+		return population
+	if not len(rows):
+		return []
+	params = slice(1, rows.shape[1]-num_calculated)
+	order = numpy.lexsort(rows.T[::-1])
+	selected = []
+	taken = rows[0:0, params]
+	block = 1024
+	for b in range(0, len(order), block):
+		candidates = order[b:b+block]
+		c = rows[candidates, params]
+		if len(taken):
+			#the candidates of the block close to a taken row, most of them late in a run
+			ac = numpy.abs(c)[:,None,:]
+			at = numpy.abs(taken)[None,:,:]
+			d = (numpy.abs(c[:,None,:]-taken[None,:,:]) > min_dif*numpy.maximum(ac, at)).sum(axis=2)
+			away = (d >= min_distance).all(axis=1)
+			candidates, c = candidates[away], c[away]
+		#the rest are checked in order, each against the rows taken before it
+		for j in range(len(candidates)):
+			if len(taken):
+				d = (numpy.abs(taken-c[j]) > min_dif*numpy.maximum(numpy.abs(taken), numpy.abs(c[j]))).sum(axis=1)
+				if (d < min_distance).any(): continue
+			taken = numpy.vstack([taken, c[j]])
+			selected.append(candidates[j])
+			if len(selected) == np:
+				return rows[selected].tolist()
+	return rows[selected].tolist()
 
+def parseLogFile(filename, np, min_distance, min_dif,num_calculated):
+	vars, rows = lastRunRows(filename)
+	if vars is None:
+		return ()
+	return vars, selectDiverse(rows, np, min_distance, min_dif, num_calculated)
 
 
 
@@ -0,0 +1,123 @@
+from __future__ import division
+import random
+from nec.print_out import printOut
+
+
+def evaluate_many(evaluator, vectors, ids):
+    if hasattr(evaluator, "targetMany"):
+        return list(map(float, evaluator.targetMany(vectors, ids)))
+    return [float(evaluator.target(vectors[i], ids[i])) for i in range(len(vectors))]
+
+
+def orthogonal_directions(n):
+    # the 2n columns +-h of a random Householder matrix H = I - 2vv'/v'v
+    # (OrthoMADS), so the poll directions get dense as the mesh is refined
+    v = [random.gauss(0, 1) for i in range(n)]
+    vv = sum(t*t for t in v)
+    if vv == 0:
+        v = n*[1.0]
+        vv = float(n)
+    dirs = []
+    for j in range(n):
+        h = [(1.0 if i == j else 0.0) - 2*v[i]*v[j]/vv for i in range(n)]
+        dirs.append(h)
+        dirs.append([-t for t in h])
+    return dirs
+
+
+def mads(evaluator, xtol=1e-4, maxfun=None, initial_step=.1, parallel=1,
+         full_output=0, disp=1, callback=None):
+    """Minimize with mesh adaptive direct search.
+
+    The search runs in coordinates normalized to evaluator.domain. Every
+    iteration polls the 2N directions of a random orthonormal basis with the
+    current poll size, evaluating `parallel` points at once through
+    evaluator.targetMany and stopping the poll as soon as a batch improves on
+    the incumbent. The direction of the last success is polled first and
+    the poll size is doubled on success and halved on failure. Poll points
+    outside the domain are clamped onto it. The search stops when the poll
+    size drops below xtol or after maxfun evaluations.
+    """
+    domain = evaluator.domain
+    n = len(domain)
+    if maxfun is None:
+        maxfun = n * 200
+    parallel = max(1, parallel)
+
+    def to_domain(y):
+        return [domain[i][0]+y[i]*(domain[i][1]-domain[i][0]) for i in range(n)]
+
+    def from_domain(x):
+        return [(x[i]-domain[i][0])/(domain[i][1]-domain[i][0]) if domain[i][1] > domain[i][0] else .5 for i in range(n)]
+
+    fcalls = [0]
+    cache = {}
+    def evaluate(ys):
+        # points already evaluated (clamping often maps several polls onto one) are not rerun
+        keys = [tuple(round(t, 12) for t in y) for y in ys]
+        todo = []
+        for k in range(len(ys)):
+            if keys[k] not in cache and keys[k] not in [keys[j] for j in todo]:
+                todo.append(k)
+        if todo:
+            scores = evaluate_many(evaluator, [to_domain(ys[k]) for k in todo], ["m%d"%k for k in range(len(todo))])
+            fcalls[0] += len(todo)
+            for j in range(len(todo)):
+                cache[keys[todo[j]]] = scores[j]
+        return [cache[k] for k in keys]
+
+    y = [min(1.0, max(0.0, t)) for t in from_domain(evaluator.x)]
+    fy = evaluate([y])[0]
+    step = initial_step
+    last_direction = None
+    iterations = 0
+
+    while fcalls[0] < maxfun and step >= xtol:
+        iterations += 1
+        dirs = orthogonal_directions(n)
+        if last_direction is not None:
+            dirs.insert(0, last_direction)
+        polls = []
+        for d in dirs:
+            p = [min(1.0, max(0.0, y[i]+step*d[i])) for i in range(n)]
+            if max(abs(p[i]-y[i]) for i in range(n)) > 0:
+                polls.append((p, d))
+
+        success = None
+        for b in range(0, len(polls), parallel):
+            batch = polls[b:b+parallel]
+            scores = evaluate([p for p, d in batch])
+            for k in range(len(batch)):
+                if scores[k] < fy and (success is None or scores[k] < success[0]):
+                    success = (scores[k], batch[k][0], batch[k][1])
+            if success is not None or fcalls[0] >= maxfun:
+                break
+
+        if success is not None:
+            fy, y, last_direction = success
+            step = min(1.0, 2*step)
+        else:
+            last_direction = None
+            step = step/2
+        evaluator.x = to_domain(y)
+        if callback is not None:
+            callback(evaluator.x)
+
+    x = to_domain(y)
+    evaluator.x = x
+    warnflag = 0
+    if fcalls[0] >= maxfun:
+        warnflag = 1
+        if disp:
+            printOut("Warning: Maximum number of function evaluations has "\
+                  "been exceeded.")
+    else:
+        if disp:
+            printOut("Optimization terminated successfully.")
+            printOut("         Current function value: %f" % fy)
+            printOut("         Iterations: %d" % iterations)
+            printOut("         Function evaluations: %d" % fcalls[0])
+
+    if full_output:
+        return x, fy, iterations, fcalls[0], warnflag
+    return x
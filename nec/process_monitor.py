@@ -1,10 +1,61 @@
 from __future__ import division
-from threading import Lock, Thread
+import os, sys, shutil
+from threading import Lock, Thread, Condition
 from time import perf_counter as clock, sleep
 import pdb
 from nec.print_out import printOut
+try:
+	import resource
+except ImportError:
+	resource = None
+
+MB = 1<<20
+
+#sets the limits given as arguments in its own process and executes the engine in it
+LIMIT_LAUNCHER = "import os, sys, resource\nm, c = int(sys.argv[1]), int(sys.argv[2])\nif m: resource.setrlimit(resource.RLIMIT_AS, (m, m))\nif c: resource.setrlimit(resource.RLIMIT_CPU, (c, c))\nos.execvp(sys.argv[3], sys.argv[3:])"
+
+def availableMemory():
+	#MemAvailable of /proc/meminfo in bytes, None where there is none
+	try:
+		f = open("/proc/meminfo", "rt")
+		try:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1])*1024
+		finally:
+			f.close()
+	except (IOError, ValueError, IndexError):
+		pass
+	return None
+
+def waitProcess(popen):
+	#waits for the engine, returns its resource usage where os.wait4 is available
+	if hasattr(os, "wait4"):
+		try:
+			pid, status, usage = os.wait4(popen.pid, 0)
+		except ChildProcessError:
+			popen.wait()
+			return None
+		popen.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+		return usage
+	popen.wait()
+	return None
+
 class ProcessMonitor:
-	def __init__(self, max_run_time = 3600):
+	"""Kills hanging engines, accounts for the CPU time and the peak memory of the
+	engines and keeps the predicted memory of the engines running at once within
+	the memory budget.
+
+	memory_limit and cpu_limit (bytes and seconds, 0 for none) are applied to
+	every engine as RLIMIT_AS and RLIMIT_CPU before the engine is executed, by
+	prlimit(1) or else a python launcher. Where there is no resource module they
+	are ignored. memory_budget is the memory all engines running at once may
+	use, 0 for 80% of the memory available at start and -1 for no budget. The
+	memory of an engine is predicted from the peak RSS of its run with the most
+	segments, scaled by the square of the segments, or before the first run as
+	the size of the complex interaction matrix of its segments.
+	"""
+	def __init__(self, max_run_time = 3600, memory_limit = 0, cpu_limit = 0, memory_budget = -1):
 		self.stop = 0
 		self.lock = Lock()
 		self.thread = None
@@ -13,6 +64,101 @@ class ProcessMonitor:
 		self.max_time = 0
 		self.killed = {}
 		self.max_run_time = max_run_time
+		if (memory_limit or cpu_limit) and resource is None:
+			printOut("The engine memory and CPU limits are not supported on this system, ignored")
+			memory_limit = cpu_limit = 0
+		self.memory_limit = memory_limit
+		self.cpu_limit = cpu_limit
+		self.prlimit = shutil.which("prlimit") if memory_limit or cpu_limit else None
+		if memory_budget == 0:
+			available = availableMemory()
+			memory_budget = int(.8*available) if available else -1
+		self.memory_budget = memory_budget
+		self.memory_cond = Condition(self.lock)
+		self.reserved = 0
+		self.running = 0
+		self.memory_waits = 0
+		#engine: largest peak RSS in bytes
+		self.peak_rss = {}
+		#engine: (segments, peak RSS) of its run with the most segments
+		self.reference_run = {}
+		self.cpu_time = .0
+		self.accounted = 0
+		self.killed_by_limit = 0
+		self.failed_memory_limit = 0
+
+	def command(self, args):
+		#the engine command line setting the limits in the engine process before the engine is
+		#executed. preexec_fn is not safe with several engine threads and a limit set after the
+		#start misses the memory the engine maps at exec
+		if not self.memory_limit and not self.cpu_limit: return args
+		if self.prlimit:
+			limits = []
+			if self.memory_limit: limits.append("--as=%d"%self.memory_limit)
+			if self.cpu_limit: limits.append("--cpu=%d"%self.cpu_limit)
+			return [self.prlimit]+limits+["--"]+args
+		return [sys.executable, "-c", LIMIT_LAUNCHER, str(self.memory_limit), str(self.cpu_limit)]+args
+
+	def predictedMemory(self, engine, segments):
+		with self.lock:
+			if engine in self.reference_run:
+				run_segments, rss = self.reference_run[engine]
+				if segments > run_segments > 0:
+					return int(rss*(segments/run_segments)**2)
+				return rss
+		return 16*segments*segments
+
+	def reserve(self, engine, segments):
+		"""Waits until the predicted memory of the engine fits the budget, returns the
+		amount reserved for release(). An engine always runs when no other is running."""
+		if self.memory_budget < 0: return 0
+		memory = self.predictedMemory(engine, segments)
+		with self.memory_cond:
+			if self.running and self.reserved+memory > self.memory_budget:
+				self.memory_waits += 1
+				while self.running and self.reserved+memory > self.memory_budget:
+					self.memory_cond.wait()
+			self.reserved += memory
+			self.running += 1
+		return memory
+
+	def release(self, memory):
+		if self.memory_budget < 0: return
+		with self.memory_cond:
+			self.reserved -= memory
+			self.running -= 1
+			self.memory_cond.notify_all()
+
+	def account(self, engine, usage, returncode, segments=0):
+		if usage is None: return
+		with self.lock:
+			self.accounted += 1
+			self.cpu_time += usage.ru_utime+usage.ru_stime
+			#kilobytes on linux, bytes on mac os
+			rss = usage.ru_maxrss*(1 if os.uname()[0] == "Darwin" else 1024)
+			self.peak_rss[engine] = max(rss, self.peak_rss.get(engine, 0))
+			if not returncode:
+				reference = self.reference_run.get(engine)
+				if reference is None or (segments, rss) > reference:
+					self.reference_run[engine] = (segments, rss)
+			elif self.cpu_limit and returncode < 0 and usage.ru_utime+usage.ru_stime >= .9*self.cpu_limit:
+				#killed at the limit, the kernel checks it at clock ticks
+				self.killed_by_limit += 1
+			elif self.memory_limit:
+				#an allocation refused by RLIMIT_AS (ENOMEM), at exec or later, fails the engine
+				self.failed_memory_limit += 1
+
+	def status(self):
+		with self.lock:
+			if not self.accounted: return None
+			s = "Engines: %d runs, CPU time %.1f sec., peak RSS %s"%(self.accounted, self.cpu_time, ", ".join(["%s %.1f MB"%(os.path.basename(e), r/MB) for e, r in sorted(self.peak_rss.items())]))
+			if self.memory_waits:
+				s += ", %d waits for memory"%self.memory_waits
+			if self.killed_by_limit:
+				s += ", %d killed by the CPU limit"%self.killed_by_limit
+			if self.failed_memory_limit:
+				s += ", %d failed under the memory limit"%self.failed_memory_limit
+			return s
 	def addProcess(self, process):
 		try:
 			self.lock.acquire()
@@ -201,3 +201,138 @@ def fmin(evaluator, xtol=1e-4, ftol=1e-4, maxiter=None, maxfun=None,
     return retlist
 
 
+def wrap_function_many(evaluator):
+    ncalls = [0]
+    def function_wrapper(xs):
+        ncalls[0] += len(xs)
+        ids = ["s%d"%i for i in range(len(xs))]
+        if hasattr(evaluator, "targetMany"):
+            res = evaluator.targetMany(xs, ids)
+        else:
+            res = [evaluator.target(xs[i], ids[i]) for i in range(len(xs))]
+        return list(map(float, res))
+    return ncalls, function_wrapper
+
+
+def fmin_parallel(evaluator, xtol=1e-4, ftol=1e-4, maxiter=None, maxfun=None,
+         full_output=0, disp=1, callback=None):
+    """Speculative parallel variant of fmin.
+
+    Each iteration evaluates the reflection, expansion, outside and inside
+    contraction points in one call to evaluator.targetMany and then follows
+    the same decisions as fmin. The initial simplex vertices and the shrink
+    step are evaluated concurrently as well. The arguments and return values
+    are the same as for fmin; maxfun counts all evaluated points including
+    the speculative ones.
+    """
+    fcalls, funcs = wrap_function_many(evaluator)
+    x0 = evaluator.x
+    N = len(x0)
+    if maxiter is None:
+        maxiter = N * 200
+    if maxfun is None:
+        maxfun = N * 200
+
+    rho = 1; chi = 2; psi = 0.5; sigma = 0.5;
+
+    nonzdelt = 0.05
+    zdelt = 0.00025
+    sim = [list(x0)]
+    for k in range(0,N):
+        y = list(x0)
+        if y[k] != 0:
+            y[k] = (1+nonzdelt)*y[k]
+        else:
+            y[k] = zdelt
+        sim.append(y)
+    fsim = funcs(sim)
+
+    ind = sort_permutation(fsim)
+    fsim = apply_permutation(fsim,ind)
+    sim = apply_permutation(sim,ind)
+    evaluator.x = sim[0]
+
+    iterations = 1
+
+    while (fcalls[0] < maxfun and iterations < maxiter):
+        sim_size = max(map(lambda x : max(map(abs,map(operator.sub, x, sim[0]))),sim[1:]))
+        fsim_size = max( map(lambda x: abs(x-fsim[0]), fsim[1:]))
+        if ( sim_size <= xtol ) \
+           and fsim_size <=ftol:
+           break
+
+        xbar = averageArrays(sim[:-1])
+        xr = linearCombine((1+rho),xbar, - rho,sim[-1])
+        xe = linearCombine((1+rho*chi),xbar, - rho*chi,sim[-1])
+        xc = linearCombine((1+psi*rho),xbar, - psi*rho,sim[-1])
+        xcc = linearCombine((1-psi),xbar,  psi,sim[-1])
+        fxr, fxe, fxc, fxcc = funcs([xr, xe, xc, xcc])
+        doshrink = 0
+
+        if fxr < fsim[0]:
+            if fxe < fxr:
+                sim[-1] = xe
+                fsim[-1] = fxe
+            else:
+                sim[-1] = xr
+                fsim[-1] = fxr
+        else: # fsim[0] <= fxr
+            if fxr < fsim[-2]:
+                sim[-1] = xr
+                fsim[-1] = fxr
+            else: # fxr >= fsim[-2]
+                # Perform contraction
+                if fxr < fsim[-1]:
+                    if fxc <= fxr:
+                        sim[-1] = xc
+                        fsim[-1] = fxc
+                    else:
+                        doshrink=1
+                else:
+                    # Perform an inside contraction
+                    if fxcc < fsim[-1]:
+                        sim[-1] = xcc
+                        fsim[-1] = fxcc
+                    else:
+                        doshrink = 1
+
+                if doshrink:
+                    for j in range(1,N+1):
+                        sim[j] = linearCombine((1-sigma),sim[0] , sigma,sim[j])
+                    fsim[1:] = funcs(sim[1:])
+
+        ind = sort_permutation(fsim)
+        sim = apply_permutation(sim,ind)
+        fsim = apply_permutation(fsim,ind)
+        evaluator.x = sim[0]
+        if callback is not None:
+            callback(sim[0])
+        iterations += 1
+
+    x = sim[0]
+    fval = min(fsim)
+    warnflag = 0
+
+    if fcalls[0] >= maxfun:
+        warnflag = 1
+        if disp:
+            printOut("Warning: Maximum number of function evaluations has "\
+                  "been exceeded.")
+    elif iterations >= maxiter:
+        warnflag = 2
+        if disp:
+            printOut("Warning: Maximum number of iterations has been exceeded")
+    else:
+        if disp:
+            printOut("Optimization terminated successfully.")
+            printOut("         Current function value: %f" % fval)
+            printOut("         Iterations: %d" % iterations)
+            printOut("         Function evaluations: %d" % fcalls[0])
+
+
+    if full_output:
+        retlist = x, fval, iterations, fcalls[0], warnflag
+    else:
+        retlist = x
+
+    return retlist
@@ -0,0 +1,138 @@
+from __future__ import division
+import math, random
+
+# Cheap regression models trained on every (vector, score) pair the optimizer
+# has paid an engine run for. Used to pre-screen DE trial vectors so that
+# candidates which are unlikely to beat their parent never reach the engine.
+
+def solveLinear(a, b):
+	n = len(b)
+	m = [list(a[i])+[b[i]] for i in range(n)]
+	for c in range(n):
+		p = max(range(c, n), key=lambda r: abs(m[r][c]))
+		if abs(m[p][c]) < 1e-12:
+			raise ZeroDivisionError("singular system")
+		m[c], m[p] = m[p], m[c]
+		for r in range(c+1, n):
+			f = m[r][c]/m[c][c]
+			if f:
+				for k in range(c, n+1):
+					m[r][k] -= f*m[c][k]
+	x = [0.0]*n
+	for r in range(n-1, -1, -1):
+		s = m[r][n]
+		for k in range(r+1, n):
+			s -= m[r][k]*x[k]
+		x[r] = s/m[r][r]
+	return x
+
+class Surrogate:
+	def __init__(self, domain, kind="knn", neighbors=0, recheck=.1, confidence=1.0, min_samples=0, max_samples=2000, seed=None):
+		if kind not in ("knn", "rbf"):
+			raise ValueError("Unknown surrogate model '%s'"%kind)
+		self.kind = kind
+		self.offset = [d[0] for d in domain]
+		self.scale = [1.0/(d[1]-d[0]) if d[1] > d[0] else 1.0 for d in domain]
+		n = len(domain)
+		self.neighbors = neighbors if neighbors > 0 else max(5, 2*n+1)
+		self.recheck = recheck
+		#the recheck draws leave the optimizer's random sequence alone
+		self.random = random.Random(seed)
+		self.confidence = confidence
+		self.min_samples = min_samples if min_samples > 0 else max(20, 5*n)
+		self.max_samples = max_samples
+		self.samples = []
+		self.scores = []
+		self.screened = 0
+		self.skipped = 0
+		self.rechecked = 0
+		self.false_rejects = 0
+
+	def normalize(self, vector):
+		return [(vector[i]-self.offset[i])*self.scale[i] for i in range(len(vector))]
+
+	def add(self, vector, score):
+		score = float(score)
+		if score >= 1000: return
+		self.samples.append(self.normalize(vector))
+		self.scores.append(score)
+		if len(self.samples) > self.max_samples:
+			del self.samples[0]
+			del self.scores[0]
+
+	def nearest(self, x):
+		d = []
+		for i in range(len(self.samples)):
+			s = self.samples[i]
+			dist = 0.0
+			for j in range(len(x)):
+				t = s[j]-x[j]
+				dist += t*t
+			d.append((dist, i))
+		d.sort()
+		return d[0:self.neighbors]
+
+	def predict(self, vector):
+		"""Returns (predicted score, spread) or None while there is not enough data."""
+		if len(self.samples) < self.min_samples:
+			return None
+		x = self.normalize(vector)
+		near = self.nearest(x)
+		ys = [self.scores[i] for d, i in near]
+		if near[0][0] < 1e-18:
+			return (ys[0], 0.0)
+		w = [1.0/d for d, i in near]
+		tw = sum(w)
+		mean = sum(w[k]*ys[k] for k in range(len(ys)))/tw
+		spread = math.sqrt(max(0.0, sum(w[k]*(ys[k]-mean)**2 for k in range(len(ys)))/tw))
+		if self.kind == "rbf":
+			try:
+				mean = self.rbf(x, near, ys)
+			except (ZeroDivisionError, OverflowError):
+				pass
+		return (mean, spread)
+
+	def rbf(self, x, near, ys):
+		#cubic radial basis on the neighbourhood with a constant tail
+		pts = [self.samples[i] for d, i in near]
+		n = len(pts)
+		a = []
+		for p in pts:
+			row = []
+			for q in pts:
+				r = math.sqrt(sum((p[j]-q[j])**2 for j in range(len(x))))
+				row.append(r*r*r)
+			row.append(1.0)
+			a.append(row)
+		a.append([1.0]*n+[0.0])
+		c = solveLinear(a, ys+[0.0])
+		res = c[n]
+		for k in range(n):
+			r = math.sqrt(sum((pts[k][j]-x[j])**2 for j in range(len(x))))
+			res += c[k]*r*r*r
+		return res
+
+	def promising(self, vector, score):
+		"""Decides if a trial is worth an engine run against a parent with the given score.
+		Returns (evaluate, rechecking)."""
+		p = self.predict(vector)
+		if p is None:
+			return (1, 0)
+		self.screened += 1
+		mean, spread = p
+		if mean - self.confidence*spread <= float(score):
+			return (1, 0)
+		if self.random.random() < self.recheck:
+			self.rechecked += 1
+			return (1, 1)
+		self.skipped += 1
+		return (0, 0)
+
+	def falseReject(self):
+		#a rechecked trial improved on its parent - the model is too pessimistic, widen the band
+		self.false_rejects += 1
+		self.confidence *= 1.1
+
+	def status(self, engine_runs_per_evaluation=1):
+		return "Surrogate(%s): %d samples, %d screened, %d skipped (%d engine runs saved), %d rechecked, %d false rejects"%(
+			self.kind, len(self.samples), self.screened, self.skipped, self.skipped*engine_runs_per_evaluation, self.rechecked, self.false_rejects)
@@ -0,0 +1,170 @@
+from __future__ import division
+import math, json
+from threading import Lock, current_thread
+from time import perf_counter as clock
+
+# Per-phase timing of the evaluations (--timing). The evaluator threads add the
+# duration of every deck generation, geometry validation, engine run, output
+# parse, target function evaluation and log write to a Timing object. Every
+# generation the optimizer prints the time spent in each phase since the
+# previous one; at exit the histograms of the durations are written to the log.
+# The deck phase includes the geometry validation.
+#
+# With --trace FILE every phase is also written to FILE as a Chrome trace event
+# (chrome://tracing, ui.perfetto.dev) on the track of the thread it ran in,
+# with a marker at the end of every generation. The engine events name the
+# deck the engine ran, .agt for the average gain test passes. The file is a
+# valid JSON array once closed and readable by the viewers before that.
+
+PHASES = ("deck", "geometry", "engine", "parse", "target", "log")
+BUCKETS = 32
+
+def formatDuration(t):
+	if t < 1e-3: return "%.0fus"%(t*1e6)
+	if t < 1: return "%.1fms"%(t*1e3)
+	return "%.2fs"%t
+
+
+class Phase:
+	def __init__(self, timing, name, detail):
+		self.timing = timing
+		self.name = name
+		self.detail = detail
+	def __enter__(self):
+		self.start = clock()
+		return self
+	def __exit__(self, *exc):
+		self.timing.add(self.name, clock()-self.start, self.start, self.detail)
+		return False
+
+class NoPhase:
+	def __enter__(self):
+		return self
+	def __exit__(self, *exc):
+		return False
+
+NO_PHASE = NoPhase()
+
+
+class Timing:
+	def __init__(self, enabled=0, trace=""):
+		self.enabled = enabled or trace
+		self.lock = Lock()
+		self.trace = None
+		if trace:
+			self.trace = open(trace, "wt")
+			self.trace.write("[")
+			self.trace_separator = "\n"
+			#thread ident: trace track
+			self.tracks = {}
+		#name: [count, total, max, histogram of log2 microseconds]
+		self.phases = {}
+		self.evaluations = 0
+		self.start = clock()
+		self.interval_start = self.start
+		self.interval = {}
+		self.interval_evaluations = 0
+
+	def phase(self, name, detail=None):
+		#with timing.phase("engine"): ...
+		if not self.enabled: return NO_PHASE
+		return Phase(self, name, detail)
+
+	def add(self, name, seconds, start=None, detail=None):
+		if not self.enabled: return
+		if self.trace:
+			if start is None:
+				start = clock()-seconds
+			event = {"name":name, "ph":"X", "ts":round((start-self.start)*1e6, 1), "dur":round(seconds*1e6, 1)}
+			if detail is not None:
+				event["args"] = {"detail":detail}
+			self.traceEvent(event)
+		b = min(BUCKETS-1, max(0, int(math.log(max(seconds, 1e-6)*1e6, 2))))
+		with self.lock:
+			p = self.phases.get(name)
+			if p is None:
+				p = self.phases[name] = [0, .0, .0, BUCKETS*[0]]
+			p[0] += 1
+			p[1] += seconds
+			p[2] = max(p[2], seconds)
+			p[3][b] += 1
+			i = self.interval.get(name)
+			if i is None:
+				self.interval[name] = [1, seconds]
+			else:
+				i[0] += 1
+				i[1] += seconds
+
+	def traceEvent(self, event):
+		thread = current_thread()
+		with self.lock:
+			if self.trace is None: return
+			track = self.tracks.get(thread.ident)
+			if track is None:
+				track = self.tracks[thread.ident] = len(self.tracks)+1
+				self.writeEvent({"name":"thread_name", "ph":"M", "pid":1, "tid":track, "args":{"name":thread.name}})
+			event["pid"] = 1
+			event["tid"] = track
+			self.writeEvent(event)
+
+	def writeEvent(self, event):
+		self.trace.write(self.trace_separator+json.dumps(event))
+		self.trace_separator = ",\n"
+
+	def mark(self, name):
+		#a generation boundary on all tracks of the trace
+		if not self.trace: return
+		self.traceEvent({"name":name, "ph":"i", "s":"g", "ts":round((clock()-self.start)*1e6, 1)})
+		with self.lock:
+			if self.trace: self.trace.flush()
+
+	def close(self):
+		with self.lock:
+			if self.trace is None: return
+			self.trace.write("\n]\n")
+			self.trace.close()
+			self.trace = None
+
+	def evaluation(self):
+		if not self.enabled: return
+		with self.lock:
+			self.evaluations += 1
+			self.interval_evaluations += 1
+
+	def names(self, phases):
+		return [n for n in PHASES if n in phases]+sorted([n for n in phases if n not in PHASES])
+
+	def status(self, slots):
+		"""The phases since the previous call, slots is the number of engines which can run at once.
+		None if nothing was evaluated since then."""
+		with self.lock:
+			now = clock()
+			wall = max(now-self.interval_start, 1e-9)
+			interval, evaluations = self.interval, self.interval_evaluations
+			self.interval, self.interval_evaluations = {}, 0
+			self.interval_start = now
+		if not evaluations:
+			return None
+		engine = interval.get("engine", [0, .0])[1]
+		s = "Timing: %.2f evaluations/s, engines busy %.0f%% of %d slots;"%(evaluations/wall, 100*engine/(wall*max(1, slots)), slots)
+		for n in self.names(interval):
+			count, total = interval[n]
+			s += " %s %s (%d x %s)"%(n, formatDuration(total), count, formatDuration(total/count))
+		return s
+
+	def histogram(self):
+		"""The duration histograms of the whole run, one list of lines per phase."""
+		with self.lock:
+			phases = dict((n, [p[0], p[1], p[2], list(p[3])]) for n, p in self.phases.items())
+			wall = clock()-self.start
+			evaluations = self.evaluations
+		lines = ["Timing of %d evaluations in %s, %.2f evaluations/s"%(evaluations, formatDuration(wall), evaluations/max(wall, 1e-9))]
+		for n in self.names(phases):
+			count, total, longest, buckets = phases[n]
+			lines.append("%-8s %8d runs, total %s, mean %s, max %s"%(n, count, formatDuration(total), formatDuration(total/count), formatDuration(longest)))
+			for b in range(BUCKETS):
+				if not buckets[b]: continue
+				lo = formatDuration(math.pow(2, b)*1e-6) if b else "0us"
+				hi = formatDuration(math.pow(2, b+1)*1e-6)
+				lines.append("    %8s - %-8s %8d %s"%(lo, hi, buckets[b], "#"*int(math.ceil(40*buckets[b]/count))))
+		return lines
@@ -0,0 +1,284 @@
+from __future__ import division
+import os, sys, json, time, socket, shutil, traceback
+from threading import Lock, Condition, Semaphore
+from nec.print_out import printOut
+from nec import eval as ne
+from nec.timing import Timing
+
+# Remote engine runs.
+# A worker (python -m nec.worker) runs nec engines for a coordinator on
+# another host. The protocol is one JSON object per line in each direction:
+#  {"op": "hello"}                          -> {"capacity": engine slots, "version": 1}
+#  {"op": "run", "engine": e, "deck": text} -> {"output": engine output text} or {"error": message}
+# The coordinator (WorkerPool) is used by NecEvaluator.runEngine when --workers is given.
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 7110
+#engines a worker started without --engine may run on request; never paths
+KNOWN_ENGINES = ("nec2dxs500", "nec2dxs1k5", "nec2dxs3k0", "nec2dxs5k0", "nec2dxs8k0", "nec2dxs11k", "nec2c", "nec2++")
+
+class WorkerError(RuntimeError):
+	pass
+
+class TaskError(WorkerError):
+	#the worker is fine but could not run this engine input
+	pass
+
+def parseAddress(address):
+	address = address.strip()
+	if ":" in address:
+		host, port = address.rsplit(":", 1)
+		return (host, int(port))
+	return (address, DEFAULT_PORT)
+
+class RemoteWorker:
+	def __init__(self, host, port):
+		self.host = host
+		self.port = port
+		self.capacity = 0
+		self.running = 0
+		self.idle = []
+		self.dead_since = None
+		self.tasks = 0
+		self.failures = 0
+		self.errors = 0
+	def __str__(self):
+		return "%s:%d"%(self.host, self.port)
+
+class WorkerPool:
+	def __init__(self, addresses, timeout=3600, retries=3, retry_interval=30, connect_timeout=10):
+		self.workers = [RemoteWorker(*parseAddress(a)) for a in addresses.split(",") if a.strip()]
+		self.timeout = timeout
+		self.retries = retries
+		self.retry_interval = retry_interval
+		self.connect_timeout = connect_timeout
+		self.cond = Condition()
+		for w in self.workers:
+			try:
+				conn = self.connect(w)
+				self.release(w, conn)
+				printOut("Worker %s: %d engine slots"%(str(w), w.capacity))
+			except (OSError, ValueError, WorkerError) as e:
+				self.markDead(w, e)
+
+	def connect(self, worker):
+		sock = socket.create_connection((worker.host, worker.port), self.connect_timeout)
+		sock.settimeout(self.timeout)
+		conn = (sock, sock.makefile("rwb"))
+		if not worker.capacity:
+			reply = self.request(conn, {"op":"hello"})
+			if reply.get("version") != PROTOCOL_VERSION:
+				raise WorkerError("unsupported protocol version %s"%str(reply.get("version")))
+			worker.capacity = max(1, int(reply["capacity"]))
+		return conn
+
+	def request(self, conn, message):
+		sock, f = conn
+		f.write((json.dumps(message)+"\n").encode("utf-8"))
+		f.flush()
+		line = f.readline()
+		if not line:
+			raise ConnectionError("connection closed")
+		return json.loads(line.decode("utf-8"))
+
+	def close(self, conn):
+		try:
+			conn[1].close()
+			conn[0].close()
+		except OSError:
+			pass
+
+	def release(self, worker, conn):
+		with self.cond:
+			worker.idle.append(conn)
+
+	def markDead(self, worker, reason):
+		with self.cond:
+			if worker.dead_since is None:
+				printOut("Lost worker %s (%s)"%(str(worker), str(reason)))
+			worker.dead_since = time.time()
+			worker.failures += 1
+			idle = worker.idle
+			worker.idle = []
+		for conn in idle:
+			self.close(conn)
+
+	def acquire(self):
+		#the free worker with the lowest load relative to its capacity, None when no worker is alive.
+		#a worker unreachable at startup has no known capacity yet, it is retried with one slot
+		with self.cond:
+			while True:
+				now = time.time()
+				alive = [w for w in self.workers if w.dead_since is None or now-w.dead_since > self.retry_interval]
+				if not alive:
+					return None
+				free = [w for w in alive if w.running < max(1, w.capacity)]
+				if free:
+					w = min(free, key=lambda w: (w.running+1)/max(1, w.capacity))
+					w.running += 1
+					return w
+				self.cond.wait(1)
+
+	def run(self, engine, deck, phase=None):
+		"""Runs the engine on a worker and returns its output text, or None if no worker could run it.
+		phase, a context manager like Timing.phase(), times every request to a worker."""
+		for attempt in range(self.retries+1):
+			w = self.acquire()
+			if w is None:
+				return None
+			conn = None
+			try:
+				with self.cond:
+					conn = w.idle.pop() if w.idle else None
+				if conn is None:
+					conn = self.connect(w)
+				if phase is None:
+					reply = self.request(conn, {"op":"run", "engine":engine, "deck":deck})
+				else:
+					with phase:
+						reply = self.request(conn, {"op":"run", "engine":engine, "deck":deck})
+				self.release(w, conn)
+				conn = None
+				with self.cond:
+					w.dead_since = None
+					w.tasks += 1
+				if "error" in reply:
+					raise TaskError("worker %s: %s"%(str(w), reply["error"]))
+				return reply["output"]
+			except TaskError as e:
+				#retried, on another worker if there is one, and run locally when the retries are spent
+				with self.cond:
+					w.errors += 1
+				if attempt == self.retries:
+					printOut(str(e))
+			except (OSError, ValueError, KeyError, WorkerError) as e:
+				if conn is not None:
+					self.close(conn)
+				self.markDead(w, e)
+			finally:
+				with self.cond:
+					w.running -= 1
+					self.cond.notify_all()
+		return None
+
+	def slots(self):
+		#the engines the workers run at once, one for a worker not reached yet
+		return sum([max(1, w.capacity) for w in self.workers])
+
+	def status(self):
+		return ", ".join(["%s: %d tasks%s%s"%(str(w), w.tasks, ", %d errors"%w.errors if w.errors else "", " (lost)" if w.dead_since is not None else "") for w in self.workers])
+
+
+class EngineRunner(ne.NecEvaluator):
+	#only the engine invocation of NecEvaluator
+	def __init__(self, options):
+		from nec.process_monitor import ProcessMonitor, MB
+		self.options = options
+		self.nec_file_input = None
+		self.workers = None
+		self.engine_archive = None
+		self.timing = Timing()
+		self.process_monitor = ProcessMonitor(options.engine_kill_time, options.engine_memory_limit*MB, options.engine_cpu_limit, options.engine_memory_budget*MB if options.engine_memory_budget > 0 else options.engine_memory_budget)
+		if options.engine_takes_cmd_args=='yes' or options.engine_takes_cmd_args=='auto' and os.name!='nt':
+			self.options.engine_takes_cmd_args = 1
+		else: self.options.engine_takes_cmd_args = 0
+
+try:
+	import socketserver
+except ImportError:
+	import SocketServer as socketserver
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				return
+			try:
+				request = json.loads(line.decode("utf-8"))
+				op = request.get("op")
+				if op == "hello":
+					reply = {"capacity":self.server.capacity, "version":PROTOCOL_VERSION}
+				elif op == "run":
+					reply = {"output":self.server.runTask(request)}
+				else:
+					reply = {"error":"unknown operation %s"%str(op)}
+			except Exception as e:
+				if self.server.options.debug: traceback.print_exc()
+				reply = {"error":str(e)}
+			self.wfile.write((json.dumps(reply)+"\n").encode("utf-8"))
+			self.wfile.flush()
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, options):
+		socketserver.TCPServer.__init__(self, address, WorkerHandler)
+		self.options = options
+		self.capacity = max(1, options.num_cores)
+		self.slots = Semaphore(self.capacity)
+		self.runner = EngineRunner(options)
+		self.lock = Lock()
+		self.count = 0
+
+	def engine(self, requested):
+		if self.options.engine:
+			return self.options.engine
+		if requested in KNOWN_ENGINES:
+			return requested
+		raise WorkerError("engine '%s' is not allowed, start the worker with --engine"%requested)
+
+	def runTask(self, request):
+		engine = self.engine(request.get("engine", ""))
+		with self.slots:
+			with self.lock:
+				self.count += 1
+				wd = os.path.join(self.options.output, "task%d"%self.count)
+			os.makedirs(wd)
+			try:
+				f = open(os.path.join(wd, "nec2.inp"), "wt")
+				try: f.write(request["deck"])
+				finally: f.close()
+				self.runner.runLocalEngine(engine, "nec2.inp", "nec2.out", os.path.join(wd, "nec2.cin"), wd)
+				try:
+					f = open(os.path.join(wd, "nec2.out"), "rt")
+				except IOError:
+					raise WorkerError("the engine produced no output")
+				try: return f.read()
+				finally: f.close()
+			finally:
+				shutil.rmtree(wd, True)
+
+
+def main():
+	import optparse
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--host", default="localhost", help="address to listen on, use 0.0.0.0 to accept coordinators from other hosts. The default is %default")
+	parser.add_option("-p", "--port", default=DEFAULT_PORT, type="int", help="port to listen on (0 picks a free one). The default is %default")
+	parser.add_option("-n", "--num-cores", type="int", default=ne.ncores, help="number of engines run at once. The default is %default")
+	parser.add_option("-e", "--engine", metavar="NEC_ENGINE", default="", help="nec engine used for all tasks. By default the engine requested by the coordinator is used if it is one of "+", ".join(KNOWN_ENGINES))
+	parser.add_option("--engine-takes-cmd-args", default="auto", type="string", help="the nec engine takes command args, default=auto (which means no on windows yes otherwise). Other options are 'yes' or 'no'.")
+	parser.add_option("--engine-kill-time", type="int", default=3600, help="Maximum time the nec engine is allowed to run before it is considered hanging and killed. The default is %default")
+	parser.add_option("--engine-memory-limit", type="int", default=0, metavar="MB", help="address space limit of every engine process in MB, 0 for none. The default is %default")
+	parser.add_option("--engine-cpu-limit", type="int", default=0, metavar="SECONDS", help="CPU time limit of every engine process, 0 for none. The default is %default")
+	parser.add_option("--engine-memory-budget", type="int", default=-1, metavar="MB", help="memory in MB the engines running at once may use, 0 for 80 percent of the available memory, -1 for no limit. The default is %default")
+	parser.add_option("-o", "--output-dir", dest="output", default="worker_output", metavar="DIR", help="scratch directory for the engine runs. The default is %default")
+	parser.add_option("--debug", default=0, type="int", help="turn on some logging")
+	options, args = parser.parse_args()
+	try:
+		os.makedirs(options.output)
+	except OSError: pass
+	server = WorkerServer((options.host, options.port), options)
+	printOut("nec worker listening on %s:%d with %d engine slots"%(server.server_address[0], server.server_address[1], server.capacity))
+	sys.stdout.flush()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		server.runner.process_monitor.join()
+
+if __name__ == "__main__":
+	main()